@@ -4,10 +4,13 @@ from rdflib.Namespace import Namespace as NS
 import glob
 from twisted.python.util import sibpath
 import os
+import hashlib
 from rdflib import URIRef
 
 from twisted.plugin import getPlugins
 from playtools.interfaces import ICharSheetSection
+from playtools.snapshot import SnapshotGraph, writeSnapshot
+from playtools.util import userCacheDir
 
 rdfs = NS('http://www.w3.org/2000/01/rdf-schema#')
 rdf = NS("http://www.w3.org/1999/02/22-rdf-syntax-ns#")
@@ -26,19 +29,63 @@ def showCharSheet(section, graph, ns):
         traceback.print_exc()
         print 'Not printing', section, 'because', e
 
-def main(filename, name):
-    all_sections = getCharSheetSections()
+def dataFiles():
+    return [f for f in glob.glob(os.path.join(sibpath(__file__, 'data'),
+        '*.n3')) if not f.endswith('monster.n3')]
 
-    charactersheet = NS('http://trinket.thorne.id.au/2007/%s.n3#' % name)
-    character = URIRef(charactersheet + name)
+def dataSnapshotPath(files):
+    """
+    Where the snapshot of files is kept, in the user's cache directory.  It
+    is named for the paths, mtimes and sizes of the files, so changing,
+    adding or removing any of them makes it a different snapshot.
+    """
+    key = hashlib.md5()
+    for f in sorted(files):
+        st = os.stat(f)
+        key.update('%s\0%s\0%s\0' % (os.path.abspath(f), st.st_mtime,
+            st.st_size))
+    return os.path.join(userCacheDir(),
+            'charsheet-data-%s.snapshot' % (key.hexdigest(),))
+
+def loadDataGraph():
+    """
+    A graph of the data/*.n3 files, from a snapshot of them when there is an
+    up-to-date one.  Otherwise parse them, and if they all loaded, try to
+    leave a snapshot for the next run in place of any older one.
+    """
+    files = dataFiles()
+    path = dataSnapshotPath(files)
+    if os.path.exists(path):
+        return SnapshotGraph(path)
 
     graph = ConjunctiveGraph()
-    for f in glob.glob(os.path.join(sibpath(__file__, 'data'), '*.n3')):
-        if f.endswith('monster.n3'):
-            continue
+    failed = False
+    for f in files:
         try: graph.load(f, format='n3')
         except Exception, e:
             print 'Could not load', f, 'because', e
+            failed = True
+    if failed:
+        return graph
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        writeSnapshot(graph, path)
+        for old in glob.glob(os.path.join(os.path.dirname(path),
+                'charsheet-data-*.snapshot')):
+            if old != path:
+                os.remove(old)
+    except EnvironmentError:
+        pass
+    return graph
+
+def main(filename, name):
+    all_sections = getCharSheetSections()
+
+    charactersheet = NS('http://trinket.thorne.id.au/2007/%s.n3#' % name)
+    character = URIRef(charactersheet + name)
+
+    graph = loadDataGraph()
     graph.load(rdfs)
     graph.load(rdf)
 
@@ -0,0 +1,162 @@
+"""
+In-memory autocompletion of fact names
+
+A CompletionIndex holds the normalized name (see search.makeAltName) of every
+fact in a game system in two sorted arrays: one of whole names, and one of
+the words within names, each paired with the rest of the name after it.  A
+prefix lookup is then a binary search and a short scan.  Names that cannot be
+completed by prefix, because of a typo, are found through a trigram index.
+"""
+from bisect import bisect_left
+
+from playtools.search import makeAltName
+
+
+def trigrams(key):
+    """
+    The set of 3-character substrings of key, padded so that short keys and
+    word boundaries contribute trigrams too
+    """
+    padded = u'  %s ' % (key,)
+    return set(padded[i:i+3] for i in xrange(len(padded) - 2))
+
+
+class CompletionIndex(object):
+    """
+    Autocomplete structure over the (uri, name) of many facts
+    """
+    minSimilarity = 0.3
+
+    def __init__(self):
+        self.entries = []
+        self.names = []
+        self.words = []
+        self.trigrams = {}
+        self._gramCounts = {}
+        self._keys = set()
+
+    def add(self, uri, name, altnames=()):
+        """
+        Make the fact at uri completable by name, and by each of altnames
+        """
+        n = len(self.entries)
+        self.entries.append((uri, name))
+        for altname in (name,) + tuple(altnames):
+            key = makeAltName(altname)
+            if not key or (key, n) in self._keys:
+                continue
+            self._keys.add((key, n))
+            self.names.append((key, n))
+            split = key.split()
+            for i in range(1, len(split)):
+                self.words.append((u' '.join(split[i:]), n))
+            grams = trigrams(key)
+            self._gramCounts[key] = len(grams)
+            for gram in grams:
+                self.trigrams.setdefault(gram, set()).add(key)
+        return n
+
+    def addCollection(self, domain, collection):
+        """
+        Add every fact in collection, with uris in the domain/uri form used by
+        the search indexes
+        """
+        for uri, title, altnames in collection.names():
+            self.add(u'%s/%s' % (domain, uri), title, altnames)
+
+    def freeze(self):
+        """
+        Sort the arrays, after which the index can be searched
+        """
+        self.names.sort()
+        self.words.sort()
+        self._byKey = {}
+        for key, n in self.names:
+            self._byKey.setdefault(key, []).append(n)
+        self._keys = None
+
+    def _prefixScan(self, array, key, found, max):
+        """
+        Add entries whose key in array starts with key to found, in order,
+        until there are max of them
+        """
+        i = bisect_left(array, (key,))
+        while i < len(array) and len(found) < max:
+            k, n = array[i]
+            if not k.startswith(key):
+                break
+            if n not in found:
+                found.append(n)
+            i = i + 1
+
+    def _similar(self, key, found, max):
+        """
+        Add entries whose names share enough trigrams with key to found, most
+        similar first, until there are max of them
+        """
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for k in self.trigrams.get(gram, ()):
+                shared[k] = shared.get(k, 0) + 1
+        scored = []
+        for k, count in shared.iteritems():
+            score = float(count) / (len(grams) + self._gramCounts[k] - count)
+            if score >= self.minSimilarity:
+                scored.append((-score, k))
+        for _, k in sorted(scored):
+            for n in self._byKey[k]:
+                if len(found) >= max:
+                    return
+                if n not in found:
+                    found.append(n)
+
+    def complete(self, text, max=10):
+        """
+        Return up to max (uri, name) pairs completing text: names that start
+        with it, then names with a word that starts with it.  If there are
+        none, names that look like it.
+        """
+        key = makeAltName(text)
+        if not key:
+            return []
+        found = []
+        self._prefixScan(self.names, key, found, max)
+        self._prefixScan(self.words, key, found, max)
+        if not found:
+            self._similar(key, found, max)
+        return [self.entries[n] for n in found]
+
+
+def buildIndex(system):
+    """
+    A frozen CompletionIndex over every collection in system
+    """
+    index = CompletionIndex()
+    for domain, collection in sorted(system.facts.items()):
+        index.addCollection(domain, collection)
+    index.freeze()
+    return index
+
+
+_indexes = {}
+
+def completionIndex(system):
+    """
+    The CompletionIndex for system, built the first time it is needed and
+    again whenever system.dataVersion() changes
+    """
+    version = system.dataVersion()
+    index, built = _indexes.get(system.name, (None, None))
+    if index is None or built != version:
+        index = buildIndex(system)
+        _indexes[system.name] = (index, version)
+    return index
+
+
+def complete(system, text, max=10):
+    """
+    Return up to max (uri, name) pairs for facts in system whose names
+    complete text
+    """
+    return completionIndex(system).complete(text, max)
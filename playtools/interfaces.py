@@ -18,6 +18,17 @@ class IRuleSystem(Interface):
     name = Attribute("name")
     searchIndexPath = Attribute("searchIndexPath")
 
+    def completions(text, max=10):
+        """
+        Up to max (uri, name) pairs of facts whose names complete text
+        """
+
+    def dataVersion():
+        """
+        A value that changes whenever the facts of the system may have
+        changed, so anything built from them must be rebuilt
+        """
+
 
 class IRuleCollection(Interface):
     """
@@ -37,11 +48,35 @@ class IRuleCollection(Interface):
         Get a single IRuleFact that is uniquely identified by idOrName
         """
 
+    def lookupMany(keys):
+        """
+        Look up each of keys like lookup, in one round trip to the
+        database.  Returns a list in the same order as keys, with None for
+        each key that was not found.
+        """
+
     def dump():
         """
         All the RuleFacts this collection can find
         """
 
+    def iterate(batchSize=100):
+        """
+        Generate all the RuleFacts this collection can find, without loading
+        them all at once: they are fetched batchSize at a time
+        """
+
+    def count():
+        """
+        The number of RuleFacts this collection can find
+        """
+
+    def names():
+        """
+        Generate (uri, title, altnames) for each RuleFact this collection can
+        find, as IIndexable would give them, without loading the RuleFacts
+        """
+
 
 class IRuleFact(Interface):
     """
@@ -54,6 +89,7 @@ class IIndexable(Interface):
     uri = Attribute("uri")
     title = Attribute("title")
     text = Attribute("text")
+    facets = Attribute("facets") # dict of values to filter searches by
 
 
 class IConverter(Interface):
@@ -1,9 +1,12 @@
 """
 The game system based on the D20 SRD (version 3.5)
 """
+import os
 import re
 from xml.dom import minidom
 import inspect
+import threading
+from itertools import islice
 
 from rdflib import Literal
 
@@ -15,9 +18,11 @@ from storm import locals as SL
 
 from playtools.interfaces import (IRuleSystem, IRuleCollection,
     IIndexable, IRuleFact)
-from playtools.util import RESOURCE, gatherText, rdfName
-from playtools import globalRegistry, sparqly as S
-from playtools.search import textFromHtml
+from playtools.util import (RESOURCE, gatherText, rdfName, LRUCache,
+        holdsHandles)
+from playtools import globalRegistry, sparqly as S, complete
+from playtools.search import textFromHtml, makeAltName
+from playtools.parser.misc import parseChallengeRating
 from playtools.common import (FAM, P as PROP, C as CHAR, skillNs as SKILL,
         featNs as FEAT, a, RDFNS)
 from playtools.test.pttestutil import TODO, FIXME
@@ -30,13 +35,20 @@ from rdflib import RDF
 from rdfalchemy import rdfSingle, rdfMultiple, rdfList
 
 
-from d20srd35config import SQLPATH, RDFPATH
+from d20srd35config import SQLPATH, RDFPATH, monsterTablePath
+import d20srd35stats
 
 RDFSNS = S.RDFSNS
 
 DICE = NS('http://goonmill.org/2007/dice.n3#')
 PCCLASS = NS('http://goonmill.org/2007/pcclass.n3#')
 
+# creature sizes, in order, for the numeric "size" search facet
+SIZE_RANKS = dict((s, n) for (n, s) in enumerate(['fine', 'diminutive',
+    'tiny', 'small', 'medium', 'large', 'huge', 'gargantuan', 'colossal',
+    'colossalplus']))
+SIZE_RANKS['colossal+'] = SIZE_RANKS['colossalplus']
+
 
 def loadReferenceURLs():
     """
@@ -62,13 +74,84 @@ class D20SRD35System(object):
     def __init__(self):
         self.facts = {}
 
+    def completions(self, text, max=10):
+        """
+        Up to max (uri, name) pairs of facts whose names complete text
+        """
+        return complete.complete(self, text, max)
+
+    def dataVersion(self):
+        """
+        The generation of the RDF database and the mtime and size of the SQL
+        database
+        """
+        return (RDFDB.generation,) + sqlVersion()
+
+    def monsterTable(self):
+        """
+        The numeric stats of every monster, as a dict of numpy arrays (see
+        d20srd35stats.monsterTable), cached in the user's cache directory
+        until the SQL database changes
+        """
+        return d20srd35stats.monsterTable(STORE, monsterTablePath(),
+                '%s:%s' % sqlVersion())
+
 d20srd35 = D20SRD35System()
 
 
-# the d20srd databases are essentially static and permanent, so just open them here.
-STORE = SL.Store(SL.create_database('sqlite:' + SQLPATH))
-RDFDB = S.TriplesDatabase()
-RDFDB.open(RDFPATH)
+class LazyStore(object):
+    """
+    Stand-in for a Storm store, which opens the database the first time it is
+    used in each thread.  Storm stores must not be shared between threads.
+    """
+    def __init__(self, uri):
+        self.uri = uri
+        self._local = threading.local()
+        holdsHandles(self)
+
+    def getStore(self):
+        """
+        The real Store for this thread
+        """
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = self._local.store = SL.Store(SL.create_database(self.uri))
+        return store
+
+    def isOpen(self):
+        """
+        Whether the store has been opened yet in this thread
+        """
+        return getattr(self._local, 'store', None) is not None
+
+    def forget(self):
+        """
+        Forget the stores opened so far, without closing them, so new ones
+        are opened when next used (see util.afterFork)
+
+        @return what was forgotten
+        """
+        old, self._local = self._local, threading.local()
+        return old
+
+    def __getattr__(self, name):
+        return getattr(self.getStore(), name)
+
+
+# the d20srd databases are essentially static and permanent, but opening them
+# is not free, and plugin discovery imports this module in every command, so
+# they are only opened when something uses them.
+STORE = LazyStore('sqlite:' + SQLPATH)
+RDFDB = S.LazyTriplesDatabase(RDFPATH)
+
+
+def sqlVersion():
+    """
+    The mtime and size of the SQL database, which change when it is
+    rebuilt or written to
+    """
+    st = os.stat(SQLPATH)
+    return (st.st_mtime, st.st_size)
 
 
 
@@ -102,6 +185,7 @@ class IndexableStormFact(object):
         self.text = textFromHtml(_ft)
         self.uri = fact.id
         self.title = fact.name
+        self.facets = fact.facets() if hasattr(fact, 'facets') else {}
 
     @staticmethod
     def repSlash(m):
@@ -128,6 +212,7 @@ class StormFactCollection(object):
         factClass.collection = self
         self.klass = factClass
         self.factName = factName
+        self._index = None
 
     def __getitem__(self, key):
         ret = self.lookup(key)
@@ -141,23 +226,124 @@ class StormFactCollection(object):
         """
         return list(STORE.find(self.klass))
 
-    def lookup(self, idOrName):
+    def iterate(self, batchSize=100):
         """
-        Implement the dual-interpretation logic for "idOrName" to look
-        up an object from the database by id or by name.  Naturally
-        this requires the table have a 'name' column.
+        Generate all instances of the factClass, fetching batchSize rows at a
+        time in id order, so only one batch is in memory at once
+        """
+        k = self.klass
+        lastId = None
+        while True:
+            if lastId is None:
+                rows = STORE.find(k)
+            else:
+                rows = STORE.find(k, k.id > lastId)
+            batch = list(rows.order_by(k.id)[:batchSize])
+            for thing in batch:
+                yield thing
+            if len(batch) < batchSize:
+                return
+            lastId = batch[-1].id
+
+    def count(self):
+        """
+        The number of instances of the factClass
+        """
+        return STORE.find(self.klass).count()
 
-        @return an instance of the table-mapped class, e.g. Monster, Spell,
-        Feat or Skill
+    def names(self):
+        """
+        Generate (id, name, altnames) of every instance of the factClass in
+        id order, reading only those columns
+        """
+        k = self.klass
+        altnameColumn = getattr(k, 'altname', None)
+        if altnameColumn is None:
+            for id, name in STORE.find((k.id, k.name)).order_by(k.id):
+                yield id, name, ()
+        else:
+            rows = STORE.find((k.id, k.name, altnameColumn)).order_by(k.id)
+            for id, name, altname in rows:
+                yield id, name, (altname,) if altname else ()
+
+    def buildIndex(self):
+        """
+        Map every id, name, and normalized name and altname (see
+        search.makeAltName) in the table to its id.  Only those columns are
+        read, so this costs one cheap query.
+
+        @return (ids, names, altnames) dicts
+        """
+        ids, names, altnames = set(), {}, {}
+        altnameColumn = getattr(self.klass, 'altname', None)
+        if altnameColumn is None:
+            rows = ((id, name, None) for (id, name) in
+                    STORE.find((self.klass.id, self.klass.name)))
+        else:
+            rows = STORE.find((self.klass.id, self.klass.name, altnameColumn))
+        for id, name, altname in rows:
+            ids.add(id)
+            names.setdefault(name, id)
+            for n in (name, altname):
+                if n:
+                    altnames.setdefault(makeAltName(n), id)
+        return ids, names, altnames
+
+    def resolve(self, idOrName):
+        """
+        Find the id of the thing in the table with id, name or altname
+        idOrName, or None.  The index is rebuilt whenever the SQL database
+        has changed since it was built.
         """
+        version = sqlVersion()
+        if self._index is None or self._index[1] != version:
+            self._index = (self.buildIndex(), version)
+        ids, names, altnames = self._index[0]
+
         try:
             id = int(idOrName)
-            thing = STORE.find(self.klass, self.klass.id==id).one()
-            if thing is not None:
-                return thing
+            if id in ids:
+                return id
         except ValueError:
             pass
-        return STORE.find(self.klass, self.klass.name==idOrName).one()
+        if idOrName in names:
+            return names[idOrName]
+        return altnames.get(makeAltName(unicode(idOrName)))
+
+    def lookup(self, idOrName):
+        """
+        Implement the dual-interpretation logic for "idOrName" to look
+        up an object from the database by id or by name.  Names are matched
+        exactly first, then ignoring case and punctuation, and against
+        altnames.
+
+        This resolves idOrName in an index of the table's ids and names, so
+        it costs at most one fetch by primary key (none, if Storm already has
+        the object cached).
+
+        @return an instance of the table-mapped class, e.g. Monster, Spell,
+        Feat or Skill
+        """
+        id = self.resolve(idOrName)
+        if id is None:
+            return None
+        return STORE.get(self.klass, id)
+
+    def lookupMany(self, keys):
+        """
+        Look up each of keys, which may be any mix of ids and names, like
+        lookup does, but fetch them all with one query.
+
+        @return a list of instances in the same order as keys, with None for
+        each key that was not found
+        """
+        ids = [self.resolve(k) for k in keys]
+        wanted = set(i for i in ids if i is not None)
+        found = {}
+        if wanted:
+            for thing in STORE.find(self.klass, self.klass.id.is_in(wanted)):
+                found[thing.id] = thing
+        return [found.get(i) for i in ids]
 
 
 class FullText2HACK(object):
@@ -223,6 +409,21 @@ class Monster(object):
     def __repr__(self):
         return '<%s name=%s>' % (self.__class__.__name__, self.name)
 
+    def facets(self):
+        """
+        Values to filter searches by
+        """
+        try:
+            cr = parseChallengeRating(self.challenge_rating)[0][0]
+        except (ValueError, IndexError, AttributeError):
+            cr = None
+        descriptors = (self.descriptor or u'').split(u',')
+        return {u'cr': cr,
+                u'size': SIZE_RANKS.get((self.size or u'').lower()),
+                u'type': self.type,
+                u'family': [self.family, self.type] + descriptors,
+                }
+
 monsterCollection = StormFactCollection(Monster, 'monster')
 
 class Spell(object):
@@ -250,6 +451,17 @@ class Spell(object):
     short_description = SL.Unicode()
     reference = SL.Unicode()
 
+    def facets(self):
+        """
+        Values to filter searches by.  level is the lowest level of the
+        spell for any class.
+        """
+        levels = [int(n) for n in re.findall(r'\d+', self.level or u'')]
+        return {u'school': self.school,
+                u'subschool': self.subschool,
+                u'level': min(levels) if levels else None,
+                }
+
 spellCollection = StormFactCollection(Spell, 'spell')
 
 
@@ -332,12 +544,17 @@ class IndexableRDFFact(object):
         self.text = fact.collectText()
         self.uri = unicode(fact.resUri)
         self.title = unicode(fact.label)
+        self.facets = fact.facets() if hasattr(fact, 'facets') else {}
 
 # Use IndexableStormFact as an adapter for stormfacts to convert them to
 # IIndexable
 globalRegistry.register([IRDFFact], IIndexable, '', IndexableRDFFact)
 
 
+# things that can safely be written as <uri> in a query
+URIRX = re.compile(r'^[^<>"{}|^`\\\s]+$')
+
+
 class RDFFactCollection(object):
     """
     A collection of RuleFacts that are RDFalchemy-mapped objects, so we can
@@ -362,6 +579,57 @@ class RDFFactCollection(object):
         """
         return list(self.klass.ClassInstances())
 
+    def iterate(self, batchSize=100):
+        """
+        Generate all instances of the factClass.  The triples about each
+        batchSize of them (and their bnodes) are read at once into a
+        sparqly.PrefetchedGraph, which the instances then read from.
+        """
+        db = self.klass.db
+        if isinstance(db, S.PrefetchedGraph):
+            db = db.graph
+        subjects = db.subjects(RDF.type, self.klass.rdf_type)
+        while True:
+            batch = list(islice(subjects, batchSize))
+            if not batch:
+                return
+            prefetched = S.PrefetchedGraph(db)
+            prefetched.describe(batch, depth=0)
+            for s in batch:
+                instance = self.klass(s)
+                instance.db = prefetched
+                yield instance
+
+    def count(self):
+        """
+        The number of instances of the factClass
+        """
+        n = 0
+        for s in self.klass.db.subjects(RDF.type, self.klass.rdf_type):
+            n = n + 1
+        return n
+
+    def names(self):
+        """
+        Generate (uri, label, altnames) of every instance of the factClass,
+        reading all the labels and altnames in the graph at once instead of
+        each instance's.  The altnames are the instance's other rdfs:labels,
+        if it has more than one, and its p:altname values (as Monster2 has).
+        """
+        db = self.klass.db
+        labels, extra = {}, {}
+        for s, label in db.subject_objects(RDFSNS.label):
+            labels.setdefault(s, []).append(unicode(label))
+        for s, altname in db.subject_objects(PROP.altname):
+            extra.setdefault(s, []).append(unicode(altname))
+        for s in db.subjects(RDF.type, self.klass.rdf_type):
+            names = labels.get(s) or [unicode(S.iriToTitle(s))]
+            altnames = []
+            for name in names[1:] + extra.get(s, []):
+                if name and name != names[0] and name not in altnames:
+                    altnames.append(name)
+            yield unicode(s), names[0], tuple(altnames)
+
     def lookup(self, uri):
         """
         Lookup an item by its uri.
@@ -372,6 +640,29 @@ class RDFFactCollection(object):
         r = self.klass(u'<%s>' % (uri,))
         return r
 
+    def lookupMany(self, uris, hydrate=False):
+        """
+        Look up each of uris, checking that they are instances of the
+        factClass with one SPARQL query.  With hydrate, also load everything
+        the instances refer to up front (see sparqly.hydrate), which makes
+        rendering many of them, e.g. Monster2 statblocks, far cheaper.
+
+        @return a list of instances in the same order as uris, with None for
+        each uri that is not an instance of the factClass
+        """
+        wanted = set(unicode(u) for u in uris if URIRX.match(unicode(u)))
+        found = set()
+        if wanted:
+            alternatives = u' || '.join(u'?s = <%s>' % (u,) for u in
+                    sorted(wanted))
+            q = u'SELECT ?s { ?s a <%s> . FILTER (%s) }' % (
+                    self.klass.rdf_type, alternatives)
+            found = set(unicode(row[0]) for row in self.klass.db.query(q))
+        ret = [self.lookup(u) if unicode(u) in found else None for u in uris]
+        if hydrate:
+            S.hydrate(filter(None, ret))
+        return ret
+
 
 class SpecialAction(S.rdfsPTClass):
     """Something a creature can do besides attack"""
@@ -450,10 +741,75 @@ class MoveMechanic(S.rdfsPTClass):
 NO_CACHE = object()
 
 
+class DescriptorCache(object):
+    """
+    Process-wide cache of the values CachingDescriptors compute, keyed on
+    (resUri, descriptor name), so the objects rdfalchemy makes afresh for
+    the same resource share them.  Holds at most maxSize values, and drops
+    them all when the objects start reading from another database (see
+    sparqly.graphSource), or when the generation of database changes (i.e.
+    after writes through it).
+    """
+    def __init__(self, maxSize, database):
+        self.cache = LRUCache(maxSize)
+        self.database = database
+        self._source = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self, instance, name, compute):
+        """
+        The value of name for instance, cached or else from compute()
+        """
+        key = (instance.resUri, name)
+        source = S.graphSource(instance.db)
+        with self._lock:
+            if (source is not self._source or
+                    self.database.generation != self._generation):
+                self.cache.clear()
+                self._source = source
+                self._generation = self.database.generation
+            ret = self.cache.get(key, NO_CACHE)
+        if ret is NO_CACHE:
+            ret = compute()
+            with self._lock:
+                self.cache[key] = ret
+        return ret
+
+    def stats(self):
+        """
+        A dict of the number of values cached, and the hits, misses and hit
+        rate of lookups
+        """
+        hits, misses = self.cache.hits, self.cache.misses
+        return {'size': len(self.cache), 'hits': hits, 'misses': misses,
+                'hitRate': hits and float(hits) / (hits + misses)}
+
+
+# set by cacheDescriptors
+DESCRIPTOR_CACHE = None
+
+def cacheDescriptors(maxSize=10000):
+    """
+    Share the values of CachingDescriptors between all objects for the same
+    resource, in a DescriptorCache of maxSize values; 0 turns the cache off.
+    Objects that share a value share the same object, so values must not be
+    modified.
+
+    @return the DescriptorCache
+    """
+    global DESCRIPTOR_CACHE
+    if maxSize:
+        DESCRIPTOR_CACHE = DescriptorCache(maxSize, RDFDB)
+    else:
+        DESCRIPTOR_CACHE = None
+    return DESCRIPTOR_CACHE
+
+
 class CachingDescriptor(object):
     """
     Read-only descriptor which can compute its return value and caches it on
-    the instance, once computed
+    the instance, once computed (and in DESCRIPTOR_CACHE, if that is on)
     """
     def __init__(self, name):
         self.name = name
@@ -465,7 +821,11 @@ class CachingDescriptor(object):
         cached = getattr(instance, attrName, NO_CACHE)
         if cached is not NO_CACHE:
             return cached
-        r = self.get(instance, owner)
+        if DESCRIPTOR_CACHE is None:
+            r = self.get(instance, owner)
+        else:
+            r = DESCRIPTOR_CACHE.get(instance, self.name,
+                    lambda: self.get(instance, owner))
         setattr(instance, attrName, r)
         return r
 
@@ -477,17 +837,92 @@ class CoreFilter(CachingDescriptor):
 
     Pass in a matcher function, and only items for which matcher returns true
     on value will be returned.
+
+    The rdf:types of the items (or of typed(item) for each item, when the
+    matcher looks at the types of something the item refers to) are
+    prefetched in one go before matching, so the rdfIsInstance flags that
+    matchers check need no queries of their own.
     """
-    def __init__(self, name, attr, matcher):
+    def __init__(self, name, attr, matcher, typed=None):
         self.matcher = matcher
         self.attr = attr
+        self.typed = typed
         CachingDescriptor.__init__(self, name)
 
     def get(self, instance, owner):
         items = getattr(instance, self.attr)
+        if self.typed is None:
+            S.prefetchTypes(items)
+        else:
+            S.prefetchTypes(filter(None, map(self.typed, items)))
         return [f for f in items if self.matcher(f)]
 
 
+# the categories of perk, in the order of their bits in FamilyTable.categories
+PERK_CATEGORIES = [CHAR.Sense, CHAR.Immunity, CHAR.Resistance,
+        CHAR.Vulnerability, CHAR.CombatMechanic, CHAR.SpecialQuality,
+        CHAR.SpecialArmorClass, CHAR.Aura, CHAR.SpellLike, CHAR.Supernatural,
+        CHAR.Extraordinary, CHAR.SpecialAttack]
+
+
+class FamilyTable(object):
+    """
+    The perks and languages of every Family (dicts of family URI to a set of
+    perk or language URIs) and the categories of every perk (a dict of perk
+    URI to a bitmask of PERK_CATEGORIES), read from graph in one query per
+    property and per category
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.perks = {}
+        self.languages = {}
+        for fam in graph.subjects(RDF.type, CHAR.Family):
+            self.perks[fam] = set()
+            self.languages[fam] = set()
+        for table, prop in [(self.perks, PROP.perk),
+                (self.languages, PROP.language)]:
+            for s, o in graph.subject_objects(prop):
+                if s in table:
+                    table[s].add(o)
+
+        self.categories = {}
+        for n, category in enumerate(PERK_CATEGORIES):
+            for perk in graph.subjects(RDF.type, category):
+                self.categories[perk] = self.categories.get(perk, 0) | 1 << n
+
+
+_familyTable = [None, None, None]
+
+def familyTable(graph):
+    """
+    The FamilyTable of the database graph reads from (see
+    sparqly.graphSource), built once for each generation of RDFDB
+    """
+    table, source, generation = _familyTable
+    if (table is None or source is not S.graphSource(graph) or
+            generation != RDFDB.generation):
+        while isinstance(graph, S.PrefetchedGraph):
+            graph = graph.graph
+        table = FamilyTable(graph)
+        _familyTable[:] = [table, S.graphSource(graph), RDFDB.generation]
+    return table
+
+
+class PerkFilter(CachingDescriptor):
+    """
+    Descriptor to get the perks in one of PERK_CATEGORIES, by looking up the
+    category of each perk in the FamilyTable
+    """
+    def __init__(self, name, category):
+        self.bit = 1 << PERK_CATEGORIES.index(category)
+        CachingDescriptor.__init__(self, name)
+
+    def get(self, instance, owner):
+        categories = familyTable(instance.db).categories
+        return [p for p in instance.perks
+                if categories.get(p.resUri, 0) & self.bit]
+
+
 class Family(S.rdfsPTClass):
     """A family of monster with shared characteristics"""
     rdf_type = CHAR.Family
@@ -499,18 +934,12 @@ class Family(S.rdfsPTClass):
     languages = rdfMultiple(PROP.language, range_type=Language.rdf_type)
     perks = rdfMultiple(PROP.perk, range_type=Perk.rdf_type)
 
-    senses = CoreFilter("senses", "perks", 
-            lambda x: x.isSense)
-    immunities = CoreFilter("immunities", "perks", 
-            lambda x: x.isImmunity)
-    resistances = CoreFilter("resistances", "perks", 
-            lambda x: x.isResistance)
-    vulnerabilities = CoreFilter("vulnerabilities", "perks",
-            lambda x: x.isVulnerability)
-    specialQualities = CoreFilter("specialQualities", "perks",
-            lambda x: x.isSpecialQuality)
-    combatMechanics = CoreFilter("combatMechanics", "perks",
-            lambda x: x.isCombatMechanic)
+    senses = PerkFilter("senses", CHAR.Sense)
+    immunities = PerkFilter("immunities", CHAR.Immunity)
+    resistances = PerkFilter("resistances", CHAR.Resistance)
+    vulnerabilities = PerkFilter("vulnerabilities", CHAR.Vulnerability)
+    specialQualities = PerkFilter("specialQualities", CHAR.SpecialQuality)
+    combatMechanics = PerkFilter("combatMechanics", CHAR.CombatMechanic)
 
     def collectText(self):
         """
@@ -863,6 +1292,12 @@ class FamilyGetter(CachingDescriptor):
         self.property = property
 
     def get(self, instance, owner):
+        # perks and languages come from the FamilyTable, anything else from
+        # each family
+        table = familyTable(instance.db)
+        column = {'perks': (table.perks, Perk),
+                'languages': (table.languages, Language)}.get(self.property)
+
         gatherer = self.gatherFactory()
         for fam in instance.families:
 
@@ -872,7 +1307,18 @@ class FamilyGetter(CachingDescriptor):
             if isinstance(fam, Literal):
                 continue
 
-            gatherer.add(getattr(fam, self.property))
+            if column is not None and fam.resUri in column[0]:
+                uris, klass = column
+                found = []
+                for uri in uris[fam.resUri]:
+                    # read from the graph instance does, such as the view it
+                    # was hydrated into, not the global one
+                    thing = klass(uri)
+                    thing.db = instance.db
+                    found.append(thing)
+                gatherer.add(found)
+            else:
+                gatherer.add(getattr(fam, self.property))
         return gatherer
 
 
@@ -953,15 +1399,20 @@ class Monster2(S.rdfsPTClass):
     bonusFeats             = CoreFilter("bonusFeats", "feats",
                                         lambda x: x.isBonusFeat)
     acFeats                = CoreFilter("acFeats",  "feats",
-                                        lambda x: x.feat.isArmorClassFeat)
+                                        lambda x: x.feat.isArmorClassFeat,
+                                        typed=lambda x: x.feat)
     speedFeats             = CoreFilter("speedFeats",  "feats",
-                                        lambda x: x.feat.isSpeedFeat)
+                                        lambda x: x.feat.isSpeedFeat,
+                                        typed=lambda x: x.feat)
     attackOptionFeats      = CoreFilter("attackOptionFeats",  "feats",
-                                        lambda x: x.feat.isAttackOptionFeat)
+                                        lambda x: x.feat.isAttackOptionFeat,
+                                        typed=lambda x: x.feat)
     rangedAttackFeats      = CoreFilter("rangedAttackFeats",  "feats",
-                                        lambda x: x.feat.isRangedAttackFeat)
+                                        lambda x: x.feat.isRangedAttackFeat,
+                                        typed=lambda x: x.feat)
     epicFeats              = CoreFilter("epicFeats",  "feats",
-                                            lambda x: x.feat.epic)
+                                        lambda x: x.feat.epic,
+                                        typed=lambda x: x.feat)
 
     TODO("ValueMap for skills taking into account subskills", """
     This should also implement e.g. __contains__; should I implement a skill
@@ -1005,26 +1456,20 @@ class Monster2(S.rdfsPTClass):
     TODO("regeneration - value")
     TODO("damageReduction - {'name':value}")
 
-    auras                  = CoreFilter("auras", "perks", 
-            lambda x: x.isAura)
-    resistances            = CoreFilter("resistances", "perks", 
-            lambda x: x.isResistance)
-    vulnerabilities        = CoreFilter("vulnerabilities", "perks", 
-            lambda x: x.isVulnerability)
-    immunities             = CoreFilter("immunities", "perks", 
-            lambda x: x.isImmunity)
-    senses                 = CoreFilter("senses", "perks", 
-            lambda x: x.isSense)
-    supernaturalAbilities  = CoreFilter("supernaturalAbilities", "perks",
-            lambda x: x.isSupernatural)
-    extraordinaryAbilities = CoreFilter("extraordinaryAbilities", "perks",
-            lambda x: x.isExtraordinary)
-    spellLikeAbilities     = CoreFilter("spellLikeAbilities", "perks",
-            lambda x: x.isSpellLike)
-    specialAttacks         = CoreFilter("specialAttacks", "perks",
-            lambda x: x.isSpecialAttack)
-    specialArmorClasses    = CoreFilter("specialArmorClasses", "perks",
-            lambda x: x.isSpecialAC)
+    auras                  = PerkFilter("auras", CHAR.Aura)
+    resistances            = PerkFilter("resistances", CHAR.Resistance)
+    vulnerabilities        = PerkFilter("vulnerabilities",
+            CHAR.Vulnerability)
+    immunities             = PerkFilter("immunities", CHAR.Immunity)
+    senses                 = PerkFilter("senses", CHAR.Sense)
+    supernaturalAbilities  = PerkFilter("supernaturalAbilities",
+            CHAR.Supernatural)
+    extraordinaryAbilities = PerkFilter("extraordinaryAbilities",
+            CHAR.Extraordinary)
+    spellLikeAbilities     = PerkFilter("spellLikeAbilities", CHAR.SpellLike)
+    specialAttacks         = PerkFilter("specialAttacks", CHAR.SpecialAttack)
+    specialArmorClasses    = PerkFilter("specialArmorClasses",
+            CHAR.SpecialArmorClass)
 
     reference              = rdfSingle(PROP.reference)
     textLocation           = rdfSingle(PROP.textLocation)
@@ -1066,6 +1511,23 @@ class Monster2(S.rdfsPTClass):
         assert type(ret) is unicode
         return ret
 
+    def facets(self):
+        """
+        Values to filter searches by
+        """
+        crs = [self.db.value(c.resUri, RDFNS.value, None) for c in self.cr]
+        crs = [float(c) for c in crs if c is not None]
+        size = getattr(self.size, 'resUri', self.size)
+        if size is not None:
+            size = SIZE_RANKS.get(unicode(size).split('#')[-1].lower())
+        def labels(objects):
+            return [unicode(getattr(o, 'label', o)) for o in objects]
+        return {u'cr': min(crs) if crs else None,
+                u'size': size,
+                u'type': labels(self.type),
+                u'family': labels(self.families),
+                }
+
 monster2 = RDFFactCollection(Monster2, 'monster2')
 
 TODO("""Author metadata!!""", """add author/license/creation date/etc.
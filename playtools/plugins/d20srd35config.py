@@ -4,12 +4,21 @@ Some config settings for launching srd35 database.
 This is a separate module so I can import it without importing the plugin
 itself first.
 """
-from playtools.util import RESOURCE
+import os
+
+from playtools.util import RESOURCE, userCacheDir
 from playtools.test.pttestutil import TODO
 
 SQLPATH = RESOURCE('plugins/srd35.db')
 RDFPATH = RESOURCE('plugins/srd35rdf.db')
 
+def monsterTablePath():
+    """
+    Where the numpy copy of the monster_stats table is cached, in the
+    user's cache directory, since the package may not be writable
+    """
+    return os.path.join(userCacheDir(), 'srd35-monsters.npz')
+
 RDFURIS = ['http://www.w3.org/2000/01/rdf-schema#', 
            'http://goonmill.org/2007/family.n3#', 
            'http://goonmill.org/2007/characteristic.n3#', 
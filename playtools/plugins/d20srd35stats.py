@@ -0,0 +1,318 @@
+"""
+A flat table of the numeric stats of every SRD monster, monster_stats,
+parsed once from the text columns of the monster table so the bestiary can
+be searched and sorted in SQL, e.g.
+
+    store.find(MonsterStats, MonsterStats.cr >= 5, MonsterStats.cr <= 8
+            ).order_by(Desc(MonsterStats.ac))
+
+A stat that is missing or does not parse (such as a Con of "-") is NULL.
+
+monsterTable reads the whole table at once into numpy arrays, one per column,
+for vectorized filtering and aggregation over the bestiary.
+"""
+import os
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from storm import locals as SL
+
+from playtools.parser import (abilityparser, saveparser, armorclassparser,
+        attackparser)
+from playtools.parser.misc import (parseChallengeRating, parseInitiative,
+        parseGrapple)
+from playtools.common import monsterNs
+from playtools.util import rdfName
+
+
+# size categories, smallest first; a monster's size_rank is the index here
+SIZES = [u'fine', u'diminutive', u'tiny', u'small', u'medium', u'large',
+        u'huge', u'gargantuan', u'colossal', u'colossal+']
+
+ABILITIES = [('str', 'strength'), ('dex', 'dexterity'),
+        ('con', 'constitution'), ('int', 'intelligence'), ('wis', 'wisdom'),
+        ('cha', 'charisma')]
+
+SAVES = ['fort', 'ref', 'will']
+
+# bump this when the columns or how they are parsed change, so cached copies
+# of the table are rebuilt
+STATS_VERSION = 2
+
+COLUMNS = [('id', 'INTEGER PRIMARY KEY'), ('uri', 'TEXT'),
+        ('cr', 'REAL'), ('hd', 'REAL'),
+        ('hp', 'INTEGER'), ('ac', 'INTEGER'), ('touch_ac', 'INTEGER'),
+        ('flat_footed_ac', 'INTEGER')] + [
+        (s, 'INTEGER') for s in SAVES] + [
+        (name, 'INTEGER') for ab, name in ABILITIES] + [
+        ('bab', 'INTEGER'), ('grapple', 'INTEGER'), ('initiative', 'INTEGER'),
+        ('attack_bonus', 'INTEGER'), ('full_attack_bonus', 'INTEGER'),
+        ('size_rank', 'INTEGER')]
+
+INDEXED = ['cr', 'hd', 'ac', 'size_rank']
+
+
+class MonsterStats(object):
+    """The numeric stats of one Monster, whose id this shares"""
+    __storm_table__ = 'monster_stats'
+
+    id = SL.Int(primary=True)
+    uri = SL.Unicode()
+    cr = SL.Float()
+    hd = SL.Float()
+    hp = SL.Int()
+    ac = SL.Int()
+    touch_ac = SL.Int()
+    flat_footed_ac = SL.Int()
+    fort = SL.Int()
+    ref = SL.Int()
+    will = SL.Int()
+    strength = SL.Int()
+    dexterity = SL.Int()
+    constitution = SL.Int()
+    intelligence = SL.Int()
+    wisdom = SL.Int()
+    charisma = SL.Int()
+    bab = SL.Int()
+    grapple = SL.Int()
+    initiative = SL.Int()
+    attack_bonus = SL.Int()
+    full_attack_bonus = SL.Int()
+    size_rank = SL.Int()
+
+    def __repr__(self):
+        return '<%s id=%s>' % (self.__class__.__name__, self.id)
+
+
+HD_RX = re.compile(r'^\s*(\d+/\d+|\d+|\xbd)?\s*d\d+')
+HP_RX = re.compile(r'\((\d+) hp\)')
+
+def parseHitDice(s):
+    """
+    The number of hit dice and the average hit points of a hit_dice string
+    such as "8d8+40 (76 hp)", each None if missing
+    """
+    hd = hp = None
+    m = HD_RX.match(s)
+    if m:
+        count = m.group(1)
+        if count is None:
+            hd = 1.
+        elif count == u'\xbd':
+            hd = .5
+        elif '/' in count:
+            num, den = count.split('/')
+            hd = float(num) / int(den)
+        else:
+            hd = float(count)
+    m = HP_RX.search(s)
+    if m:
+        hp = int(m.group(1))
+    return hd, hp
+
+
+def _parsed(parse, s):
+    """
+    parse(s), or None if s is empty or does not parse
+    """
+    if not s:
+        return None
+    try:
+        return parse(s)
+    except (RuntimeError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _statBonus(stat):
+    if stat is None or stat.other is not None:
+        return None
+    return stat.bonus
+
+
+def bestAttackBonus(s):
+    """
+    The highest attack bonus of any attack form in an attack or full_attack
+    string, or None if it has none
+    """
+    bonuses = [form.bonus[0]
+            for option in attackparser.parseAttacks(s)
+            for group in option
+            for form in group.attackForms if form.bonus]
+    if bonuses:
+        return max(bonuses)
+    return None
+
+
+def statsFor(row):
+    """
+    The monster_stats columns (a dict) for row, a dict of the text columns
+    of the monster table
+    """
+    ret = dict((name, None) for name, type in COLUMNS)
+    ret['id'] = row['id']
+    if row['name']:
+        ret['uri'] = unicode(monsterNs[rdfName(row['name'])])
+
+    crs = _parsed(parseChallengeRating, row['challenge_rating'])
+    if crs:
+        ret['cr'] = float(crs[0][0])
+
+    ret['hd'], ret['hp'] = parseHitDice(row['hit_dice'] or u'')
+
+    armor = _parsed(lambda s: armorclassparser.parseArmor(s)[0],
+            row['armor_class'])
+    if armor is not None:
+        ret['ac'] = armor.value
+        ret['touch_ac'] = armor.touch
+        ret['flat_footed_ac'] = armor.flatFooted
+
+    saves = _parsed(lambda s: saveparser.parseSaves(s)[0], row['saves']) or {}
+    for save in SAVES:
+        ret[save] = _statBonus(saves.get(save))
+
+    abilities = _parsed(lambda s: abilityparser.parseAbilities(s)[0],
+            row['abilities']) or {}
+    for ab, name in ABILITIES:
+        ret[name] = _statBonus(abilities.get(ab))
+
+    ret['bab'] = _parsed(int, row['base_attack'])
+    ret['grapple'] = _parsed(parseGrapple, row['grapple'])
+    ret['initiative'] = _parsed(parseInitiative, row['initiative'])
+    ret['attack_bonus'] = _parsed(bestAttackBonus, row['attack'])
+    ret['full_attack_bonus'] = _parsed(bestAttackBonus, row['full_attack'])
+
+    size = (row['size'] or u'').strip().lower()
+    if size in SIZES:
+        ret['size_rank'] = SIZES.index(size)
+    return ret
+
+
+SOURCE_COLUMNS = ['id', 'challenge_rating', 'hit_dice', 'armor_class',
+        'saves', 'abilities', 'base_attack', 'grapple', 'initiative', 'size',
+        'name', 'attack', 'full_attack']
+
+def parseMonsterStats(store):
+    """
+    The monster_stats columns (dicts, see statsFor) of every row of the
+    monster table in store, in id order
+    """
+    rows = store.execute('SELECT %s FROM monster ORDER BY id' % (
+        ', '.join(SOURCE_COLUMNS),)).get_all()
+    return [statsFor(dict(zip(SOURCE_COLUMNS, row))) for row in rows]
+
+
+def buildMonsterStats(store):
+    """
+    (Re)create the monster_stats table from the monster table in store (a
+    storm Store), with its indexes, and commit
+
+    @return the number of monsters in the table
+    """
+    rows = parseMonsterStats(store)
+    store.execute('DROP TABLE IF EXISTS monster_stats')
+    store.execute('CREATE TABLE monster_stats (%s)' % (', '.join(
+        '%s %s' % c for c in COLUMNS),))
+
+    names = [name for name, type in COLUMNS]
+    insert = 'INSERT INTO monster_stats (%s) VALUES (%s)' % (
+            ', '.join(names), ', '.join('?' * len(names)))
+    for stats in rows:
+        store.execute(insert, [stats[name] for name in names])
+
+    for name in INDEXED:
+        store.execute('CREATE INDEX monster_stats_%s ON monster_stats (%s)'
+                % (name, name))
+    store.commit()
+    return len(rows)
+
+
+def hasMonsterStats(store):
+    """
+    Whether store has the monster_stats table
+    """
+    return store.execute("SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'monster_stats'").get_one(
+                    ) is not None
+
+
+def readMonsterTable(store):
+    """
+    The monster_stats table in store as a dict of numpy arrays, one per
+    column, in id order.  uri is a unicode array; every other column is
+    float64, with NaN for NULL, so comparisons with a missing stat are false
+    and numpy.nanmean and friends skip it.
+
+    A database installed before monster_stats existed does not have the
+    table, and may not be writable, so then the stats are parsed from the
+    monster table without storing them.
+    """
+    names = [name for name, type in COLUMNS]
+    if hasMonsterStats(store):
+        rows = store.execute('SELECT %s FROM monster_stats ORDER BY id' % (
+            ', '.join(names),)).get_all()
+    else:
+        rows = [[stats[name] for name in names]
+                for stats in parseMonsterStats(store)]
+    table = {}
+    for n, name in enumerate(names):
+        column = [row[n] for row in rows]
+        if name == 'uri':
+            table[name] = numpy.array([u or u'' for u in column], dtype=unicode)
+        else:
+            table[name] = numpy.array([numpy.nan if v is None else v
+                for v in column], dtype=numpy.float64)
+    return table
+
+
+def monsterTable(store, cachePath=None, version=None):
+    """
+    The monster_stats table in store as a dict of numpy arrays (see
+    readMonsterTable), e.g. the URIs of the CR 5-8 monsters, hardest to hit
+    first:
+
+        t = monsterTable(store)
+        wanted = (t['cr'] >= 5) & (t['cr'] <= 8)
+        t['uri'][wanted][numpy.argsort(-t['ac'][wanted])]
+
+    With cachePath, the arrays are kept in a .npz file there, and read from
+    it instead of the store as long as it was written for the same version,
+    a string identifying the contents of store.  The cache is only a
+    convenience: if it cannot be written, the arrays are returned anyway.
+
+    Raises ImportError if numpy is not installed.
+    """
+    if numpy is None:
+        raise ImportError("monsterTable needs numpy")
+    version = '%s:%s' % (STATS_VERSION, version)
+    if cachePath is not None and os.path.exists(cachePath):
+        try:
+            cached = numpy.load(cachePath)
+            try:
+                if cached['_version'] == version:
+                    return dict((name, cached[name])
+                            for name, type in COLUMNS)
+            finally:
+                cached.close()
+        except (IOError, KeyError, ValueError):
+            pass
+
+    table = readMonsterTable(store)
+    if cachePath is not None:
+        temp = cachePath + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(cachePath)):
+                os.makedirs(os.path.dirname(cachePath))
+            f = open(temp, 'wb')
+            try:
+                numpy.savez(f, _version=numpy.array(version), **table)
+            finally:
+                f.close()
+            os.rename(temp, cachePath)
+        except EnvironmentError:
+            if os.path.exists(temp):
+                os.remove(temp)
+    return table
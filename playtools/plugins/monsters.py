@@ -35,7 +35,7 @@ def statblockSource():
     # blah, cross-dependencies :(
     from goonmill.statblock import Statblock
 
-    for m in SRD.facts['monster'].dump():
+    for m in SRD.facts['monster'].iterate():
         yield Statblock.fromMonster(m)
 
 
@@ -209,7 +209,10 @@ def run(argv=None):
     fout.write("""<html><head><title>D20 SRD Monsters</title>
     <style type="text/css">.badTitle { background-color: yellow; }</style>
     </head><body>""")
-    for m in sorted(MONSTERS2.dump(), key=lambda m:m.label):
+    # sort by label without keeping every monster in memory
+    labels = sorted((m.label, m.resUri) for m in MONSTERS2.iterate())
+    for label, uri in labels:
+        m = MONSTERS2.lookup(uri)
         print m
         if m.fullText:
             loc = fixupMonsterDOM(m, writer=lambda fn, data, title: fout.write(data))
@@ -0,0 +1,455 @@
+"""
+A compact, pure-Python inverted index in a memory-mapped file, used as a
+search backend where HyperEstraier is not available.
+
+File layout (integers are little-endian unsigned 32-bit unless noted):
+
+    header      "PTPOST01", directory offset, directory length
+    term index  one 16-byte entry per term, sorted by the utf-8 term:
+                key offset, key length, postings offset, postings length
+    keys        the utf-8 terms
+    postings    for each term, for each document containing it, as varints:
+                doc id delta, number of positions, position deltas...
+    doc index   one 8-byte entry per document: record offset, record length
+    records     one utf-8 JSON object per document
+    directory   utf-8 JSON giving the term and document counts, the section
+                offsets and the [first, end) doc id range of each domain
+
+Documents are numbered so that each domain is a contiguous range of doc ids,
+which lets a search skip every posting outside the domain it is in.
+
+Since the file is only ever read through mmap, opening an index costs a
+couple of small reads, and processes searching the same index share its pages
+through the OS page cache.
+"""
+import os
+import re
+import mmap
+import struct
+import json
+
+MAGIC = 'PTPOST01'
+SUFFIX = '.postings'
+
+HEADER = struct.Struct('<8s2I')
+TERM_ENTRY = struct.Struct('<4I')
+DOC_ENTRY = struct.Struct('<2I')
+
+TOKENRX = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    """
+    Return the lowercased word tokens in text
+    """
+    return TOKENRX.findall(text.lower())
+
+
+def encodeVarint(n, out):
+    """
+    Append the bytes of n as a varint to the list out
+    """
+    while n >= 0x80:
+        out.append(chr((n & 0x7f) | 0x80))
+        n = n >> 7
+    out.append(chr(n))
+
+
+def decodeVarints(data):
+    """
+    Return the list of integers encoded as varints in the string data
+    """
+    ret = []
+    n = shift = 0
+    for c in data:
+        b = ord(c)
+        n = n | ((b & 0x7f) << shift)
+        if b & 0x80:
+            shift = shift + 7
+        else:
+            ret.append(n)
+            n = shift = 0
+    return ret
+
+
+def matchFacet(value, condition):
+    """
+    Whether a stored facet value meets a condition, as made by
+    search.facetCondition
+    """
+    if value is None:
+        return False
+    op = condition[0]
+    if op == 'range':
+        lo, hi = condition[1:]
+        if not isinstance(value, (int, long, float)):
+            return False
+        return (lo is None or value >= lo) and (hi is None or value <= hi)
+    if not isinstance(value, basestring):
+        return False
+    word = condition[1]
+    if op == 'token':
+        return set(word.split()) <= set(value.split())
+    if op == 'include':
+        return word in value
+    if op == 'begin':
+        return value.startswith(word)
+    return value.endswith(word)
+
+
+class PostingsWriter(object):
+    """
+    Accumulates documents, then writes them out as a postings index file
+    """
+    def __init__(self):
+        self.records = []
+
+    def addDocument(self, uri, name, domain, text, hiddenText=u'',
+            attributes=None):
+        """
+        Add one document.  text is searchable and is what teasers are made
+        from; hiddenText is searchable but never displayed.  attributes are
+        extra values stored with the document and returned in its hits.
+        """
+        record = {}
+        if attributes:
+            record.update(attributes)
+        record.update({u'@uri': uri, u'@name': name, u'domain': domain,
+            u'text': text, u'hidden': hiddenText})
+        self.records.append(record)
+
+    def addIndex(self, index, skipDomain=None):
+        """
+        Add every document from the PostingsIndex index, except the ones in
+        skipDomain
+        """
+        for record in index.records():
+            if record[u'domain'] != skipDomain:
+                self.records.append(record)
+
+    def write(self, path):
+        """
+        Write the index to path, replacing any index that is already there.
+        Readers that already have the old file open can go on using it.
+        """
+        records = sorted(self.records, key=lambda r: r[u'domain'])
+
+        domains = {}
+        postings = {}
+        for docid, record in enumerate(records):
+            first, end = domains.get(record[u'domain'], (docid, docid))
+            domains[record[u'domain']] = [first, docid + 1]
+            # leave a gap between the text and the hidden text, so that a
+            # phrase cannot match across the two
+            words = (tokenize(record[u'text']) + [None] +
+                    tokenize(record[u'hidden']))
+            for pos, word in enumerate(words):
+                if word is None:
+                    continue
+                postings.setdefault(word.encode('utf-8'), {}).setdefault(
+                        docid, []).append(pos)
+
+        terms = sorted(postings)
+
+        termIndexOffset = HEADER.size
+        keysOffset = termIndexOffset + TERM_ENTRY.size * len(terms)
+
+        keys = []
+        postingBlobs = []
+        postingsOffset = keysOffset + sum(len(t) for t in terms)
+        offset = postingsOffset
+        for term in terms:
+            out = []
+            lastDoc = 0
+            for docid in sorted(postings[term]):
+                positions = postings[term][docid]
+                encodeVarint(docid - lastDoc, out)
+                encodeVarint(len(positions), out)
+                lastPos = 0
+                for pos in positions:
+                    encodeVarint(pos - lastPos, out)
+                    lastPos = pos
+                lastDoc = docid
+            blob = ''.join(out)
+            postingBlobs.append((offset, blob))
+            offset = offset + len(blob)
+
+        termIndex = []
+        keyOffset = keysOffset
+        for term, (postOffset, blob) in zip(terms, postingBlobs):
+            termIndex.append(TERM_ENTRY.pack(keyOffset, len(term),
+                postOffset, len(blob)))
+            keys.append(term)
+            keyOffset = keyOffset + len(term)
+
+        docIndexOffset = offset
+        offset = docIndexOffset + DOC_ENTRY.size * len(records)
+        docIndex = []
+        docBlobs = []
+        for record in records:
+            blob = json.dumps(record).encode('utf-8')
+            docIndex.append(DOC_ENTRY.pack(offset, len(blob)))
+            docBlobs.append(blob)
+            offset = offset + len(blob)
+
+        directory = json.dumps(dict(termCount=len(terms),
+            termIndexOffset=termIndexOffset,
+            docCount=len(records),
+            docIndexOffset=docIndexOffset,
+            domains=domains,
+            ))
+
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(HEADER.pack(MAGIC, offset, len(directory)))
+            f.write(''.join(termIndex))
+            f.write(''.join(keys))
+            f.write(''.join(blob for _, blob in postingBlobs))
+            f.write(''.join(docIndex))
+            f.write(''.join(docBlobs))
+            f.write(directory)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+
+class PostingsHit(dict):
+    """
+    One document found by a search.  Its attributes are available like
+    those of a hypy hit, e.g. hit[u'@uri'], hit[u'@name'].
+    """
+    def __init__(self, record):
+        record = dict(record)
+        self.text = record.pop(u'text', u'')
+        self.hiddenText = record.pop(u'hidden', u'')
+        dict.__init__(self, record)
+
+    def teaser(self, terms, format='rst'):
+        """
+        A short excerpt of the text, starting near the first of terms that
+        can be found in it
+        """
+        lower = self.text.lower()
+        start = 0
+        for term in terms:
+            at = lower.find(term.lower().rstrip(u'*'))
+            if at >= 0:
+                start = max(0, at - 40)
+                break
+        return u' '.join(self.text[start:start + 160].split())
+
+    def encode(self, encoding):
+        """
+        The attributes and text of the document, as a draft-like string
+        """
+        lines = [u'%s=%s' % (k, self[k]) for k in sorted(self)]
+        lines.append(u'')
+        lines.append(self.text)
+        return u'\n'.join(lines).encode(encoding)
+
+
+class PostingsIndex(object):
+    """
+    Read-only access to a postings index file written by PostingsWriter
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, dirOffset, dirLength = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a postings index" % (path,))
+        directory = json.loads(self._map[dirOffset:dirOffset + dirLength])
+        self.termCount = directory['termCount']
+        self.docCount = directory['docCount']
+        self._termIndexOffset = directory['termIndexOffset']
+        self._docIndexOffset = directory['docIndexOffset']
+        self.domains = dict((d, tuple(r)) for (d, r) in
+                directory['domains'].items())
+        self._uris = None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.docCount
+
+    def _termEntry(self, n):
+        return TERM_ENTRY.unpack_from(self._map,
+                self._termIndexOffset + TERM_ENTRY.size * n)
+
+    def _key(self, n):
+        keyOffset, keyLength, _, _ = self._termEntry(n)
+        return self._map[keyOffset:keyOffset + keyLength]
+
+    def termRange(self, word, prefix=False):
+        """
+        Return the [lo, hi) range of term numbers which are word, or which
+        start with word if prefix is true
+        """
+        key = word.encode('utf-8')
+        lo, hi = 0, self.termCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        hi = lo
+        while hi < self.termCount:
+            k = self._key(hi)
+            if not (k.startswith(key) if prefix else k == key):
+                break
+            hi = hi + 1
+        return lo, hi
+
+    def postings(self, n, first=0, end=None):
+        """
+        Return {docid: [positions]} for term number n, for the doc ids in
+        [first, end)
+        """
+        if end is None:
+            end = self.docCount
+        _, _, offset, length = self._termEntry(n)
+        nums = decodeVarints(self._map[offset:offset + length])
+        ret = {}
+        docid = j = 0
+        while j < len(nums):
+            docid = docid + nums[j]
+            count = nums[j + 1]
+            j = j + 2
+            if docid >= end:
+                break
+            if docid >= first:
+                pos = 0
+                positions = []
+                for delta in nums[j:j + count]:
+                    pos = pos + delta
+                    positions.append(pos)
+                ret[docid] = positions
+            j = j + count
+        return ret
+
+    def matchClause(self, clause, first, end):
+        """
+        Return {docid: number of matches} for one clause of a query.  A
+        clause ending in '*' matches the prefix of its last word; a clause of
+        several words matches them only as a phrase.
+        """
+        words = tokenize(clause)
+        if not words:
+            return {}
+        prefix = clause.endswith(u'*')
+
+        positionMaps = []
+        for n, word in enumerate(words):
+            lo, hi = self.termRange(word, prefix and n == len(words) - 1)
+            merged = {}
+            for t in xrange(lo, hi):
+                for docid, positions in self.postings(t, first, end).items():
+                    merged.setdefault(docid, []).extend(positions)
+            positionMaps.append(merged)
+
+        head, rest = positionMaps[0], positionMaps[1:]
+        if not rest:
+            return dict((d, len(p)) for (d, p) in head.items())
+
+        ret = {}
+        for docid in head:
+            if not all(docid in m for m in rest):
+                continue
+            following = [set(m[docid]) for m in rest]
+            count = 0
+            for pos in head[docid]:
+                if all(pos + k + 1 in s for (k, s) in enumerate(following)):
+                    count = count + 1
+            if count:
+                ret[docid] = count
+        return ret
+
+    def search(self, domain, clauses, max=10, conditions=None, order=None):
+        """
+        Return up to max hits in domain matching all of clauses, best first.
+        With no clauses, every document in domain matches.
+
+        conditions is {attribute: condition} (see matchFacet) which the hits'
+        attributes must also meet.  If order names a numeric attribute, hits
+        are sorted by it, or by it descending if it starts with "-", instead
+        of by how well they match.
+        """
+        if domain not in self.domains:
+            return []
+        first, end = self.domains[domain]
+
+        if not clauses:
+            scores = dict((d, 0) for d in xrange(first, end))
+        else:
+            scores = None
+            for clause in clauses:
+                matched = self.matchClause(clause, first, end)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = dict((d, scores[d] + matched[d]) for d in scores
+                            if d in matched)
+                if not scores:
+                    return []
+
+        if not conditions and not order:
+            ranked = sorted(scores, key=lambda d: (-scores[d], d))
+            if max is not None:
+                ranked = ranked[:max]
+            return [self.hit(d) for d in ranked]
+
+        records = {}
+        for docid in scores:
+            record = self.record(docid)
+            for name, condition in (conditions or {}).items():
+                if not matchFacet(record.get(name), condition):
+                    break
+            else:
+                records[docid] = record
+
+        def key(d):
+            if not order:
+                return (-scores[d], d)
+            value = records[d].get(order.lstrip(u'-'))
+            if not isinstance(value, (int, long, float)):
+                return (1, 0, -scores[d], d)
+            if order.startswith(u'-'):
+                value = -value
+            return (0, value, -scores[d], d)
+
+        ranked = sorted(records, key=key)
+        if max is not None:
+            ranked = ranked[:max]
+        return [PostingsHit(records[d]) for d in ranked]
+
+    def record(self, docid):
+        """
+        The stored record for docid, as a dict
+        """
+        offset, length = DOC_ENTRY.unpack_from(self._map,
+                self._docIndexOffset + DOC_ENTRY.size * docid)
+        return json.loads(self._map[offset:offset + length].decode('utf-8'))
+
+    def records(self):
+        """
+        Generate the stored record of every document
+        """
+        for docid in xrange(self.docCount):
+            yield self.record(docid)
+
+    def hit(self, docid):
+        """
+        The PostingsHit for docid
+        """
+        return PostingsHit(self.record(docid))
+
+    def __getitem__(self, uri):
+        if self._uris is None:
+            self._uris = dict((r[u'@uri'], d) for (d, r) in
+                    enumerate(self.records()))
+        return self.hit(self._uris[uri])
@@ -0,0 +1,242 @@
+"""
+Benchmarks for the slow paths of playtools. (library code)
+"""
+
+import sys
+import os
+import re
+import time
+import subprocess
+
+from twisted.python import usage
+
+
+def timed(f, *a, **kw):
+    """
+    Call f, returning (seconds taken, f's return value)
+    """
+    start = time.time()
+    ret = f(*a, **kw)
+    return time.time() - start, ret
+
+
+def report(label, seconds, count, size):
+    """
+    Print one line of benchmark results
+    """
+    print '%-12s %8.3fs %10.1f docs/s %8.2f MB/s' % (label, seconds,
+            count / seconds, size / seconds / 2**20)
+
+
+class HtmlCommand(usage.Options):
+    """
+    Time the extraction of index text from the SRD spell full_text, using
+    microdom and using search.textFromHtml
+    """
+    optParameters = [['repeat', 'r', 3, 'Number of passes over the corpus',
+        int],
+            ]
+
+    def postOptions(self):
+        from storm import locals as SL
+        from twisted.web import microdom, domhelpers
+
+        from playtools.plugins.d20srd35config import SQLPATH
+        from playtools import search
+
+        slashRx = re.compile(r'\\([n"])')
+        def repSlash(m):
+            return {'n': '\n', '"': '"'}[m.group(1)]
+
+        store = SL.Store(SL.create_database('sqlite:' + SQLPATH))
+        corpus = [re.sub(slashRx, repSlash, t) for (t,) in
+                store.execute("SELECT full_text FROM spell")]
+        store.close()
+        size = sum(len(t.encode('utf-8')) for t in corpus) * self['repeat']
+        count = len(corpus) * self['repeat']
+
+        def withMicrodom():
+            for n in range(self['repeat']):
+                ret = []
+                for text in corpus:
+                    d = microdom.parseString(text, beExtremelyLenient=1)
+                    ret.append(domhelpers.gatherTextNodes(d, joinWith=u" "))
+            return ret
+
+        def withTextFromHtml():
+            for n in range(self['repeat']):
+                ret = [search.textFromHtml(text) for text in corpus]
+            return ret
+
+        print '%s spell documents, %s passes' % (len(corpus), self['repeat'])
+        seconds, old = timed(withMicrodom)
+        report('microdom', seconds, count, size)
+        seconds, new = timed(withTextFromHtml)
+        report('textFromHtml', seconds, count, size)
+
+        different = len([1 for o, n in zip(old, new) if o != n])
+        print '%s documents extracted differently' % (different,)
+
+
+class StartupCommand(usage.Options):
+    """
+    Time how long each command in bin/ takes to start up, by running it with
+    --help (or, for the scripts that take no options, by loading it), and how
+    long opening the SRD databases takes
+    """
+    optParameters = [['repeat', 'r', 5, 'Number of runs of each command', int],
+            ['bin', None, None, 'Directory containing the commands'],
+            ]
+
+    # scripts that would do real work when run, so are only loaded
+    loadOnly = ['notation3', 'showsheet']
+
+    # commands that are run as modules rather than from bin/
+    modules = ['playtools.search']
+
+    def postOptions(self):
+        from playtools.util import RESOURCE
+
+        binDir = self['bin'] or os.path.normpath(RESOURCE('../bin'))
+        env = dict(os.environ)
+        root = os.path.dirname(binDir)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [root,
+            env.get('PYTHONPATH')]))
+
+        commands = []
+        for name in sorted(os.listdir(binDir)):
+            path = os.path.join(binDir, name)
+            if name in self.loadOnly:
+                argv = [sys.executable, '-c',
+                    'import imp; imp.load_source("%s", %r)' % (name, path)]
+            else:
+                argv = [sys.executable, path, '--help']
+            commands.append((name, argv))
+        for module in self.modules:
+            commands.append((module, [sys.executable, '-m', module, '--help']))
+
+        devnull = open(os.devnull, 'w')
+        print '%-20s %8s %8s' % ('command', 'best', 'mean')
+        for name, argv in commands:
+            times = []
+            for n in range(self['repeat']):
+                seconds, _ = timed(subprocess.call, argv, stdout=devnull,
+                        stderr=devnull, env=env)
+                times.append(seconds)
+            print '%-20s %7.3fs %7.3fs' % (name, min(times),
+                    sum(times) / len(times))
+        devnull.close()
+
+        from playtools.plugins import d20srd35
+        seconds, _ = timed(lambda: (d20srd35.STORE.getStore(),
+            len(d20srd35.RDFDB.graph)))
+        print ('Opening the SRD store and RDF graph takes %.3fs, now paid on '
+                'first use instead of by every command' % (seconds,))
+
+
+class ReadsCommand(usage.Options):
+    """
+    Time reads of the SRD RDF graph from several threads at once, each
+    reading through its own connection from a SQLiteGraphPool
+    """
+    optParameters = [['threads', 't', 4, 'Largest number of threads', int],
+            ['subjects', 's', 500, 'Number of subjects each thread reads',
+                int],
+            ]
+    optFlags = [['wal', None, 'Switch the store to write-ahead logging '
+            '(this changes the database file)'],
+            ]
+
+    def postOptions(self):
+        import threading
+        from itertools import islice
+
+        from playtools.plugins.d20srd35config import RDFPATH
+        from playtools.sparqly import SQLiteGraphPool
+        from playtools.common import a
+
+        pool = SQLiteGraphPool(RDFPATH, wal=self['wal'])
+        subjects = list(islice(pool.reader().subjects(a, None),
+            self['subjects']))
+
+        def read():
+            graph = pool.reader()
+            for s in subjects:
+                list(graph.predicate_objects(s))
+
+        n = 1
+        while n <= self['threads']:
+            threads = [threading.Thread(target=read) for i in range(n)]
+            def runAll():
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            seconds, _ = timed(runAll)
+            print '%2s threads %8.3fs %10.1f subjects/s' % (n, seconds,
+                    n * len(subjects) / seconds)
+            n = n * 2
+        print 'pool: %(readers)s readers, wal=%(wal)s' % pool.stats()
+        pool.close()
+
+
+class SwapCommand(usage.Options):
+    """
+    Time entering usingRDFDatabase, as MonsterConverter does for each
+    monster, with the rdfalchemy classes mapped once and remapped every time
+    """
+    optParameters = [['repeat', 'r', 1000, 'Number of entries', int],
+            ]
+
+    def postOptions(self):
+        from rdflib.Graph import ConjunctiveGraph
+
+        from playtools import sparqly
+        from playtools.plugins import d20srd35
+
+        graph = ConjunctiveGraph()
+        sparqly.initRDFDatabase(None)
+        print '%s mapped classes' % (len(sparqly.mapClasses()),)
+
+        def swap(remap):
+            for n in xrange(self['repeat']):
+                old = sparqly.initRDFDatabase(graph, remap=remap)
+                sparqly.initRDFDatabase(old, remap=remap)
+
+        for label, remap in [('remapped', True), ('cached', False)]:
+            seconds, _ = timed(swap, remap)
+            print '%-12s %8.3fs %10.1f us/entry' % (label, seconds,
+                    seconds / self['repeat'] * 1e6)
+
+
+class Options(usage.Options):
+    synopsis = "ptbench"
+
+    subCommands = [
+            ("html", None, HtmlCommand, "Time index text extraction"),
+            ("startup", None, StartupCommand, "Time the startup of each command"),
+            ("reads", None, ReadsCommand, "Time concurrent reads of the RDF graph"),
+            ("swap", None, SwapCommand, "Time switching the RDF database"),
+            ]
+
+    def postOptions(self):
+        if self.subCommand is None:
+            self.synopsis = "ptbench <subcommand>"
+            raise usage.UsageError("** Please specify a subcommand (see \"Commands\").")
+
+
+def run(argv=None):
+    if argv is None:
+        argv = sys.argv
+    o = Options()
+    try:
+        o.parseOptions(argv[1:])
+    except usage.UsageError, e:
+        if hasattr(o, 'subOptions'):
+            print str(o.subOptions)
+        else:
+            print str(o)
+        print str(e)
+        return 1
+
+    return 0
@@ -9,8 +9,12 @@ import pprint
 
 from twisted.python import usage
 
+from rdflib.Graph import (ConjunctiveGraph as Graph, Graph as RawGraph,
+        QuotedGraph)
+
 from playtools.sparqly import (sqliteBackedGraph, filterNamespaces,
-                TriplesDatabase)
+                TriplesDatabase, bulkLoad)
+from playtools.snapshot import writeSnapshot
 from playtools.util import columnizeResult, prefixen
 
 
@@ -43,6 +47,12 @@ class Explorer(cmd.Cmd):
         for pfx, uri in nss:
             print '@prefix %12s: <%s>.' % (pfx, uri)
 
+    def do_stats(self, arg):
+        """Show how well the query result cache is doing"""
+        results = self.store.results
+        print '%s cached results, %s hits, %s misses' % (len(results),
+                results.hits, results.misses)
+
     def postcmd(self, stop, line):
         return not not self._quitting
 
@@ -75,6 +85,7 @@ class OpenCommand(usage.Options):
     def open(self):
         tdb = TriplesDatabase()
         tdb.open(self['filename'])
+        tdb.cacheResults()
         ex = Explorer(tdb)
         ex.cmdloop()
 
@@ -151,13 +162,32 @@ class PullCommand(usage.Options):
         if self['verbose']:
             print 'Omitted some namespaces:\n %s' % ('\n '.join(list(s1-s2)),)
 
+        total, seconds = 0, 0.0
         for d in filterNamespaces(self.n3list):
             if self['verbose']:
                 print 'Loading from %s' % (d,)
-            graph.load(d, format='n3')
+            loaded = Graph()
+            loaded.parse(d, format='n3')
+            for pfx, uri in loaded.namespaces():
+                graph.bind(pfx, uri)
+            for context in loaded.contexts():
+                if isinstance(context, QuotedGraph):
+                    target = QuotedGraph(graph.store, context.identifier)
+                else:
+                    # replace what an earlier pull stored from d, as
+                    # graph.load does
+                    target = RawGraph(graph.store, context.identifier)
+                    target.remove((None, None, None))
+                n, secs = bulkLoad(graph, context, context=target,
+                        commit=False)
+                total, seconds = total + n, seconds + secs
 
         graph.commit()
 
+        if self['verbose'] and seconds:
+            print 'Stored %s triples in %.2fs (%d triples/s)' % (total,
+                    seconds, total / seconds)
+
         # TODO - accept rdf etc. (--rdf <uri>)
 
         if self['verbose']:
@@ -166,6 +196,53 @@ class PullCommand(usage.Options):
         return graph
 
 
+class SnapshotCommand(usage.Options):
+    """
+    Write a read-only binary snapshot of a store, and/or of documents at some
+    URIs, which TriplesDatabase.open can load with graphClass=SnapshotGraph
+    """
+    synopsis = "[--store <filename>] [--n3 <uri> ...] <snapshot>"
+    optParameters = [['store', 's', None, 'Include the triples of this store'],
+            ['n3', None, None, 'Include an N3 file from the given URI'],
+            ]
+    n3list = None
+
+    def opt_n3(self, uri):
+        if self.n3list is None:
+            self.n3list = []
+        self.n3list.append(uri)
+
+    def parseArgs(self, filename):
+        self['filename'] = filename
+
+    def postOptions(self):
+        if self['store'] is None and self.n3list is None:
+            raise usage.UsageError("** Give a --store and/or --n3 to snapshot")
+        self.snapshot()
+
+    def snapshot(self):
+        if self['store'] is None:
+            graph = Graph()
+        else:
+            if not os.path.exists(self['store']):
+                raise usage.UsageError("** %s does not exist" % (
+                    self['store'],))
+            path, filename = os.path.split(self['store'])
+            graph = sqliteBackedGraph(path, filename)
+            if self.n3list:
+                graph, store = Graph(), graph
+                TriplesDatabase.extendRawGraph(graph, store)
+                for pfx, uri in store.namespaces():
+                    graph.bind(pfx, uri)
+
+        for d in filterNamespaces(self.n3list or []):
+            graph.load(d, format='n3')
+
+        count = writeSnapshot(graph, self['filename'])
+        print 'Wrote %s triples, counting those in formulae, to %s' % (count,
+                self['filename'])
+
+
 class Options(usage.Options):
     synopsis = "ptstore"
 
@@ -173,6 +250,8 @@ class Options(usage.Options):
             ("create", None, CreateCommand, "Create a new store"),
             ("pull", None, PullCommand, "Read data from a URL and import it"),
             ("open", None, OpenCommand, "Open the store interactively"),
+            ("snapshot", None, SnapshotCommand,
+                "Write a read-only binary snapshot"),
             ]
 
     # def parseArgs(self, ...):
@@ -7,9 +7,12 @@ import sys, os
 from twisted.python import usage
 from twisted.python.util import sibpath
 
+from storm import locals as SL
+
 from . import ptstore
 
 from playtools.plugins.d20srd35config import SQLPATH, RDFPATH, SQLS, RDFURIS
+from playtools.plugins.d20srd35stats import buildMonsterStats
 from playtools import search, plugins
 
 class Options(usage.Options):
@@ -30,6 +33,8 @@ class Options(usage.Options):
 
         self.install_sql(SQLPATH)
 
+        self.install_stats(SQLPATH)
+
         idx = self.create_index()
 
     def ptstore(self, *a):
@@ -74,6 +79,15 @@ class Options(usage.Options):
 
         os.chmod(path, 0644)
 
+    def install_stats(self, path):
+        """
+        Parse the monster stats into the monster_stats table
+        """
+        store = SL.Store(SL.create_database('sqlite:' + path))
+        count = buildMonsterStats(store)
+        store.close()
+        print 'monster_stats: %s monsters' % (count,)
+
     def create_index(self):
         search.run(['search.py', '--build-index'])
 
@@ -1,16 +1,29 @@
 """
-HyperEstraier-based indexing and searching
+Indexing and searching, with HyperEstraier or with the pure-Python postings
+index in playtools.postings
 """
+from __future__ import with_statement
+
 import sys
+import os
 import shutil
 import re
+import threading
+import itertools
+import multiprocessing
+import hashlib
 
-from twisted.web import microdom, domhelpers
 from twisted.python import usage
 
 from playtools.interfaces import IIndexable, IRuleCollection
+from playtools.util import LRUCache, afterFork
+from playtools.parser.misc import parseChallengeRating
+from playtools import postings
 
-import hypy
+try:
+    import hypy
+except ImportError:
+    hypy = None
 
 
 ALTRX = re.compile(r'[^a-zA-Z0-9\s]')
@@ -23,15 +36,61 @@ def makeAltName(s):
     return s
 
 
+MARKUPRX = re.compile(r"""
+      <!--(?P<comment>.*?)(?:-->|\Z)
+    | <!\[CDATA\[(?P<cdata>.*?)(?:\]\]>|\Z)
+    | <(?P<raw>script|style)\b[^>]*>(?P<rawText>.*?)(?:</(?P=raw)\s*>|\Z)
+    | (?P<entity>&\#?\w+;)
+    | <[!?/]?[a-zA-Z_:](?:"[^"]*"|'[^']*'|[^<>])*(?:>|\Z)
+    | <\s*\Z
+    """, re.S | re.X | re.I)
+
+def iterTextNodes(htmlText):
+    """
+    Generate the text nodes of html text, without building a DOM.
+
+    This is as lenient as microdom with beExtremelyLenient, and produces the
+    same nodes as domhelpers.gatherTextNodes would: whitespace-only text is
+    dropped, entity references are left unexpanded as nodes of their own, and
+    the contents of comments, CDATA sections and script/style elements count
+    as text.
+
+    Unlike microdom, anything that cannot be a tag is kept as text: a bare
+    "&" (not made into "&amp;"), "<" followed by a space or digit as in
+    "a < b" or "<1>" (where microdom could raise), and "<? pi ?>" with a
+    space after the "?".
+    """
+    pos = 0
+    for m in MARKUPRX.finditer(htmlText):
+        if m.start() > pos:
+            text = htmlText[pos:m.start()]
+            if pos == 0:
+                text = text.lstrip()
+            if text.strip():
+                yield text
+        pos = m.end()
+
+        lastgroup = m.lastgroup
+        if lastgroup == 'raw':
+            lastgroup = 'rawText'
+        if lastgroup is not None:
+            text = m.group(lastgroup)
+            if text is not None and text.strip():
+                yield text
+
+    text = htmlText[pos:]
+    if pos == 0:
+        text = text.lstrip()
+    if text.strip():
+        yield text
+
+
 def textFromHtml(htmlText):
     """
     Convert html text into its text nodes, with extreme leniency.  If the input
     is unicode, keep it unicode.
     """
-    d = microdom.parseString(htmlText, beExtremelyLenient=1)
-    s = domhelpers.gatherTextNodes(d, joinWith=u" ")
-    ## print '\n'.join('| ' + l for l in s.splitlines())
-    return s
+    return u" ".join(iterTextNodes(htmlText))
 
 
 ALWAYS_SKIP = object()
@@ -43,31 +102,371 @@ def fuzzyQuoteTerm(t):
     return '%s*' % (t,)
 
 
-def find(estdb, domain, terms, max=10):
-    """Use an estraier index to find monsters or other things"""
+def facetValue(value):
+    """
+    Normalize a facet value for storing in an index.  Numbers stay numbers;
+    a string, or a list of strings, becomes space-separated tokens made from
+    their altnames, e.g. [u"Undead", u"Astral Construct"] becomes
+    u"undead astral-construct"
+    """
+    if isinstance(value, (int, long, float)):
+        return value
+    if isinstance(value, basestring):
+        value = [value]
+    tokens = [makeAltName(v).replace(u' ', u'-') for v in value if v]
+    return u' '.join(t for t in tokens if t)
+
+
+def normalizeFacets(facets):
+    """
+    Return the facets dict of an IIndexable with its values normalized by
+    facetValue, and the empty ones dropped
+    """
+    ret = {}
+    for name, value in (facets or {}).items():
+        if value is None:
+            continue
+        value = facetValue(value)
+        if value != u'':
+            ret[unicode(name)] = value
+    return ret
+
+
+def facetCondition(spec):
+    """
+    Convert one facet filter, as given to find(), into the condition tuple
+    that the index backends evaluate:
+
+        (lo, hi)     - ('range', lo, hi), number between lo and hi inclusive;
+                       either end may be None
+        3            - ('range', 3, 3)
+        u"undead"    - ('token', u"undead"), one of the facet's tokens
+        u"*wight*"   - ('include', u"wight"); u"wight*" is ('begin', ...)
+                       and u"*wight" is ('end', ...)
+    """
+    if isinstance(spec, (tuple, list)):
+        lo, hi = spec
+        return ('range', lo, hi)
+    if isinstance(spec, (int, long, float)):
+        return ('range', spec, spec)
+    if u'*' in spec:
+        word = makeAltName(spec.replace(u'*', u' '))
+        if spec.startswith(u'*') and spec.endswith(u'*'):
+            return ('include', word)
+        elif spec.endswith(u'*'):
+            return ('begin', word)
+        return ('end', word)
+    return ('token', facetValue(spec))
+
+
+def facetConditions(filters):
+    """
+    Return {name: condition} for a dict of facet filters
+    """
+    return dict((name, facetCondition(spec)) for (name, spec) in
+            (filters or {}).items())
+
+
+HYPYSTRINGOPS = {'token': u'STRAND', 'include': u'STRINC', 'begin': u'STRBW',
+        'end': u'STREW'}
+
+def hypyFacetExpression(name, condition):
+    """
+    Return the HCondition attribute expression for a facet condition
+    """
+    op = condition[0]
+    if op == 'range':
+        lo, hi = condition[1:]
+        if lo is None:
+            return u'%s NUMLE %s' % (name, hi)
+        if hi is None:
+            return u'%s NUMGE %s' % (name, lo)
+        return u'%s NUMBT %s %s' % (name, lo, hi)
+    return u'%s %s %s' % (name, HYPYSTRINGOPS[op], condition[1])
+
+
+def find(estdb, domain, terms, max=10, filters=None, order=None):
+    """
+    Use an estraier index, or a postings index, to find monsters or other
+    things
+
+    filters is a dict of {facet name: filter} which hits must match (see
+    facetCondition), and order is the name of a numeric facet to sort the
+    hits by instead of by relevance, prefixed with "-" to sort descending.
+    Both are evaluated by the index, in the same search.
+    """
     fuzzy = [fuzzyQuoteTerm(t) for t in terms]
+    conditions = facetConditions(filters)
+
+    if isinstance(estdb, postings.PostingsIndex):
+        return estdb.search(domain, fuzzy, max, conditions, order)
+
     phrase = u' '.join(fuzzy)
 
     query = hypy.HCondition(phrase, matching='simple', max=max)
     query.addAttr(u'domain STREQ %s' % (domain,))
+    for name, condition in sorted(conditions.items()):
+        query.addAttr(hypyFacetExpression(name, condition))
+    if order:
+        if order.startswith(u'-'):
+            query.setOrder(u'%s NUMD' % (order[1:],))
+        else:
+            query.setOrder(u'%s NUMA' % (order,))
 
     r = estdb.search(query)
 
     return r
 
 
+def defaultBackend():
+    """
+    The name of the search backend to use when none was asked for
+    """
+    if hypy is None:
+        return 'postings'
+    return 'hypy'
+
+
+def indexPath(system, backend=None):
+    """
+    Where the index of system is kept, for the named backend
+    """
+    if backend is None:
+        backend = defaultBackend()
+    if backend == 'postings':
+        return system.searchIndexPath + postings.SUFFIX
+    return system.searchIndexPath
+
+
+def indexGeneration(path):
+    """
+    Return the generation number of the index at path, which the indexers
+    bump every time they change it
+    """
+    try:
+        return int(open(path + '.generation').read())
+    except (EnvironmentError, ValueError):
+        return 0
+
+
+def bumpGeneration(path):
+    """
+    Record that the index at path has changed, so that open handles and
+    cached results for it are thrown away
+    """
+    gen = indexGeneration(path) + 1
+    f = open(path + '.generation', 'w')
+    try:
+        f.write(str(gen))
+    finally:
+        f.close()
+    return gen
+
+
+def normalizeTerms(terms):
+    """
+    Return terms as a tuple, lowercased and with whitespace collapsed, which
+    does not change what they match
+    """
+    return tuple(u' '.join(t.lower().split()) for t in terms)
+
+
+def removeIndex(path):
+    """
+    Delete the index at path, of either kind, if it exists
+    """
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except EnvironmentError:
+        pass
+
+
+class SearchService(object):
+    """
+    Keeps one read handle open for each search index, and reuses it for every
+    query, so that a lookup against a warm index only costs the query itself.
+
+    Use the module-level instance, service, rather than making your own.
+    """
+    def __init__(self, backend=None, cacheSize=1000):
+        self.backend = backend
+        self.cache = LRUCache(cacheSize)
+        self._handles = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def openIndex(self, path):
+        """
+        Return the read handle for the index at path, opening it the first
+        time it is asked for
+        """
+        with self._lock:
+            estdb = self._handles.get(path)
+            if estdb is None:
+                if path.endswith(postings.SUFFIX):
+                    estdb = postings.PostingsIndex(path)
+                else:
+                    estdb = hypy.HDatabase(autoflush=False)
+                    estdb.open(path, 'r')
+                self._handles[path] = estdb
+            return estdb
+
+    def closeIndex(self, path=None):
+        """
+        Close the handle for the index at path, or every handle if path is
+        None.  Do this before rebuilding an index that may be open.
+        """
+        with self._lock:
+            if path is None:
+                paths = self._handles.keys()
+            else:
+                paths = [path]
+            for p in paths:
+                self._generations.pop(p, None)
+                estdb = self._handles.pop(p, None)
+                if estdb is not None:
+                    estdb.close()
+
+    def checkGeneration(self, path):
+        """
+        If the index at path has changed since we opened it, close our handle
+        and drop the cached results, so they are all fetched again
+        """
+        gen = indexGeneration(path)
+        if path in self._generations and self._generations[path] != gen:
+            self.closeIndex(path)
+            with self._lock:
+                self.cache.clear()
+        self._generations[path] = gen
+
+    def find(self, system, domain, terms, max=10, filters=None, order=None):
+        """
+        Search the index of the IRuleSystem system for things in domain
+        """
+        return self.findMany(system, domain, [terms], max, filters, order)[0]
+
+    def findMany(self, system, domain, listOfTermLists, max=10, filters=None,
+            order=None):
+        """
+        Run a batch of searches in domain against one open index, all with
+        the same facet filters and order (see find).  Identical queries are
+        only run once, and results are cached until the index changes.
+
+        @return a list of results, one for each list of terms
+        """
+        path = indexPath(system, self.backend)
+        self.checkGeneration(path)
+        estdb = self.openIndex(path)
+
+        facetKey = tuple(sorted(facetConditions(filters).items()))
+
+        ret = []
+        with self._lock:
+            for terms in listOfTermLists:
+                key = (path, domain, normalizeTerms(terms), max, facetKey,
+                        order)
+                hits = self.cache.get(key)
+                if hits is None:
+                    hits = list(find(estdb, domain, terms, max, filters,
+                        order))
+                    self.cache[key] = hits
+                ret.append(hits)
+        return ret
+
+service = SearchService()
+
+
+def contentHash(title, text, facets=None):
+    """
+    Return a digest of the indexed title, text and facets of a document, so
+    we can tell when it needs to be re-indexed
+    """
+    h = hashlib.md5(title.encode('utf-8'))
+    h.update('\0')
+    h.update(text.encode('utf-8'))
+    if facets:
+        h.update('\0')
+        h.update(repr(sorted(facets.items())))
+    return unicode(h.hexdigest())
+
+
+def extractDocument(item):
+    """
+    Adapt item to IIndexable and return the (uri, title, text, facets) that
+    will be indexed for it, as plain values which can be pickled
+    """
+    item = IIndexable(item)
+    facets = normalizeFacets(getattr(item, 'facets', None))
+    return unicode(item.uri), item.title, item.text, facets
+
+
+# the collection being indexed by a parallel buildIndex.  Worker processes
+# are forked after this is set, so they inherit it.
+_jobCollection = None
+
+def _extractJob(uri):
+    """
+    Worker-process half of a parallel buildIndex: extract the fact at uri
+    """
+    return extractDocument(_jobCollection.lookup(uri))
+
+
+def extractParallel(collection, jobs):
+    """
+    Generate extractDocument(fact) for each fact in collection, in the order
+    of collection.names(), doing the extraction in a pool of jobs worker
+    processes.
+
+    Only the uris of the facts are sent to the workers, which look the facts
+    up themselves.  Each worker calls util.afterFork first, so it opens
+    database handles of its own instead of using this process's.
+    """
+    global _jobCollection
+    uris = [uri for uri, title, altnames in collection.names()]
+    _jobCollection = collection
+    pool = multiprocessing.Pool(jobs, initializer=afterFork)
+    try:
+        chunksize = max(1, len(uris) // (jobs * 8))
+        for fields in pool.imap(_extractJob, uris, chunksize):
+            yield fields
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _jobCollection = None
+
+
+def extractDocuments(collection, jobs=1):
+    """
+    Generate the (uri, title, text, facets) of each fact in collection, using
+    jobs worker processes if jobs > 1
+    """
+    if jobs > 1:
+        return extractParallel(collection, jobs)
+    return itertools.imap(extractDocument, collection.iterate())
+
+
 class HypyIndexer(object):
     """
     Manager for Hypy HDatabases
     """
+    batchSize = 200
+
     def __init__(self, path):
         self.path = path
 
-    def buildIndex(self, collection, beQuiet=False):
+    def buildIndex(self, collection, beQuiet=False, jobs=1):
         """
         Extract the indexable text documents from the collection and index
         them under the named domain.
 
+        With jobs > 1, the text is extracted in that many worker processes
+        and this process only writes the documents, flushing them in batches
+        of batchSize.  The resulting index is the same either way.
+
         TODO: add a zope Interface to the classes of things that can be indexed,
         and adapt to that.
         """
@@ -76,57 +475,231 @@ class HypyIndexer(object):
         estdb = hypy.HDatabase(autoflush=False)
         estdb.open(self.path, 'a')
 
-        items = collection.dump()
+        total = collection.count()
+        documents = extractDocuments(collection, jobs)
 
         lastPct = 0
-        for n, item in enumerate(items):
-            pct = int(100.0*(float(n)/len(items)))
+        for n, fields in enumerate(documents):
+            pct = int(100.0*(float(n)/total))
             if pct%10 == 0 and lastPct != pct:
                 lastPct = pct
                 if not beQuiet:
                     sys.stdout.write("%s%%" % (pct,))
+            if n % self.batchSize == 0:
                 estdb.flush()
-            self.indexItem(item, estdb, collection.factName, )
+            estdb.putDoc(self.makeDocument(fields, collection.factName), 0)
             if not beQuiet:
                 sys.stdout.write(".")
                 sys.stdout.flush()
 
+        estdb.flush()
+        estdb.close()
+        bumpGeneration(self.path)
+
         if not beQuiet:
             sys.stdout.write("100%")
 
+    def updateIndex(self, collection, beQuiet=False, jobs=1):
+        """
+        Bring the documents in collection's domain up to date without
+        rebuilding the index: documents whose title or text digest changed
+        are replaced, new ones are added, and ones no longer in the
+        collection are removed.
+
+        @return (added, replaced, removed) document counts
+        """
+        assert IRuleCollection.providedBy(collection)
+        domain = collection.factName
+
+        estdb = hypy.HDatabase(autoflush=False)
+        estdb.open(self.path, 'a')
+
+        indexed = self.indexedDigests(estdb, domain)
+        added = replaced = 0
+
+        for n, fields in enumerate(extractDocuments(collection, jobs)):
+            doc = self.makeDocument(fields, domain)
+            uri = doc[u'@uri']
+            oldDigest = indexed.pop(uri, None)
+            if oldDigest == doc[u'digest']:
+                continue
+            if oldDigest is None:
+                added = added + 1
+            else:
+                replaced = replaced + 1
+            estdb.putDoc(doc, 0)
+            if (added + replaced) % self.batchSize == 0:
+                estdb.flush()
+
+        # anything left over was not in the collection any more
+        for uri in indexed:
+            estdb.remove(uri=uri)
+
+        estdb.flush()
+        estdb.close()
+        bumpGeneration(self.path)
+
+        if not beQuiet:
+            sys.stdout.write("%s added, %s replaced, %s removed" % (added,
+                replaced, len(indexed)))
+        return added, replaced, len(indexed)
+
+    def indexedDigests(self, estdb, domain):
+        """
+        Return {uri: digest} for each document already indexed in domain
+        """
+        query = hypy.HCondition()
+        query.addAttr(u'domain STREQ %s' % (domain,))
+        return dict((hit[u'@uri'], hit.get(u'digest')) for hit in
+                estdb.search(query))
+
     def indexItem(self, item, estdb, domain):
         """
         Add a single item to the Hypy index
         """
-        item = IIndexable(item)
+        estdb.putDoc(self.makeDocument(extractDocument(item), domain), 0)
 
-        full = item.text
+    def makeDocument(self, fields, domain):
+        """
+        Build the HDocument for fields, an extracted (uri, title, text,
+        facets)
+        """
+        uri, title, full, facets = fields
         # TODO - this domain/uri is a little awkward if we ever use anything
         # other than a numeric id for URI. for example, this would not look
         # good: "spell/http://goonmill.org/2009/spells.n3#magicMissile"
         # Would rather have domain be <http://...spells.n3#> and uri be
         # <magicMissile>
-        doc = hypy.HDocument(uri=u'%s/%s' % (domain, unicode(item.uri)))
+        doc = hypy.HDocument(uri=u'%s/%s' % (domain, uri))
         doc.addText(full)
-        doc[u'@name'] = item.title
-        doc[u'altname'] = makeAltName(item.title)
+        doc[u'@name'] = title
+        doc[u'altname'] = makeAltName(title)
         doc[u'domain'] = domain.decode('ascii')
-        # add item.title to the text so that it has extra weight in the
+        doc[u'digest'] = contentHash(title, full, facets)
+        for name, value in facets.items():
+            doc[name] = unicode(value)
+        # add title to the text so that it has extra weight in the
         # search results
-        doc.addHiddenText(item.title)
+        doc.addHiddenText(title)
         # pad with the altname so exact matches come up near the top
         doc.addHiddenText((doc[u'altname'] + " ") * 6)
+        return doc
+
+
+class PostingsIndexer(object):
+    """
+    Manager for the pure-Python postings index file (see playtools.postings),
+    which indexes the same text as HypyIndexer does.
+
+    A postings index is written in one go, so each buildIndex or updateIndex
+    call rewrites the file, keeping the documents from other domains.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def buildIndex(self, collection, beQuiet=False, jobs=1):
+        """
+        Extract the indexable text documents from the collection and index
+        them under the named domain, replacing whatever was in that domain.
+        """
+        self.indexCollection(collection, beQuiet, jobs, keepDigests=False)
+
+    def updateIndex(self, collection, beQuiet=False, jobs=1):
+        """
+        Re-index the documents in the collection's domain and report what
+        changed.
+
+        @return (added, replaced, removed) document counts
+        """
+        return self.indexCollection(collection, beQuiet, jobs,
+                keepDigests=True)
+
+    def indexCollection(self, collection, beQuiet, jobs, keepDigests):
+        assert IRuleCollection.providedBy(collection)
+        domain = collection.factName.decode('ascii')
+
+        writer = postings.PostingsWriter()
+        indexed = {}
+        if os.path.exists(self.path):
+            old = postings.PostingsIndex(self.path)
+            writer.addIndex(old, skipDomain=domain)
+            if keepDigests:
+                indexed = dict((hit[u'@uri'], hit.get(u'digest')) for hit in
+                        old.search(domain, [], max=None))
+            old.close()
+
+        added = replaced = 0
+        for fields in extractDocuments(collection, jobs):
+            uri, title, full, facets = fields
+            uri = u'%s/%s' % (domain, uri)
+            altname = makeAltName(title)
+            digest = contentHash(title, full, facets)
+            # same hidden text as HypyIndexer.makeDocument, for the same
+            # weighting of titles and exact names
+            hidden = title + u' ' + (altname + u' ') * 6
+            attributes = dict(facets)
+            attributes.update({u'altname': altname, u'digest': digest})
+            writer.addDocument(uri, title, domain, full, hidden, attributes)
+
+            oldDigest = indexed.pop(uri, None)
+            if oldDigest is None:
+                added = added + 1
+            elif oldDigest != digest:
+                replaced = replaced + 1
+
+        writer.write(self.path)
+        bumpGeneration(self.path)
+
+        if not beQuiet:
+            sys.stdout.write("%s documents" % (len(writer.records),))
+        return added, replaced, len(indexed)
 
-        estdb.putDoc(doc, 0)
+
+INDEXERS = {'hypy': HypyIndexer, 'postings': PostingsIndexer}
+
+
+FRACTION_RX = re.compile(r'^\s*\d+\s*/\s*\d+\s*$')
+
+def parseFacetFilter(value):
+    """
+    Convert a facet filter from the command line into the form find() takes:
+    u"3-5" is the range (3.0, 5.0), u"3-" or u"-5" are open ranges, u"3" is
+    3.0, u"1/2" is a challenge rating, 0.5, and anything else is a string
+
+    Raises UsageError for a fraction that is not a challenge rating
+    """
+    def number(s):
+        if s == u'':
+            return None
+        if FRACTION_RX.match(s):
+            try:
+                return float(parseChallengeRating(s.replace(u' ', u''))[0][0])
+            except (ValueError, ZeroDivisionError):
+                raise usage.UsageError("** %s is not a challenge rating" % (
+                    s.strip(),))
+        return float(s)
+    try:
+        if u'-' in value:
+            lo, hi = value.rsplit(u'-', 1)
+            return (number(lo), number(hi))
+        return number(value)
+    except ValueError:
+        return value
 
 
 class Options(usage.Options):
     optParameters = [
             ['system', None, u'D20 SRD', 'Game system to search inside of, or index'],
             ['fact', None, u'monster', 'Fact Domain (monster, spell, item...) to search inside of'],
+            ['serve', None, None, 'Serve queries from warm indexes on this UNIX socket path'],
+            ['jobs', 'j', 1, 'Number of worker processes that extract text while building the index', int],
+            ['backend', None, None, 'Search backend, hypy or postings (default: hypy, if it is installed)'],
+            ['order', None, None, 'Sort hits by this numeric facet, or descending by -facet'],
             ]
     optFlags = [
             ['build-index', 'b', 'Build a fresh index'],
+            ['update-index', 'u', 'Re-index only the documents that changed since the index was built'],
+            ['complete', 'c', 'Autocomplete the names of facts in the system from the terms'],
             ['full-document', 'f', 'Display the entire document for each hit'],
             ]
 
@@ -145,6 +718,20 @@ class Options(usage.Options):
         # getdefaultencoding version
         return unicode(s)
 
+    def __init__(self):
+        usage.Options.__init__(self)
+        self['filters'] = {}
+
+    def opt_filter(self, spec):
+        """
+        Only find things with this facet value, e.g. --filter type=undead,
+        --filter cr=3-5, --filter cr=3- (repeatable)
+        """
+        if '=' not in spec:
+            raise usage.UsageError("** --filter takes facet=value")
+        name, value = map(self.decode, spec.split('=', 1))
+        self['filters'][name] = parseFacetFilter(value)
+
     def parseArgs(self, *terms):
         self['terms'] = map(self.decode, terms)
 
@@ -154,27 +741,41 @@ class Options(usage.Options):
                                     # import from search, this module)
 
         system = fact.systems[self['system']]
-        idir = system.searchIndexPath
+        backend = self['backend'] or defaultBackend()
+        if backend not in INDEXERS:
+            raise usage.UsageError("** Unknown backend %s" % (backend,))
+        idir = indexPath(system, backend)
 
         domain = self.decode(self['fact'])
 
-        if self['build-index']:
-            try:
-                shutil.rmtree(idir)
-            except EnvironmentError, e:
-                pass
+        if self['serve']:
+            from playtools import searchserver
+            searchserver.serve(self['serve'])
+
+        elif self['build-index']:
+            service.closeIndex(idir)
+            removeIndex(idir)
 
-            system = fact.systems[self['system']]
-            indexer = HypyIndexer(system.searchIndexPath)
+            indexer = INDEXERS[backend](idir)
             for name, collection in system.facts.items():
                 print '%s:'%(name,),
-                indexer.buildIndex(collection)
+                indexer.buildIndex(collection, jobs=self['jobs'])
 
-        else:
-            estdb = hypy.HDatabase(autoflush=False)
-            estdb.open(idir, 'r')
+        elif self['update-index']:
+            service.closeIndex(idir)
+            indexer = INDEXERS[backend](idir)
+            for name, collection in system.facts.items():
+                print '%s:'%(name,),
+                indexer.updateIndex(collection, jobs=self['jobs'])
+                print
 
-            for hit in find(estdb, domain, self['terms']):
+        elif self['complete']:
+            for uri, name in system.completions(u' '.join(self['terms'])):
+                print '<%s> %s' % (uri, name)
+
+        else:
+            for hit in find(service.openIndex(idir), domain, self['terms'],
+                    filters=self['filters'], order=self['order']):
                 print '<%s> %s' % (hit[u'@uri'], hit[u'@name'])
                 if self['full-document']:
                     for line in hit.encode('utf-8').splitlines():
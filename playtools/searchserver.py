@@ -0,0 +1,115 @@
+"""
+Local search daemon which answers queries from warm indexes over a UNIX socket
+
+The protocol is line-oriented JSON.  Each request is one line:
+
+    {"system": "D20 SRD", "fact": "monster", "terms": ["gob"], "max": 10}
+
+optionally with facet filters and an order, as taken by search.find:
+
+    {..., "filters": {"cr": [3, 5], "type": "undead"}, "order": "-cr"}
+
+and each response is one line:
+
+    {"hits": [{"uri": "monster/301", "name": "Goblin"}, ...]}
+
+or, if the request could not be answered:
+
+    {"error": "..."}
+"""
+import socket
+import json
+
+from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import Factory
+
+from playtools import search
+
+
+class SearchProtocol(LineReceiver):
+    """
+    Answer one search request per line, using the search service's
+    long-lived index handles
+    """
+    delimiter = '\n'
+
+    def lineReceived(self, line):
+        try:
+            request = json.loads(line)
+            hits = self.factory.find(request[u'system'], request[u'fact'],
+                    request[u'terms'], request.get(u'max', 10),
+                    request.get(u'filters'), request.get(u'order'))
+            response = {u'hits': hits}
+        except Exception, e:
+            response = {u'error': unicode(e)}
+        self.sendLine(json.dumps(response))
+
+
+class SearchFactory(Factory):
+    """
+    Factory for SearchProtocol.  Looks up game systems by name in systems
+    (which defaults to playtools.fact.systems) and searches them with service.
+    """
+    protocol = SearchProtocol
+
+    def __init__(self, systems=None, service=None):
+        if systems is None:
+            from playtools import fact
+            systems = fact.systems
+        if service is None:
+            service = search.service
+        self.systems = systems
+        self.service = service
+
+    def find(self, systemName, domain, terms, max=10, filters=None,
+            order=None):
+        """
+        Search and return the hits as a list of simple dicts
+        """
+        system = self.systems[systemName]
+        if filters:
+            # JSON has no tuples; ranges come in as lists
+            filters = dict((k, tuple(v) if isinstance(v, list) else v) for
+                    (k, v) in filters.items())
+        hits = self.service.find(system, domain, terms, max, filters, order)
+        return [{u'uri': h[u'@uri'], u'name': h[u'@name']} for h in hits]
+
+
+def serve(socketPath, reactor=None):
+    """
+    Listen on socketPath and answer queries until the reactor stops
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    reactor.listenUNIX(socketPath, SearchFactory())
+    reactor.run()
+
+
+def remoteFind(socketPath, system, domain, terms, max=10, filters=None,
+        order=None):
+    """
+    Blocking client for the search daemon listening on socketPath.  Returns
+    a list of (uri, name) pairs.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+        request = dict(system=system, fact=domain, terms=terms, max=max)
+        if filters:
+            request.update(filters=filters)
+        if order:
+            request.update(order=order)
+        sock.sendall(json.dumps(request) + '\n')
+        data = ''
+        while not data.endswith('\n'):
+            chunk = sock.recv(8192)
+            if not chunk:
+                break
+            data = data + chunk
+    finally:
+        sock.close()
+
+    response = json.loads(data)
+    if u'error' in response:
+        raise RuntimeError(response[u'error'])
+    return [(h[u'uri'], h[u'name']) for h in response[u'hits']]
@@ -0,0 +1,359 @@
+"""
+Read-only binary snapshots of an RDF graph
+
+A snapshot file holds every term of a graph once, in a sorted term table,
+and every triple three times as integer term ids, sorted in SPO, POS and OSP
+order.  SnapshotGraph memory-maps the file, so opening one costs next to
+nothing, any triple pattern is a binary search in one of the three arrays,
+and processes opening the same snapshot share its pages.
+
+The triples inside N3 formulae (the quoted graphs of rules) are few, and
+are stored separately, as (s, p, o, formula) records; they are loaded into
+memory when the snapshot is opened.
+
+Layout (all integers are unsigned 32-bit little-endian):
+
+    header      magic, term count, triple count, quoted triple count,
+                namespace bytes
+    offsets     term count + 1 offsets into the term data
+    term data   encoded terms, in sorted order, padded to 4 bytes
+    spo         triple count (s, p, o) records
+    pos         triple count records of the same triples, as (p, o, s)
+    osp         ... and as (o, s, p)
+    quoted      quoted triple count (s, p, o, formula) records
+    namespaces  prefix NUL uri NUL prefix NUL uri ... in UTF-8
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+from rdflib import URIRef, BNode, Literal, Variable, plugin
+from rdflib.Graph import ConjunctiveGraph, QuotedGraph
+from rdflib.store import Store, VALID_STORE
+
+
+MAGIC = 'PTSNAP\x00\x02'
+HEADER = struct.Struct('<8sIIII')
+RECORD = struct.Struct('<3I')
+QUOTED = struct.Struct('<4I')
+
+# the position of s, p and o in the records of each index, in the order the
+# indexes are stored
+ORDERS = [(0, 1, 2), (1, 2, 0), (2, 0, 1)]
+
+
+def encodeTerm(term):
+    """
+    The bytes by which term is stored in the term table
+    """
+    if isinstance(term, QuotedGraph):
+        return 'F' + encodeTerm(term.identifier)
+    elif isinstance(term, Variable):
+        return 'V' + term.encode('utf-8')
+    elif isinstance(term, Literal):
+        return 'L' + u'\0'.join([term, term.language or u'',
+            term.datatype or u'']).encode('utf-8')
+    elif isinstance(term, BNode):
+        return 'B' + term.encode('utf-8')
+    elif isinstance(term, URIRef):
+        return 'U' + term.encode('utf-8')
+    raise TypeError("%r cannot be stored in a snapshot" % (term,))
+
+
+def decodeTerm(data, store=None):
+    """
+    The term stored in the term table as data.  Formulae are decoded as
+    QuotedGraphs on store.
+    """
+    if data[0] == 'F':
+        return QuotedGraph(store, decodeTerm(data[1:]))
+    kind, text = data[0], data[1:].decode('utf-8')
+    if kind == 'U':
+        return URIRef(text)
+    elif kind == 'B':
+        return BNode(text)
+    elif kind == 'V':
+        return Variable(text)
+    text, language, datatype = text.rsplit(u'\0', 2)
+    return Literal(text, lang=language or None,
+            datatype=datatype and URIRef(datatype) or None)
+
+
+def _uint32s(numbers):
+    """
+    The bytes of an array of numbers, as little-endian unsigned 32-bit ints
+    """
+    a = array('I', numbers)
+    assert a.itemsize == 4, "array('I') is not 32 bits on this platform"
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tostring()
+
+
+def writeSnapshot(graph, filename):
+    """
+    Write every triple and namespace of graph, and the triples of the N3
+    formulae in it, to a snapshot at filename.  The file is replaced
+    atomically, so processes that have the old snapshot open keep reading
+    the old one.
+
+    @return the number of triples written, counting those in formulae
+    """
+    triples = set()
+    quoted = set()
+    terms = set()
+    formulae = []
+    def encode(term):
+        if isinstance(term, QuotedGraph):
+            formulae.append(term)
+        return encodeTerm(term)
+
+    for triple in graph.triples((None, None, None)):
+        encoded = tuple(map(encode, triple))
+        triples.add(encoded)
+        terms.update(encoded)
+
+    seen = set()
+    while formulae:
+        formula = formulae.pop()
+        f = encodeTerm(formula)
+        if f in seen:
+            continue
+        seen.add(f)
+        for triple in formula.triples((None, None, None)):
+            encoded = tuple(map(encode, triple))
+            quoted.add(encoded + (f,))
+            terms.update(encoded)
+
+    terms = sorted(terms)
+    ids = dict((t, n) for n, t in enumerate(terms))
+    records = [(ids[s], ids[p], ids[o]) for s, p, o in triples]
+    quotedRecords = sorted([ids[t] for t in q] for q in quoted)
+
+    offsets = [0]
+    for t in terms:
+        offsets.append(offsets[-1] + len(t))
+    termData = ''.join(terms)
+    termData = termData + '\0' * (-len(termData) % 4)
+
+    namespaces = []
+    for prefix, uri in sorted(graph.namespaces()):
+        namespaces.extend([prefix, uri])
+    namespaceData = u'\0'.join(namespaces).encode('utf-8')
+
+    temp = filename + '.tmp'
+    f = open(temp, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, len(terms), len(records),
+            len(quotedRecords), len(namespaceData)))
+        f.write(_uint32s(offsets))
+        f.write(termData)
+        for order in ORDERS:
+            f.write(_uint32s(n for r in sorted([r[i] for i in order]
+                for r in records) for n in r))
+        f.write(_uint32s(n for r in quotedRecords for n in r))
+        f.write(namespaceData)
+    finally:
+        f.close()
+    os.rename(temp, filename)
+    return len(records) + len(quotedRecords)
+
+
+class SnapshotStore(Store):
+    """
+    rdflib Store answering from a snapshot file.  Triples and namespace
+    bindings added to it are kept in memory, on top of the snapshot;
+    triples in the snapshot cannot be removed.
+
+    The snapshot's triples are in no context, so they are seen by the whole
+    (conjunctive) graph but not through any one context of it.  The triples
+    of its formulae are loaded into memory, in the QuotedGraph contexts they
+    belong to.
+    """
+    context_aware = True
+
+    def __init__(self, filename):
+        Store.__init__(self)
+        self.filename = filename
+        self.added = plugin.get('IOMemory', Store)()
+        self._terms = {}
+
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.termCount, self.tripleCount, quotedCount,
+                namespaceBytes) = HEADER.unpack_from(self._map, 0)
+        assert magic == MAGIC, "%s is not a snapshot" % (filename,)
+
+        self._offsetBase = HEADER.size
+        self._termBase = self._offsetBase + 4 * (self.termCount + 1)
+        termBytes = self._offset(self.termCount)
+        self._indexBase = self._termBase + termBytes + (-termBytes % 4)
+        indexBytes = RECORD.size * self.tripleCount
+        quotedBase = self._indexBase + 3 * indexBytes
+        namespaceBase = quotedBase + QUOTED.size * quotedCount
+
+        for n in xrange(quotedCount):
+            s, p, o, formula = map(self.term, QUOTED.unpack_from(self._map,
+                quotedBase + QUOTED.size * n))
+            self.added.add((s, p, o), formula, quoted=True)
+
+        self._namespaces = {}
+        if namespaceBytes:
+            data = self._map[namespaceBase:namespaceBase + namespaceBytes]
+            split = data.decode('utf-8').split(u'\0')
+            for prefix, uri in zip(split[::2], split[1::2]):
+                self._namespaces[prefix] = URIRef(uri)
+
+    def open(self, configuration, create=False):
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        self._map.close()
+        self._file.close()
+
+    def _offset(self, n):
+        return struct.unpack_from('<I', self._map, self._offsetBase + 4 * n)[0]
+
+    def _termData(self, n):
+        start = self._termBase + self._offset(n)
+        return self._map[start:self._termBase + self._offset(n + 1)]
+
+    def term(self, n):
+        """
+        The term with id n
+        """
+        if n not in self._terms:
+            self._terms[n] = decodeTerm(self._termData(n), self)
+        return self._terms[n]
+
+    def termId(self, term):
+        """
+        The id of term, or None if the snapshot does not contain it
+        """
+        try:
+            data = encodeTerm(term)
+        except TypeError:
+            return None
+        lo, hi = 0, self.termCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._termData(mid) < data:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.termCount and self._termData(lo) == data:
+            return lo
+        return None
+
+    def _record(self, index, n):
+        return RECORD.unpack_from(self._map, self._indexBase +
+                RECORD.size * (index * self.tripleCount + n))
+
+    def _bisect(self, index, key, after):
+        """
+        The first record in index whose leading fields are >= key (or > key,
+        when after is true)
+        """
+        lo, hi = 0, self.tripleCount
+        k = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            leading = self._record(index, mid)[:k]
+            if leading < key or (after and leading == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def snapshotTriples(self, triple):
+        """
+        Generate the triples in the snapshot matching the pattern triple
+        """
+        ids = []
+        for term in triple:
+            if term is None:
+                ids.append(None)
+                continue
+            n = self.termId(term)
+            if n is None:
+                return
+            ids.append(n)
+
+        # use the index whose leading fields are the bound positions
+        for index, order in enumerate(ORDERS):
+            key = []
+            for position in order:
+                if ids[position] is None:
+                    break
+                key.append(ids[position])
+            if len(key) == len(ids) - ids.count(None):
+                break
+        key = tuple(key)
+
+        start = self._bisect(index, key, False)
+        end = self._bisect(index, key, True) if key else self.tripleCount
+        for n in xrange(start, end):
+            record = self._record(index, n)
+            spo = [None, None, None]
+            for position, id in zip(order, record):
+                spo[position] = id
+            yield tuple(map(self.term, spo))
+
+    def add(self, triple, context, quoted=False):
+        if not quoted:
+            for t in self.snapshotTriples(triple):
+                return
+        self.added.add(triple, context, quoted)
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+    def remove(self, triple, context=None):
+        if context is None:
+            for t in self.snapshotTriples(triple):
+                raise TypeError("%s is read-only, %r cannot be removed" % (
+                    self.filename, t))
+        self.added.remove(triple, context)
+
+    def triples(self, triple, context=None):
+        if context is None:
+            for t in self.snapshotTriples(triple):
+                yield t, iter(())
+        for t, contexts in self.added.triples(triple, context):
+            yield t, contexts
+
+    def __len__(self, context=None):
+        if context is None:
+            return self.tripleCount + len(self.added)
+        return self.added.__len__(context)
+
+    def contexts(self, triple=None):
+        return self.added.contexts(triple)
+
+    def bind(self, prefix, namespace):
+        self._namespaces[prefix] = namespace
+
+    def prefix(self, namespace):
+        for prefix, uri in self._namespaces.items():
+            if uri == namespace:
+                return prefix
+        return None
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def namespaces(self):
+        return self._namespaces.iteritems()
+
+
+class SnapshotGraph(ConjunctiveGraph):
+    """
+    A graph backed by the snapshot at filename, which can be given to
+    TriplesDatabase.open as the graphClass
+    """
+    def __init__(self, filename):
+        ConjunctiveGraph.__init__(self, store=SnapshotStore(filename))
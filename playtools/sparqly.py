@@ -7,9 +7,13 @@ Utilities for using rdfalchemy with playtools
 """
 
 import os.path
+import re
 import hashlib
 import random
 import contextlib
+import threading
+import time
+from itertools import islice
 
 try:
     from cStringIO import StringIO
@@ -21,6 +25,9 @@ except ImportError:
 from rdflib import URIRef, BNode, Literal
 from rdflib.Graph import ConjunctiveGraph as Graph
 from rdflib.Literal import Literal as RDFLiteral
+from rdflib.Graph import QuotedGraph
+from rdflib.store.SQLite import SQLite as SQLiteStore, regexp
+from rdflib.sparql.bison import Parse
 
 from rdfalchemy.descriptors import rdfAbstract, rdfSingle
 from rdfalchemy.rdfsSubject import rdfsClass
@@ -28,6 +35,7 @@ from rdfalchemy.rdfSubject import rdfSubject
 from rdfalchemy.orm import mapper, allsub
 
 from playtools.common import RDFSNS, a as RDF_a
+from playtools.util import LRUCache, holdsHandles
 
 
 def select(base, rest):
@@ -75,13 +83,57 @@ def canBeLiteral(x):
 
 
 class TriplesDatabase(object):
-    """A database from the defined triples"""
+    """
+    A database from the defined triples
+
+    generation counts the changes made to the graph through this object;
+    what is cached about the graph (parsed queries, namespace bindings and,
+    after cacheResults, query results) is only kept for one generation.
+    """
+    parsedCacheSize = 256
+
     def __init__(self):
         self._open = False
+        self.generation = 0
+        self._parsed = LRUCache(self.parsedCacheSize)
+        self._namespaces = None
+        self.results = None
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """
+        Start a new generation, because the graph has been changed
+        """
+        with self._lock:
+            self.generation = self.generation + 1
+            self._parsed.clear()
+            self._namespaces = None
+            if self.results is not None:
+                self.results.clear()
+
+    def cacheResults(self, maxSize=1000):
+        """
+        Remember the results of the last maxSize distinct queries (text and
+        bindings), or stop remembering them if maxSize is 0.  self.results
+        is then the LRUCache, whose hits and misses tell how well the cache
+        is sized.
+
+        Only changes made through this object clear the cache, so don't use
+        it while writing to self.graph some other way.
+        """
+        with self._lock:
+            if maxSize:
+                self.results = LRUCache(maxSize)
+            else:
+                self.results = None
 
     def open(self, filename, graphClass=None):
         """
         Load existing database at 'filename'.
+
+        If graphClass is given, the graph is graphClass(filename) (e.g.
+        snapshot.SnapshotGraph), or graphClass() if there is no filename;
+        otherwise filename is a SQLite-backed store.
         """
         if filename is None:
             if graphClass is None:
@@ -92,31 +144,80 @@ class TriplesDatabase(object):
             assert os.path.exists(filename), (
                     "%s must be an existing database" % (filename,))
 
-            path, filename = os.path.split(filename)
-            self.graph = sqliteBackedGraph(path, filename)
+            if graphClass is None:
+                path, filename = os.path.split(filename)
+                self.graph = sqliteBackedGraph(path, filename)
+            else:
+                self.graph = graphClass(filename)
 
         self._open = True
+        self.changed()
 
     def query(self, rest, initNs=None, initBindings=None):
         """
         Execute a SPARQL query and get the results as a SPARQLResult
 
         {rest} is a string that should begin with "SELECT ", usually
+
+        After cacheResults, a query that was run before in this generation
+        with the same bindings returns the same SPARQLResult again.
         """
         assert self._open
 
         if initNs is None:
-            initNs = dict(self.graph.namespaces()) 
+            initNs = self.namespaces()
+            nsKey = None
+        else:
+            nsKey = tuple(sorted(initNs.items()))
         if initBindings is None: initBindings = {}
 
-        sel = select(self.getBase(), rest)
-        ret = self.graph.query(sel, initNs=initNs, initBindings=initBindings,
-                DEBUG=False)
+        results = self.results
+        if results is not None:
+            key = (rest, nsKey, frozenset(initBindings.items()))
+            with self._lock:
+                ret = results.get(key)
+                generation = self.generation
+            if ret is not None:
+                return ret
+
+        parsed = self.parse(rest, nsKey)
+        ret = self.graph.query(parsed, initNs=initNs,
+                initBindings=initBindings, DEBUG=False)
+
+        if results is not None:
+            with self._lock:
+                # the graph may have changed while the query ran
+                if self.generation == generation:
+                    results[key] = ret
         return ret
 
+    def parse(self, rest, nsKey=None):
+        """
+        The parsed form of the query {rest}, parsing it only the first time
+        it is asked for in this generation.
+
+        rdflib copies initNs into a parsed query's prefixes the first time it
+        runs, so queries run with explicit initNs are cached by nsKey too.
+        """
+        key = (rest, self.getBase(), nsKey)
+        with self._lock:
+            parsed = self._parsed.get(key)
+        if parsed is None:
+            parsed = Parse(select(key[1], rest))
+            with self._lock:
+                self._parsed[key] = parsed
+        return parsed
+
+    def namespaces(self):
+        """
+        The graph's namespace bindings, as a dict read once per generation
+        """
+        if self._namespaces is None:
+            self._namespaces = dict(self.graph.namespaces())
+        return self._namespaces
+
     def getBase(self):
-        d = dict(self.graph.namespaces())
-        return d.get('', RDFSNS)
+        return self.namespaces().get('', RDFSNS)
 
     def addTriple(self, s, v, *objects):
         """
@@ -150,16 +251,57 @@ class TriplesDatabase(object):
 
             assert None not in [s,v,o]
             self.graph.add((s, v, o))
+        self.changed()
 
     def dump(self):
+        """
+        The whole graph as a string of N3, from rdflib's serializer.  Use
+        dumpTo for big graphs.
+        """
         assert self._open
         io = StringIO()
-        try:
-            self.graph.serialize(destination=io, format='n3')
-        except Exception, e:
-            import sys, pdb; pdb.post_mortem(sys.exc_info()[2])
+        self.graph.serialize(destination=io, format='n3')
         return io.getvalue()
 
+    def dumpTo(self, fileobj, format='nt'):
+        """
+        Write the graph to fileobj as N-Triples (format='nt') or N3
+        (format='n3'), a triple or a subject at a time as the store yields
+        them, so memory use does not grow with the size of the graph.
+
+        The N3 uses the graph's namespace prefixes, and writes each run of
+        triples the store yields about one subject as one statement.
+        """
+        assert self._open
+        triples = self.graph.triples((None, None, None))
+        if format == 'nt':
+            for s, p, o in triples:
+                fileobj.write('%s %s %s .\n' % (ntTerm(s), ntTerm(p),
+                    ntTerm(o)))
+        elif format == 'n3':
+            prefixes = {}
+            for pfx, uri in sorted(self.graph.namespaces()):
+                fileobj.write(('@prefix %s: <%s>.\n' % (pfx, uri)
+                    ).encode('utf-8'))
+                prefixes.setdefault(unicode(uri), pfx)
+            n3 = lambda term: n3Term(term, prefixes)
+
+            subject = None
+            for s, p, o in triples:
+                if s != subject:
+                    if subject is not None:
+                        fileobj.write('.\n')
+                    subject = s
+                    line = u'\n%s %s %s' % (n3(s), n3(p), n3(o))
+                else:
+                    line = u';\n    %s %s' % (n3(p), n3(o))
+                fileobj.write(line.encode('utf-8'))
+            if subject is not None:
+                fileobj.write('.\n')
+        else:
+            raise ValueError("Cannot dump as %r, only 'nt' or 'n3'" % (
+                format,))
+
     def extendGraphFromFile(self, graphFile):
         """
         Add all the triples in graphFile to my graph
@@ -170,6 +312,7 @@ class TriplesDatabase(object):
         """
         assert self._open
         extendGraphFromFile(self.graph, graphFile)
+        self.changed()
 
     def extendGraph(self, graph):
         """
@@ -177,17 +320,152 @@ class TriplesDatabase(object):
         """
         assert self._open
         TriplesDatabase.extendRawGraph(self.graph, graph)
+        self.changed()
 
     @classmethod
     def extendRawGraph(cls, orig, additional):
-        # add each triple
-        # FIXME - this should use addN
-        for s,v,o in additional:
-            orig.add((s,v,o))
+        bulkLoad(orig, additional, commit=False)
 
     def commit(self):
         assert self._open
         self.graph.commit()
+        self.changed()
+
+
+NT_ESCAPES = {u'\\': u'\\\\', u'"': u'\\"', u'\n': u'\\n', u'\r': u'\\r',
+        u'\t': u'\\t'}
+NT_ESCAPE_RX = re.compile(ur'[\\"\n\r\t]|[^\x20-\x7e]')
+
+def _ntEscape(m):
+    c = m.group(0)
+    if c in NT_ESCAPES:
+        return NT_ESCAPES[c]
+    elif ord(c) > 0xffff:
+        return u'\\U%08X' % (ord(c),)
+    return u'\\u%04X' % (ord(c),)
+
+def ntEscape(text):
+    """
+    text escaped as N-Triples requires, which leaves it pure ASCII
+    """
+    return NT_ESCAPE_RX.sub(_ntEscape, text).encode('ascii')
+
+
+def ntTerm(term):
+    """
+    The N-Triples form of term
+    """
+    if isinstance(term, Literal):
+        ret = '"%s"' % (ntEscape(term),)
+        if term.language:
+            return '%s@%s' % (ret, term.language)
+        elif term.datatype:
+            return '%s^^<%s>' % (ret, ntEscape(term.datatype))
+        return ret
+    elif isinstance(term, BNode):
+        return '_:%s' % (term,)
+    return '<%s>' % (ntEscape(term),)
+
+
+QNAME_RX = re.compile(r'^(.*[/#])([A-Za-z_][A-Za-z0-9_-]*)$')
+
+def n3Term(term, prefixes):
+    """
+    The N3 form of term, as a qname if prefixes (a dict of namespace URI to
+    prefix) has its namespace, otherwise escaped as in N-Triples
+    """
+    if isinstance(term, URIRef):
+        m = QNAME_RX.match(term)
+        if m and m.group(1) in prefixes:
+            return u'%s:%s' % (prefixes[m.group(1)], m.group(2))
+    if isinstance(term, (URIRef, BNode, Literal)):
+        return ntTerm(term)
+    return term.n3()
+
+
+class LazyTriplesDatabase(TriplesDatabase):
+    """
+    A TriplesDatabase that does not open filename until its graph is first
+    used.  Each thread that uses it gets a graph of its own, because the
+    SQLite-backed stores cannot be shared between threads; for a SQLite
+    store these come from a SQLiteGraphPool, self.pool.
+
+    self.graph is the graph of the thread that reads it, but rdfalchemy
+    objects keep the db they were given, so give them self.threadGraph,
+    which stands for whichever graph that is when it is used:
+
+        initRDFDatabase(database.threadGraph)
+    """
+    def __init__(self, filename, graphClass=None, wal=False):
+        TriplesDatabase.__init__(self)
+        self.filename = filename
+        self.graphClass = graphClass
+        self._local = threading.local()
+        self._open = True
+        self.pool = None
+        if filename is not None and graphClass is None:
+            self.pool = SQLiteGraphPool(filename, wal=wal)
+        self.threadGraph = ThreadGraph(self)
+        holdsHandles(self)
+
+    def _getGraph(self):
+        graph = getattr(self._local, 'graph', None)
+        if graph is None:
+            if self.pool is None:
+                TriplesDatabase.open(self, self.filename, self.graphClass)
+                graph = self._local.graph
+            else:
+                assert os.path.exists(self.filename), (
+                        "%s must be an existing database" % (self.filename,))
+                graph = self._local.graph = self.pool.reader()
+        return graph
+
+    def _setGraph(self, graph):
+        self._local.graph = graph
+
+    graph = property(_getGraph, _setGraph)
+
+    def isOpen(self):
+        """
+        Whether the graph has been opened yet in this thread
+        """
+        return getattr(self._local, 'graph', None) is not None
+
+    def forget(self):
+        """
+        Forget every graph opened so far, without closing them, so new ones
+        are opened when next used (see util.afterFork)
+
+        @return what was forgotten
+        """
+        old = self._local, self.pool
+        self._local = threading.local()
+        if self.pool is not None:
+            self.pool = SQLiteGraphPool(os.path.join(self.pool.path,
+                self.pool.filename), wal=self.pool.wal)
+        return old
+
+
+class ThreadGraph(object):
+    """
+    Stands for database.graph, the graph of the current thread, wherever
+    it is used, so one object can be shared by every thread (as
+    rdfSubject.db is)
+    """
+    def __init__(self, database):
+        self.database = database
+
+    def __getattr__(self, name):
+        return getattr(self.database.graph, name)
+
+    def __len__(self):
+        return len(self.database.graph)
+
+    def __iter__(self):
+        return iter(self.database.graph)
+
+    def __contains__(self, triple):
+        return triple in self.database.graph
 
 
 def randomPublicID():
@@ -223,6 +501,237 @@ def sqliteBackedGraph(path, filename):
     return Graph(store)
 
 
+class SQLiteGraphPool(object):
+    """
+    Graphs on the SQLite store at filename, for many threads at once.  Each
+    thread reads through a graph and connection of its own, opened on its
+    first reader() call, so reads in different threads run side by side.
+    A reader can only be used in the thread that opened it; SQLite raises
+    ProgrammingError in any other.  Those of threads that have finished are
+    dropped as new ones are opened, and closed when garbage collected.
+    Writes all go through one writer graph, one thread at a time.
+
+    With wal=True the database is switched to SQLite's write-ahead log, so
+    readers are not blocked while the writer commits.  (This is stored in
+    the database file, and SQLite 3.7 or later is needed to open it again.)
+    """
+    def __init__(self, filename, wal=False):
+        self.path, self.filename = os.path.split(filename)
+        self.wal = bool(wal)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        self._readers = {}
+        self._writer = None
+        self.writes = 0
+        self.writeWait = 0.
+
+    def _openGraph(self, shared=False):
+        """
+        A new graph on the store, which may only be used by the current
+        thread unless shared is true
+        """
+        from pysqlite2 import dbapi2
+        graph = sqliteBackedGraph(self.path, self.filename)
+        graph.graphPool = self
+        store = graph.store
+        store._db.close()
+        db = store._db = dbapi2.connect(os.path.join(self.path,
+            self.filename), check_same_thread=not shared)
+        db.create_function('regexp', 2, regexp)
+        if self.wal:
+            # pysqlite would begin a transaction first, which SQLite does
+            # not allow here
+            level, db.isolation_level = db.isolation_level, None
+            db.execute('PRAGMA journal_mode=WAL')
+            db.isolation_level = level
+        return graph
+
+    def reader(self):
+        """
+        The graph for reading in the current thread
+        """
+        graph = getattr(self._local, 'graph', None)
+        if graph is None:
+            graph = self._local.graph = self._openGraph()
+            with self._lock:
+                # the readers of threads that have finished cannot be closed
+                # here, in another thread, so they are closed when collected
+                finished = [t for t in self._readers if not t.isAlive()]
+                for t in finished:
+                    del self._readers[t]
+                self._readers[threading.currentThread()] = graph
+        return graph
+
+    @contextlib.contextmanager
+    def writer(self):
+        """
+        Hold the writer graph, in a with block; changes are committed at the
+        end of the block, or rolled back if it raises
+        """
+        start = time.time()
+        with self._writeLock:
+            self.writeWait += time.time() - start
+            if self._writer is None:
+                # used by one thread at a time, but not always the same one
+                self._writer = self._openGraph(shared=True)
+            try:
+                yield self._writer
+            except:
+                self._writer.rollback()
+                raise
+            self._writer.commit()
+            self.writes += 1
+
+    def stats(self):
+        """
+        A dict of how the pool is being used: the number of reader
+        connections open, of writes committed, and the seconds spent
+        waiting to write
+        """
+        with self._lock:
+            readers = len(self._readers)
+        return {'readers': readers, 'writes': self.writes,
+                'writeWait': self.writeWait, 'wal': self.wal}
+
+    def close(self):
+        """
+        Close the writer and the current thread's reader, and forget the
+        readers of other threads, which only they can close; they are
+        closed when collected, and threads must not use them after this.
+        """
+        with self._lock:
+            self._readers = {}
+        graphs = []
+        mine = getattr(self._local, 'graph', None)
+        if mine is not None:
+            graphs.append(mine)
+        with self._writeLock:
+            if self._writer is not None:
+                graphs.append(self._writer)
+                self._writer = None
+        for graph in graphs:
+            graph.close()
+        self._local = threading.local()
+
+
+def bulkLoad(graph, triples, context=None, chunkSize=1000, commit=True):
+    """
+    Add triples to graph a chunk of chunkSize at a time, in context (by
+    default, the graph's default context).  On a SQLite-backed graph each
+    chunk is one executemany per table, and all of them are one transaction,
+    committed at the end or rolled back on error.  With commit false, the
+    transaction is the caller's: it is neither committed nor rolled back.
+
+    @return (number of triples added, seconds taken)
+    """
+    start = time.time()
+    if context is None:
+        context = getattr(graph, 'default_context', graph)
+    store = graph.store
+    if isinstance(store, SQLiteStore):
+        addN = lambda quads: _sqliteAddN(store, quads)
+    else:
+        addN = graph.addN
+
+    count = 0
+    triples = iter(triples)
+    try:
+        while True:
+            chunk = [(s, p, o, context) for s, p, o in
+                    islice(triples, chunkSize)]
+            if not chunk:
+                break
+            addN(chunk)
+            count = count + len(chunk)
+        if commit:
+            graph.commit()
+    except:
+        if commit and isinstance(store, SQLiteStore):
+            store.rollback()
+        raise
+    return count, time.time() - start
+
+
+def _sqliteAddN(store, quads):
+    """
+    Insert quads into rdflib's SQLite store with executemany, sorting them
+    into its tables the same way its add() does.  (Its own addN cannot work:
+    AbstractSQLStore.executeSQL refuses lists of parameters.)
+    """
+    commands = {}
+    for s, p, o, context in quads:
+        quoted = isinstance(context, QuotedGraph)
+        if quoted or p != RDF_a:
+            if isinstance(o, Literal):
+                cmd, params = store.buildLiteralTripleSQLCommand(s, p, o,
+                        context, store._internedId)
+            else:
+                cmd, params = store.buildTripleSQLCommand(s, p, o, context,
+                        store._internedId, quoted)
+        else:
+            cmd, params = store.buildTypeSQLCommand(s, o, context,
+                    store._internedId)
+        commands.setdefault(cmd, []).append(map(_sqliteParam, params))
+
+    c = store._db.cursor()
+    for cmd, paramList in commands.items():
+        c.executemany(cmd.replace('%s', '?'), paramList)
+    c.close()
+
+
+def _sqliteParam(param):
+    """
+    The value the SQLite store's executeSQL would insert for param, which it
+    writes into its SQL in double quotes
+    """
+    if isinstance(param, basestring):
+        return param.replace(u'""', u'"')
+    return param
+
+
+def rdfTypes(obj):
+    """
+    The set of rdf:types of the rdfalchemy object obj, fetched once and kept
+    on obj for all of its rdfIsInstance descriptors
+    """
+    types = obj.__dict__.get('_rdfTypes')
+    if types is None:
+        types = obj.__dict__['_rdfTypes'] = set(obj.db.objects(obj.resUri,
+            RDF_a))
+    return types
+
+
+def prefetchTypes(instances, chunkSize=500):
+    """
+    Fetch the rdf:types of many rdfalchemy objects at once, for their
+    rdfIsInstance descriptors: one triples_choices per chunkSize objects
+    with the same db, which a SQLite-backed graph answers in one query.
+    Objects whose types are already known are skipped.
+
+    The types of a chunk are only stored once its query has finished, so
+    if one fails, the objects of that chunk and the rest are left to fetch
+    their own types later.
+    """
+    byDb = {}
+    for obj in instances:
+        if '_rdfTypes' not in obj.__dict__:
+            byDb.setdefault(id(obj.db), (obj.db, {}))[1].setdefault(
+                    obj.resUri, []).append(obj)
+
+    for db, byUri in byDb.values():
+        uris = byUri.keys()
+        for n in range(0, len(uris), chunkSize):
+            chunk = uris[n:n + chunkSize]
+            types = dict((uri, set()) for uri in chunk)
+            for s, p, o in db.triples_choices((chunk, RDF_a, None)):
+                if s in types:
+                    types[s].add(o)
+            for uri in chunk:
+                for obj in byUri[uri]:
+                    obj.__dict__['_rdfTypes'] = types[uri]
+
+
 class rdfIsInstance(rdfAbstract):
     """
     An rdfalchemy descriptor that makes a boolean out of Bar in this
@@ -232,7 +741,8 @@ class rdfIsInstance(rdfAbstract):
         :foo a :Bar.
 
     Does *not* check for is-a semantics at this point - just exact boolean
-    match on that class.
+    match on that class.  The types of the object are fetched by rdfTypes
+    (or prefetchTypes) once for all of these descriptors.
     """
     range_type = None
 
@@ -244,20 +754,20 @@ class rdfIsInstance(rdfAbstract):
             return self
         if self.klass in obj.__dict__:
             return obj.__dict__[self.klass]
-        ret = list(obj.db.triples((obj.resUri, RDF_a, self.klass))) and True or False 
-        obj.__dict__[self.klass] = ret
-        return ret
+        return self.klass in rdfTypes(obj)
  
     def __set__(self, obj, true_false):
         """
         Create the triple for obj
         """
         obj.__dict__[self.klass] = true_false
+        obj.__dict__.pop('_rdfTypes', None)
         obj.db.set((obj.resUri, RDF_a, self.klass))
 
     def __delete__(self, obj):
         if obj.__dict__.has_key(self.klass):
             del obj.__dict__[self.klass]
+        obj.__dict__.pop('_rdfTypes', None)
         for s,p,o in obj.db.triples((obj.resUri, RDF_a, self.klass)):
             obj.db.remove((s,p,o))
 
@@ -279,14 +789,208 @@ class rdfSingleDefault(rdfSingle):
         return r
 
 
+# what mapClasses last mapped: the rdfalchemy classes at the time
+_mapped = {}
+
+# the rdfsPTClass classes that have a db of their own
+_boundDb = set()
+
+
+class _MappingMeta(type(rdfsClass)):
+    """
+    Metaclass of rdfsPTClass, which forgets what was mapped whenever a new
+    class is defined, and keeps track of the classes a db is set on
+    """
+    def __init__(cls, name, bases, dct):
+        super(_MappingMeta, cls).__init__(name, bases, dct)
+        _mapped.clear()
+        if 'db' in dct:
+            _boundDb.add(cls)
+
+    def __setattr__(cls, name, value):
+        super(_MappingMeta, cls).__setattr__(name, value)
+        if name == 'db':
+            _boundDb.add(cls)
+
+    def __delattr__(cls, name):
+        super(_MappingMeta, cls).__delattr__(name)
+        if name == 'db':
+            _boundDb.discard(cls)
+
+
 class rdfsPTClass(rdfsClass):
     """
     Similar to rdfalchemy.rdfsSubject.rdfsClass but when .label is missing
     default to iriToTitle(resUri)
     """
+    __metaclass__ = _MappingMeta
+
     label = rdfSingleDefault(RDFSNS.label, lambda o: iriToTitle(o.resUri))
 
 
+class PrefetchedGraph(Graph):
+    """
+    A view of graph that answers triple patterns about described subjects
+    from memory.  Patterns about any other subject, and all writes, go to
+    graph.
+    """
+    def __init__(self, graph):
+        Graph.__init__(self, store=graph.store)
+        self.graph = graph
+        self.default_context = graph.default_context
+        self.described = {}
+
+    def describe(self, subjects, depth=1, chunkSize=500):
+        """
+        Fetch every triple about each of subjects, about the bnodes they
+        refer to, and about the resources they refer to up to depth links
+        away (not counting bnodes or rdf:type).  The nodes found in each
+        round are fetched with one triples_choices per chunkSize of them.
+        """
+        todo = dict((s, 0) for s in subjects)
+        while todo:
+            levels, todo = todo, {}
+            nodes = [s for s in levels if s not in self.described]
+            for n in range(0, len(nodes), chunkSize):
+                found = dict((s, []) for s in nodes[n:n + chunkSize])
+                for t in self.graph.triples_choices((found.keys(), None,
+                        None)):
+                    if t[0] in found:
+                        found[t[0]].append(t)
+                self.described.update(found)
+                for s, triples in found.items():
+                    level = levels[s]
+                    for _, p, o in triples:
+                        if isinstance(o, BNode):
+                            nextLevel = level
+                        elif (isinstance(o, URIRef) and p != RDF_a and
+                                level < depth):
+                            nextLevel = level + 1
+                        else:
+                            continue
+                        if o not in self.described and todo.get(o,
+                                nextLevel) >= nextLevel:
+                            todo[o] = nextLevel
+
+    def triples(self, triple):
+        s, p, o = triple
+        if s in self.described:
+            for t in self.described[s]:
+                if (p is None or p == t[1]) and (o is None or o == t[2]):
+                    yield t
+        else:
+            for t in self.graph.triples(triple):
+                yield t
+
+    def triples_choices(self, triple):
+        subjects, p, o = triple
+        if not isinstance(subjects, list):
+            for t in self.graph.triples_choices(triple):
+                yield t
+            return
+        rest = []
+        for s in subjects:
+            if s in self.described:
+                for t in self.triples((s, p, o)):
+                    yield t
+            else:
+                rest.append(s)
+        if rest:
+            for t in self.graph.triples_choices((rest, p, o)):
+                yield t
+
+    def add(self, triple):
+        self.described.pop(triple[0], None)
+        self.graph.add(triple)
+
+    def addN(self, quads):
+        self.described.clear()
+        self.graph.addN(quads)
+
+    def remove(self, triple):
+        if triple[0] is None:
+            self.described.clear()
+        else:
+            self.described.pop(triple[0], None)
+        self.graph.remove(triple)
+
+    def commit(self):
+        self.graph.commit()
+
+
+def graphSource(graph):
+    """
+    What graph reads from: the graph under a PrefetchedGraph or
+    ThreadGraph, or else the SQLiteGraphPool that opened graph.  The views and per-thread graphs of
+    one database all have the same source, so what is cached about the
+    database can be kept for as long as that is the source.
+    """
+    while isinstance(graph, (PrefetchedGraph, ThreadGraph)):
+        if isinstance(graph, ThreadGraph):
+            graph = graph.database.graph
+        else:
+            graph = graph.graph
+    return getattr(graph, 'graphPool', None) or graph
+
+
+def rdfDescriptors(cls):
+    """
+    The names of the rdfalchemy descriptors of cls and its superclasses
+    """
+    names = set()
+    for klass in cls.__mro__:
+        for name, attr in vars(klass).items():
+            if isinstance(attr, rdfAbstract):
+                names.add(name)
+    return sorted(names)
+
+
+def hydrate(instances, depth=1):
+    """
+    Load instances (rdfalchemy-mapped objects sharing one graph) and the
+    objects they refer to in bulk.
+
+    The closure of every instance is fetched into a PrefetchedGraph with one
+    store lookup per node, instead of one per descriptor access.  Then each
+    rdfalchemy descriptor is read so its value is cached on the instance, and
+    the same is done for each mapped object in those values, so bnodes such
+    as list cells and annotated values come back hydrated too.
+
+    @return instances, as a list
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+    graph = instances[0].db
+    if isinstance(graph, PrefetchedGraph):
+        graph = graph.graph
+    prefetched = PrefetchedGraph(graph)
+    prefetched.describe([i.resUri for i in instances], depth)
+
+    seen = set()
+    for instance in instances:
+        _hydrateOne(instance, prefetched, seen)
+    return instances
+
+
+def _hydrateOne(instance, graph, seen):
+    """
+    Point instance at graph and cache its descriptor values, recursing into
+    the values graph has described
+    """
+    if id(instance) in seen:
+        return
+    seen.add(id(instance))
+    instance.db = graph
+    for name in rdfDescriptors(type(instance)):
+        value = getattr(instance, name)
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        for v in value:
+            if isinstance(v, rdfSubject) and v.resUri in graph.described:
+                _hydrateOne(v, graph, seen)
+
+
 def extendGraphFromFile(inGraph, graphFile, format='n3'):
     """
     Add all the triples in graphFile to inGraph
@@ -303,31 +1007,56 @@ def extendGraphFromFile(inGraph, graphFile, format='n3'):
     publicID = randomPublicID()
     g2.load(graphFile, format=format, publicID=publicID)
 
-    # add each triple
-    # FIXME - this should use addN
-    for s,v,o in g2:
-        if s == URIRef(publicID):
-            inGraph.add((URIRef(''), v, o))
-        else:
-            inGraph.add((s,v,o))
+    this = URIRef(publicID)
+    def triples():
+        for s,v,o in g2:
+            if s == this:
+                yield (URIRef(''), v, o)
+            else:
+                yield (s,v,o)
+    bulkLoad(inGraph, triples(), commit=False)
+
 
+def mapClasses(force=False):
+    """
+    Map every rdfalchemy class with rdfalchemy.orm.mapper, unless that has
+    been done already and no rdfsPTClass has been defined since (or force is
+    true), and purge their class-bound 'db' attributes, which might be
+    polluted by other rdfalchemy code.  (Instance-bound attributes should not
+    be a problem since we'll be fetching new instances.)
+
+    Without force, this costs nothing per class: only the rdfsPTClass
+    classes that db was set on are purged.  Classes defined straight from
+    the rdfalchemy bases, or db set on them, are only seen with force.
+
+    @return the mapped classes
+    """
+    if force or 'classes' not in _mapped:
+        mapper()
+        classes = _mapped['classes'] = allsub(rdfSubject)
+        for sub in classes:
+            if 'db' in sub.__dict__: # hasattr returns true for superclasses,
+                                     # must check the subclass's own __dict__
+                del sub.db
+    for sub in list(_boundDb):
+        if 'db' in sub.__dict__:
+            del sub.db
+        _boundDb.discard(sub)
+    return _mapped['classes']
 
-def initRDFDatabase(graph=None):
+
+def initRDFDatabase(graph=None, remap=False):
     """
     Initialize the database of every mapped RDF class.  Returns the prior
     value of rdfSubject.db
+
+    The classes are mapped (see mapClasses) the first time, and again after
+    new ones are defined or when remap is true.  Any db set on an
+    rdfsPTClass is removed every time, and on any other class when
+    remapping.
     """
-    mapper()
+    mapClasses(force=remap)
     old = getattr(rdfSubject, 'db', None)
-
-    # recursively purge class-bound 'db' attributes, which might be
-    # polluted by other rdfalchemy code.  Instance-bound attributes should not
-    # be a problem since we'll be fetching new instances.
-    for sub in allsub(rdfSubject):
-        if 'db' in sub.__dict__: # hasattr returns true for superclasses, must
-                                 # check the subclass's own __dict__
-            del sub.db
-
     rdfSubject.db = graph
     return old
 
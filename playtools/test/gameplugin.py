@@ -11,7 +11,7 @@ from twisted.plugin import IPlugin
 from playtools.interfaces import (IRuleSystem, IRuleFact, IRuleCollection,
         IIndexable,
         IPublisher)
-from playtools import globalRegistry, publisherplugin
+from playtools import globalRegistry, publisherplugin, complete
 
 class BuildingsAndBadgersSystem(object):
     """
@@ -24,6 +24,15 @@ class BuildingsAndBadgersSystem(object):
     def __init__(self):
         self.facts = {}
 
+    def completions(self, text, max=10):
+        """
+        Up to max (uri, name) pairs of facts whose names complete text
+        """
+        return complete.complete(self, text, max)
+
+    def dataVersion(self):
+        return dataVersion[0]
+
 
 buildingsAndBadgers = BuildingsAndBadgersSystem()
 
@@ -46,6 +55,7 @@ class IndexableBadgerFact(object):
         self.text = fact.full_text
         self.uri = fact.id
         self.title = fact.name
+        self.facets = getattr(fact, 'facets', {})
 
 globalRegistry.register([IBadgerFact], IIndexable, '', IndexableBadgerFact)
 
@@ -61,11 +71,12 @@ class Building(object):
 
 class Badger(object):
     implements(IBadgerFact)
-    def __init__(self, id, name, text, collection):
+    def __init__(self, id, name, text, collection, facets=None):
         self.id = id
         self.name = name
         self.full_text = text
         self.collection = collection
+        self.facets = facets or {}
 
 
 class FakeFactCollection(object):
@@ -90,12 +101,28 @@ class FakeFactCollection(object):
         """
         return database[self.factName][:]
 
+    def iterate(self, batchSize=100):
+        """
+        Generate all instances of the factClass
+        """
+        return iter(database[self.factName])
+
+    def count(self):
+        return len(database[self.factName])
+
+    def names(self):
+        for item in database[self.factName]:
+            yield item.id, item.name, ()
+
     def lookup(self, k):
         items = database[self.factName]
         for item in items:
             if item.id == k or item.name == k:
                 return item
 
+    def lookupMany(self, keys):
+        return map(self.lookup, keys)
+
 buildings = FakeFactCollection('building')
 badgers = FakeFactCollection('badger')
 
@@ -121,10 +148,15 @@ class HTMLBuildingPublisher(publisherplugin.PublisherPlugin):
 htmlBuildingPublisher = HTMLBuildingPublisher(buildingsAndBadgers.name,
         buildings.factName)
 
+# tests that change database bump this
+dataVersion = [0]
+
 database = {
 'badger': [
-    Badger(u'1', u'Small Badger', u'Small, pretty badger.', badgers),
-    Badger(u'73', u'Giant Man-Eating Badger', u'Giant, hideous, bad-tempered space badger.', badgers)
+    Badger(u'1', u'Small Badger', u'Small, pretty badger.', badgers,
+        {u'cr': 0.5, u'family': [u'Animal']}),
+    Badger(u'73', u'Giant Man-Eating Badger', u'Giant, hideous, bad-tempered space badger.', badgers,
+        {u'cr': 5, u'family': [u'Magical Beast', u'Extraplanar']}),
     ],
 
 'building': [
@@ -21,6 +21,10 @@ class IMPORTTestCase(unittest.TestCase):
         import playtools.dice
         playtools.dice
 
+    def test_importComplete(self):
+        import playtools.complete
+        playtools.complete
+
     def test_importConvert(self):
         import playtools.convert
         playtools.convert
@@ -37,10 +41,22 @@ class IMPORTTestCase(unittest.TestCase):
         import playtools.fact
         playtools.fact
 
+    def test_importPostings(self):
+        import playtools.postings
+        playtools.postings
+
     def test_importSearch(self):
         import playtools.search
         playtools.search
 
+    def test_importSearchserver(self):
+        import playtools.searchserver
+        playtools.searchserver
+
+    def test_importSnapshot(self):
+        import playtools.snapshot
+        playtools.snapshot
+
     def test_importSparqly(self):
         import playtools.sparqly
         playtools.sparqly
@@ -125,6 +141,10 @@ class IMPORTTestCase(unittest.TestCase):
         import playtools.parser.treasureparser
         playtools.parser.treasureparser
 
+    def test_importScriptsPtbench(self):
+        import playtools.scripts.ptbench
+        playtools.scripts.ptbench
+
     def test_importScriptsPtconvert(self):
         import playtools.scripts.ptconvert
         playtools.scripts.ptconvert
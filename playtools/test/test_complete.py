@@ -0,0 +1,81 @@
+"""
+Test autocompletion of fact names
+"""
+from twisted.trial import unittest
+
+from playtools import complete
+from playtools.test import gameplugin
+
+
+class CompletionIndexTestCase(unittest.TestCase):
+    """
+    Complete names from an index of a few facts
+    """
+    def setUp(self):
+        self.index = index = complete.CompletionIndex()
+        index.add(u'spell/1', u'Hold Animal')
+        index.add(u'spell/2', u'Hold Person')
+        index.add(u'spell/3', u'Heal, Mass', [u'Mass Heal'])
+        index.add(u'monster/4', u'Dragon, Red', [u'Red Dragon'])
+        index.add(u'monster/5', u'Horrid Wilting')
+        index.freeze()
+
+    def test_prefix(self):
+        """
+        Names starting with the text come first, then names with a word
+        starting with it, and max is respected
+        """
+        c = self.index.complete
+        self.assertEqual(c(u'hold'), [(u'spell/1', u'Hold Animal'),
+            (u'spell/2', u'Hold Person')])
+        self.assertEqual(c(u'Hold P'), [(u'spell/2', u'Hold Person')])
+        self.assertEqual(c(u'ho', max=1), [(u'spell/1', u'Hold Animal')])
+        self.assertEqual(c(u'mass'), [(u'spell/3', u'Heal, Mass')])
+        self.assertEqual(c(u'red')[0], (u'monster/4', u'Dragon, Red'))
+        self.assertEqual(c(u'drag')[0], (u'monster/4', u'Dragon, Red'))
+        self.assertEqual(c(u'  '), [])
+
+    def test_typo(self):
+        """
+        Names that look like the text are found when nothing completes it
+        """
+        c = self.index.complete
+        self.assertEqual(c(u'horid wilting'),
+                [(u'monster/5', u'Horrid Wilting')])
+        self.assertEqual(c(u'zzzzzz'), [])
+
+    def test_system(self):
+        """
+        Game systems complete the names of the facts in all of their
+        collections
+        """
+        system = gameplugin.BuildingsAndBadgersSystem()
+        system.name = 'test completion system'
+        system.facts = {'badger': gameplugin.badgers,
+                'building': gameplugin.buildings}
+        self.assertEqual(system.completions(u'giant'),
+                [(u'badger/73', u'Giant Man-Eating Badger')])
+        self.assertEqual(system.completions(u'cas'),
+                [(u'building/2', u'Castle')])
+        self.assertEqual(system.completions(u'badg', max=5),
+                [(u'badger/1', u'Small Badger'),
+                 (u'badger/73', u'Giant Man-Eating Badger')])
+
+    def test_systemChanged(self):
+        """
+        The index of a game system is rebuilt when its data version changes
+        """
+        system = gameplugin.BuildingsAndBadgersSystem()
+        system.name = 'test changing system'
+        system.facts = {'badger': gameplugin.badgers}
+        self.assertEqual(system.completions(u'honey'), [])
+
+        badgers = gameplugin.database['badger']
+        badgers.append(gameplugin.Badger(u'99', u'Honey Badger', u'',
+            gameplugin.badgers))
+        self.addCleanup(badgers.pop)
+        self.assertEqual(system.completions(u'honey'), [])
+
+        gameplugin.dataVersion[0] += 1
+        self.assertEqual(system.completions(u'honey'),
+                [(u'badger/99', u'Honey Badger')])
@@ -1,6 +1,7 @@
 """
 We shall be able to pull facts about the srd35 system out using the API
 """
+from __future__ import with_statement
 
 import re
 import os
@@ -35,7 +36,7 @@ class SRD35TestCase(unittest.TestCase):
     Pull out the facts
     """
     def setUp(self):
-        self.oldGraph = sparqly.initRDFDatabase(d20srd35.RDFDB.graph)
+        self.oldGraph = sparqly.initRDFDatabase(d20srd35.RDFDB.threadGraph)
 
     def tearDown(self):
         sparqly.initRDFDatabase(self.oldGraph)
@@ -64,6 +65,116 @@ class SRD35TestCase(unittest.TestCase):
 
         test(10, monsters, u'Behemoth Eagle')
         test(10, spells, u'Surelife')
+        test(u'Behemoth Eagle', monsters, u'Behemoth Eagle')
+        test(u'behemoth eagle', monsters, u'Behemoth Eagle')
+        test(u'Heal, Mass', spells, u'Heal, Mass')
+        test(u'heal mass', spells, u'Heal, Mass')
+        self.assertEqual(spells.lookup(u'no such spell'), None)
+        self.assertEqual(spells.lookup(99999), None)
+
+    def test_resolveRebuilt(self):
+        """
+        The index that names are resolved in is built once, and again when
+        the SQL database changes
+        """
+        spells = SRD.facts['spell']
+        builds = []
+        buildIndex = spells.buildIndex
+        def countedBuildIndex():
+            builds.append(1)
+            return buildIndex()
+        version = [(1, 1)]
+        self.patch(spells, 'buildIndex', countedBuildIndex)
+        self.patch(spells, '_index', None)
+        self.patch(d20srd35, 'sqlVersion', lambda: version[0])
+
+        self.assertEqual(spells.resolve(u'heal mass'), spells.resolve(
+            u'Heal, Mass'))
+        self.assertEqual(len(builds), 1)
+        version[0] = (2, 1)
+        self.assertEqual(spells.resolve(u'Surelife'), 10)
+        self.assertEqual(len(builds), 2)
+
+    def test_lookupMany(self):
+        """
+        Many facts can be looked up at once, in order, with misses as None
+        """
+        spells = SRD.facts['spell']
+        found = spells.lookupMany([10, u'heal mass', u'no such spell', u'10'])
+        self.assertEqual([f and f.name for f in found],
+                [u'Surelife', u'Heal, Mass', None, u'Surelife'])
+
+        monsters = SRD.facts['monster2']
+        found = monsters.lookupMany([MONSTER.badger, MONSTER.noSuchMonster,
+            FEAT.cleave, MONSTER.aboleth])
+        self.assertEqual([f and f.resUri for f in found],
+                [MONSTER.badger, None, None, MONSTER.aboleth])
+
+    def test_lookupManyHydrated(self):
+        """
+        Hydrated monsters give the same statblock values as lazy ones
+        """
+        monsters = SRD.facts['monster2']
+        uris = [MONSTER.badger, MONSTER.aboleth]
+        lazy = monsters.lookupMany(uris)
+        hydrated = monsters.lookupMany(uris, hydrate=True)
+        for m1, m2 in zip(lazy, hydrated):
+            self.assertTrue(isinstance(m2.db, sparqly.PrefetchedGraph))
+            self.assertEqual(m2.abilities, m1.abilities)
+            self.assertEqual(m2.saves, m1.saves)
+            self.assertEqual(m2.touchAC, m1.touchAC)
+            self.assertEqual(sorted(f.feat.resUri for f in m2.feats),
+                    sorted(f.feat.resUri for f in m1.feats))
+            self.assertEqual([[f.damage for f in g.forms] for g in
+                m2.attackGroups], [[f.damage for f in g.forms] for g in
+                m1.attackGroups])
+            for perk in list(m2.familyPerks) + list(m2.familyLanguages):
+                self.assertIdentical(perk.db, m2.db)
+            self.assertEqual(sorted((p.resUri, p.isSense) for p in
+                m2.familyPerks), sorted((p.resUri, p.isSense) for p in
+                    m1.familyPerks))
+
+    def test_iterate(self):
+        """
+        Collections can be iterated a batch at a time, giving the same facts
+        as dump
+        """
+        for name in ['spell', 'family']:
+            collection = SRD.facts[name]
+            dumped = collection.dump()
+            iterated = list(collection.iterate(batchSize=7))
+            self.assertEqual(len(iterated), collection.count())
+            self.assertEqual(sorted(map(self.factKey, iterated)),
+                    sorted(map(self.factKey, dumped)))
+
+    def test_namesRDF(self):
+        """
+        The names of RDF facts come with their other labels and their
+        altnames, and facts with no label are named for their URI
+        """
+        from rdflib import ConjunctiveGraph, Literal, RDF
+        graph = ConjunctiveGraph()
+        for fam in [d20srd35.FAM.devil, d20srd35.FAM.fey]:
+            graph.add((fam, RDF.type, d20srd35.CHAR.Family))
+        graph.add((d20srd35.FAM.devil, d20srd35.RDFSNS.label,
+            Literal(u'Devil')))
+        graph.add((d20srd35.FAM.devil, d20srd35.RDFSNS.label,
+            Literal(u'Baatezu')))
+        graph.add((d20srd35.FAM.devil, d20srd35.PROP.altname,
+            Literal(u'Lawful Fiend')))
+
+        with sparqly.usingRDFDatabase(graph):
+            names = dict((uri, (title, altnames)) for uri, title, altnames
+                    in SRD.facts['family'].names())
+        title, altnames = names[unicode(d20srd35.FAM.devil)]
+        self.assertEqual(sorted((title,) + altnames),
+                [u'Baatezu', u'Devil', u'Lawful Fiend'])
+        self.failUnless(title in (u'Baatezu', u'Devil'), title)
+        self.assertEqual(names[unicode(d20srd35.FAM.fey)], (u'Fey', ()))
+
+    @staticmethod
+    def factKey(fact):
+        return getattr(fact, 'id', None) or fact.resUri
 
     def test_lookupRDF(self):
         """
@@ -206,6 +317,31 @@ class SRD35TestCase(unittest.TestCase):
         tests(direct)
         tests(factModule)
 
+    def test_familyTable(self):
+        """
+        The FamilyTable has the perks and languages of each family and the
+        categories of each perk, and is built again when the database changes
+        """
+        graph = d20srd35.RDFDB.graph
+        table = d20srd35.familyTable(graph)
+        self.assertIdentical(d20srd35.familyTable(graph), table)
+        # e.g. the graph of hydrated objects
+        self.assertIdentical(d20srd35.familyTable(
+            sparqly.PrefetchedGraph(graph)), table)
+
+        devil = d20srd35.Family(d20srd35.FAM.devil)
+        self.assertEqual(table.languages[devil.resUri],
+                set(pluck(devil.languages, 'resUri')))
+        self.assertEqual(table.perks[devil.resUri],
+                set(pluck(devil.perks, 'resUri')))
+
+        fey = d20srd35.Family(d20srd35.FAM.fey)
+        self.assertEqual(sorted(pluck(fey.senses, 'resUri')),
+                sorted(p.resUri for p in fey.perks if p.isSense))
+
+        d20srd35.RDFDB.changed()
+        self.assertNotIdentical(d20srd35.familyTable(graph), table)
+
     def test_resistancesAndImmunities(self):
         """
         I can read off resistances and immunities from a family
@@ -246,6 +382,34 @@ class SRD35TestCase(unittest.TestCase):
         self.assertEqual(pluck(gorilla.epicFeats, 'feat', 'resUri'),
                 [FEAT.epicToughness])
 
+    def test_descriptorCache(self):
+        """
+        With cacheDescriptors, objects for the same monster share computed
+        values until the database changes
+        """
+        cache = d20srd35.cacheDescriptors(100)
+        self.addCleanup(d20srd35.cacheDescriptors, 0)
+        m = SRD.facts['monster2']
+
+        feats = m.lookup(MONSTER.behemothGorilla).acFeats
+        self.assertIdentical(m.lookup(MONSTER.behemothGorilla).acFeats, feats)
+        self.assertEqual(sorted(pluck(feats, 'feat', 'resUri')),
+                [FEAT.dodge, FEAT.mobility])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hitRate'], 0.5)
+
+        # hydrated objects read through a view of the same database
+        hydrated, = m.lookupMany([MONSTER.behemothGorilla], hydrate=True)
+        self.assertIdentical(hydrated.acFeats, feats)
+        self.assertIdentical(m.lookup(MONSTER.behemothGorilla).acFeats, feats)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        d20srd35.RDFDB.changed()
+        self.assertNotIdentical(m.lookup(MONSTER.behemothGorilla).acFeats,
+                feats)
+        self.assertEqual(cache.stats()['misses'], 2)
+
     def test_monsterSkills(self):
         """
         Verify that skills of the monster triples are accessible
@@ -0,0 +1,169 @@
+"""
+Tests for the monster_stats table
+"""
+
+import os
+
+from twisted.trial import unittest
+
+from storm import locals as SL
+
+from playtools.common import monsterNs as MONSTER
+from playtools.plugins import d20srd35stats
+from playtools.plugins.d20srd35stats import (buildMonsterStats, MonsterStats,
+        parseHitDice, statsFor, monsterTable, readMonsterTable,
+        hasMonsterStats, SOURCE_COLUMNS)
+
+
+MONSTERS = [
+    (1, u'2', u'4d8+4 (22 hp)', u'15 (+1 size, +1 Dex, +3 natural), touch 12, flat-footed 14',
+        u'Fort +5, Ref +5, Will +2', u'Str 10, Dex 13, Con 12, Int 3, Wis 12, Cha 6',
+        u'+3', u'-1', u'+1', u'Small',
+        u'Gnoll Thing', u'Bite +3 melee (1d6+1)',
+        u'Bite +3 melee (1d6+1) and 2 claws -2 melee (1d3)'),
+    (2, u'1/2', u'1d8 (4 hp)', u'10, touch 10, flat-footed 10',
+        u'Fort +0, Ref +0, Will +2', u'Str 12, Dex 10, Con -, Int -, Wis 10, Cha 1',
+        u'+0', u'+1', u'+0', u'Medium',
+        u'Zombie, Human', u'Slam +1 melee (1d6+1)',
+        u'Slam +1 melee (1d6+1) or club +2 melee (1d6+1)'),
+    (3, u'7; 9 with pack', u'12d10+60 (126 hp)', u'20 (-2 size, +12 natural), touch 8, flat-footed 20',
+        u'Fort +13, Ref +8, Will +6', u'Str 31, Dex 10, Con 21, Int 2, Wis 14, Cha 10',
+        u'+12', u'+30', u'+0', u'Huge',
+        u'Dire Bear', u'Claw +19 melee (2d4+10)',
+        u'2 claws +19 melee (2d4+10) and bite +13 melee (2d8+5)'),
+    (4, u'See text', u'See text', u'See text',
+        u'See text', u'See text',
+        u'-', u'-', u'See text', u'Varies',
+        None, u'See text', u'See text'),
+    ]
+
+
+class MonsterStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = SL.Store(SL.create_database('sqlite:'))
+        self.store.execute('CREATE TABLE monster (%s)' % (', '.join(
+            SOURCE_COLUMNS),))
+        for row in MONSTERS:
+            self.store.execute('INSERT INTO monster (%s) VALUES (%s)' % (
+                ', '.join(SOURCE_COLUMNS), ', '.join('?' * len(row))), row)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_parseHitDice(self):
+        """
+        Hit dice and hit points come from the hit_dice text
+        """
+        self.assertEqual(parseHitDice(u'4d8+4 (22 hp)'), (4., 22))
+        self.assertEqual(parseHitDice(u'1/2 d8 (2 hp)'), (.5, 2))
+        self.assertEqual(parseHitDice(u'\xbd d8 (2 hp)'), (.5, 2))
+        self.assertEqual(parseHitDice(u'd8 (4 hp)'), (1., 4))
+        self.assertEqual(parseHitDice(u'See text'), (None, None))
+
+    def test_statsFor(self):
+        """
+        Text columns become numbers, and those that do not parse, None
+        """
+        stats = statsFor(dict(zip(SOURCE_COLUMNS, MONSTERS[0])))
+        self.assertEqual((stats['cr'], stats['hd'], stats['hp']), (2., 4., 22))
+        self.assertEqual((stats['ac'], stats['touch_ac'],
+            stats['flat_footed_ac']), (15, 12, 14))
+        self.assertEqual((stats['fort'], stats['ref'], stats['will']),
+                (5, 5, 2))
+        self.assertEqual((stats['strength'], stats['charisma']), (10, 6))
+        self.assertEqual((stats['bab'], stats['grapple'],
+            stats['initiative'], stats['size_rank']), (3, -1, 1, 3))
+        self.assertEqual((stats['attack_bonus'], stats['full_attack_bonus']),
+                (3, 3))
+        self.assertEqual(stats['uri'], unicode(MONSTER.gnollThing))
+
+        stats = statsFor(dict(zip(SOURCE_COLUMNS, MONSTERS[1])))
+        self.assertEqual(stats['cr'], .5)
+        self.assertEqual(stats['constitution'], None)
+        self.assertEqual(stats['intelligence'], None)
+        self.assertEqual(stats['full_attack_bonus'], 2)
+
+        stats = statsFor(dict(zip(SOURCE_COLUMNS, MONSTERS[3])))
+        for name, value in stats.items():
+            if name != 'id':
+                self.assertEqual(value, None, name)
+
+    def test_buildMonsterStats(self):
+        """
+        The table can be range-queried and sorted in SQL, and rebuilt
+        """
+        self.assertEqual(buildMonsterStats(self.store), 4)
+        self.assertEqual(buildMonsterStats(self.store), 4)
+
+        found = self.store.find(MonsterStats, MonsterStats.cr >= 1,
+                MonsterStats.cr <= 8).order_by(SL.Desc(MonsterStats.ac))
+        self.assertEqual([m.id for m in found], [3, 1])
+
+        found = self.store.find(MonsterStats,
+                MonsterStats.size_rank >= 4).order_by(MonsterStats.hd)
+        self.assertEqual([(m.id, m.hd) for m in found], [(2, 1.), (3, 12.)])
+
+        self.assertEqual(self.store.get(MonsterStats, 4).cr, None)
+
+        indexes = self.store.execute("SELECT name FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = 'monster_stats'").get_all()
+        self.assertEqual(sorted(n for (n,) in indexes), [
+            'monster_stats_ac', 'monster_stats_cr', 'monster_stats_hd',
+            'monster_stats_size_rank'])
+
+    def test_monsterTable(self):
+        """
+        The table reads as numpy columns, with NaN for NULL, and is cached
+        for the version it was read for
+        """
+        buildMonsterStats(self.store)
+        numpy = d20srd35stats.numpy
+        table = monsterTable(self.store)
+        self.assertEqual(list(table['id']), [1, 2, 3, 4])
+        self.assertEqual(table['uri'][2], unicode(MONSTER.direBear))
+        self.assertEqual(list(table['cr'][:3]), [2., .5, 7.])
+        self.failUnless(numpy.isnan(table['cr'][3]))
+
+        wanted = (table['cr'] >= 1) & (table['cr'] <= 8)
+        self.assertEqual(list(table['id'][wanted]), [1., 3.])
+        self.assertEqual(numpy.nanmax(table['full_attack_bonus']), 19)
+
+        cachePath = self.mktemp() + '.npz'
+        monsterTable(self.store, cachePath, 'v1')
+        self.failUnless(os.path.exists(cachePath))
+        self.store.execute('DELETE FROM monster_stats WHERE id = 4')
+        cached = monsterTable(self.store, cachePath, 'v1')
+        self.assertEqual(list(cached['id']), [1, 2, 3, 4])
+        self.assertEqual(list(cached['uri']), list(table['uri']))
+        fresh = monsterTable(self.store, cachePath, 'v2')
+        self.assertEqual(list(fresh['id']), [1, 2, 3])
+
+        # the cache directory is made if need be, and a cache that cannot be
+        # written is no reason to fail
+        cachePath = os.path.join(self.mktemp(), 'cache', 'stats.npz')
+        monsterTable(self.store, cachePath, 'v1')
+        self.failUnless(os.path.exists(cachePath))
+        notADirectory = self.mktemp()
+        open(notADirectory, 'w').close()
+        cachePath = os.path.join(notADirectory, 'stats.npz')
+        self.assertEqual(list(monsterTable(self.store, cachePath, 'v1')['id']),
+                [1, 2, 3])
+
+    def test_readWithoutStatsTable(self):
+        """
+        Without a monster_stats table, as in databases installed before it
+        existed, the stats are parsed from the monster table, and nothing is
+        written to the database
+        """
+        parsed = readMonsterTable(self.store)
+        self.failIf(hasMonsterStats(self.store))
+        buildMonsterStats(self.store)
+        read = readMonsterTable(self.store)
+        self.assertEqual(sorted(parsed), sorted(read))
+        for name in read:
+            self.assertEqual(repr(list(parsed[name])), repr(list(read[name])),
+                    name)
+
+    if d20srd35stats.numpy is None:
+        test_monsterTable.skip = "numpy is not installed"
+        test_readWithoutStatsTable.skip = "numpy is not installed"
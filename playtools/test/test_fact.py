@@ -86,6 +86,17 @@ class TestFactPluginLoading(unittest.TestCase):
         self.assertEqual(len(dumped), 2)
         self.assertEqual(dumped[0].name, u'Small Badger')
 
+    def test_iterate(self):
+        """
+        We can iterate over all objects from a domain, and count them
+        """
+        game = gameplugin.BuildingsAndBadgersSystem()
+        self._importRuleCollections(game)
+        badgers = game.facts['badger']
+        self.assertEqual([b.name for b in badgers.iterate(batchSize=1)],
+                [b.name for b in badgers.dump()])
+        self.assertEqual(badgers.count(), 2)
+
 
 class TestGameSystems(unittest.TestCase):
     """
@@ -47,7 +47,7 @@ class MiscParserTest(unittest.TestCase):
         """
         Very simple family parser works
         """
-        sparqly.initRDFDatabase(RDFDB.graph)
+        sparqly.initRDFDatabase(RDFDB.threadGraph)
         self.assertEqual(misc.parseFamily("Abomination"), FAM.abomination)
         self.assertEqual(misc.parseFamily("Abnegation"), "Abnegation")
 
@@ -0,0 +1,131 @@
+"""
+Test the pure-Python postings index
+"""
+import os
+import tempfile
+import shutil
+
+from twisted.trial import unittest
+
+from playtools import postings
+
+
+class VarintTestCase(unittest.TestCase):
+    def test_roundTrip(self):
+        """
+        Integers of any size survive varint encoding
+        """
+        nums = [0, 1, 127, 128, 300, 16384, 2**31 - 1]
+        out = []
+        for n in nums:
+            postings.encodeVarint(n, out)
+        self.assertEqual(postings.decodeVarints(''.join(out)), nums)
+
+
+class PostingsIndexTestCase(unittest.TestCase):
+    """
+    Build a small index and search it
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test' + postings.SUFFIX)
+
+        writer = postings.PostingsWriter()
+        tests = [ # {{{
+                (u"Hello my pretty",         u"Ninja's Attack"),
+                (u"heal mass",               u"Heal, Mass"),
+                (u"hold animal",             u"Hold Animal"),
+                (u"horrid wilting",          u"Horrid Wilting"),
+                (u"incendiary cloud",        u"Incendiary Cloud"),
+                (u"insanity",                u"Insanity"),
+                ] # }}}
+        for n, (text, name) in enumerate(tests):
+            writer.addDocument(u'ninja/%s' % (n,), name, u'ninja', text,
+                    hiddenText=name, attributes={u'altname': name.lower(),
+                        u'level': n})
+        # a document in another domain which would match everything
+        writer.addDocument(u'pirate/0', u'Pirate', u'pirate',
+                u"hold heal horrid insanity hello")
+        writer.write(self.path)
+
+        self.index = postings.PostingsIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def uris(self, clauses, max=10, domain=u'ninja', **kw):
+        return [h[u'@uri'] for h in self.index.search(domain, clauses, max,
+            **kw)]
+
+    def test_prefix(self):
+        """
+        A clause ending with * matches words with that prefix, and max is
+        respected
+        """
+        self.assertEqual(self.uris([u'ho*']), [u'ninja/2', u'ninja/3'])
+        self.assertEqual(self.uris([u'ho*'], max=1), [u'ninja/2'])
+        self.assertEqual(self.uris([u'insan*']), [u'ninja/5'])
+        self.assertEqual(self.uris([u'hold']), [u'ninja/2'])
+        self.assertEqual(self.uris([u'hol']), [])
+
+    def test_phrase(self):
+        """
+        A clause with several words only matches them as a phrase, and every
+        clause must match
+        """
+        self.assertEqual(self.uris([u'hold animal']), [u'ninja/2'])
+        self.assertEqual(self.uris([u'animal hold']), [])
+        self.assertEqual(self.uris([u'h*', u'wil*']), [u'ninja/3'])
+        self.assertEqual(self.uris([u"ninja's*"]), [u'ninja/0'])
+
+    def test_domains(self):
+        """
+        Searches only find documents in the domain asked for
+        """
+        self.assertEqual(self.uris([u'hello*'], domain=u'pirate'),
+                [u'pirate/0'])
+        self.assertEqual(self.uris([u'hello*'], domain=u'nothing'), [])
+        self.assertEqual(len(self.uris([], max=None)), 6)
+
+    def test_documents(self):
+        """
+        Hits carry the stored attributes and text
+        """
+        hit = self.index[u'ninja/2']
+        self.assertEqual(hit[u'@name'], u'Hold Animal')
+        self.assertEqual(hit[u'altname'], u'hold animal')
+        self.assertEqual(hit.text, u'hold animal')
+        self.assertEqual(len(self.index), 7)
+
+    def test_conditions(self):
+        """
+        Hits can be limited by conditions on their attributes, and sorted by
+        an attribute
+        """
+        conditions = {u'altname': ('begin', u'ho')}
+        self.assertEqual(self.uris([], conditions=conditions),
+                [u'ninja/2', u'ninja/3'])
+        self.assertEqual(self.uris([], conditions={u'level': ('range', 2, 4)},
+            order=u'-level'), [u'ninja/4', u'ninja/3', u'ninja/2'])
+        self.assertEqual(self.uris([u'h*'], conditions={u'level':
+            ('range', None, 1)}), [u'ninja/1', u'ninja/0'])
+        self.assertFalse(postings.matchFacet(u'undead', ('range', 1, 2)))
+        self.assertTrue(postings.matchFacet(u'undead evil', ('token', u'evil')))
+
+    def test_rewrite(self):
+        """
+        Documents from other domains can be carried over into a new index
+        """
+        writer = postings.PostingsWriter()
+        writer.addIndex(self.index, skipDomain=u'ninja')
+        writer.write(self.path)
+
+        index = postings.PostingsIndex(self.path)
+        try:
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.search(u'ninja', [u'hold']), [])
+            self.assertEqual(index.search(u'pirate', [u'hold'])[0][u'@uri'],
+                    u'pirate/0')
+        finally:
+            index.close()
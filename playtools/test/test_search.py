@@ -4,31 +4,97 @@ Test search functionality
 from __future__ import with_statement
 
 import unittest
+import os
 import re
+import json
+import shutil
+import tempfile
 
-from hypy import HDatabase, CloseFailed
+try:
+    from hypy import HDatabase, CloseFailed
+except ImportError:
+    HDatabase = None
 
-from .. import search, fact
+from twisted.python import usage
+from twisted.test.proto_helpers import StringTransport
+
+from .. import search, searchserver, postings, fact
 
 from . import gameplugin, pttestutil
 
 
-class SearchTest(unittest.TestCase):
+class BadgersTestCase(unittest.TestCase):
+    """
+    Tests that use the Buildings & Badgers game system
+    """
     def setUp(self):
-        self.index = HDatabase()
-
         with pttestutil.pluginsLoadedFromTest(fact):
             systems = fact.getSystems()
             fact.importRuleCollections(systems)
 
         self.BADGERS = systems['Buildings & Badgers']
 
-    def tearDown(self):
-        try:
-            self.index.close()
-        except CloseFailed:
-            pass
 
+class FakeHDocument(dict):
+    """
+    Just enough of hypy.HDocument for HypyIndexer to build documents
+    """
+    def __init__(self, uri):
+        dict.__init__(self, {u'@uri': uri})
+
+    def addText(self, text):
+        pass
+
+    addHiddenText = addText
+
+
+class FakeHCondition(object):
+    """
+    A hypy.HCondition that matches everything
+    """
+    def __init__(self, *a, **kw):
+        pass
+
+    def addAttr(self, expression):
+        pass
+
+
+class FakeHDatabase(object):
+    """
+    Just enough of hypy.HDatabase for HypyIndexer to write an index, kept in
+    FakeHDatabase.indexes by path
+    """
+    indexes = {}
+
+    def __init__(self, autoflush=True):
+        self.docs = None
+
+    def open(self, path, mode):
+        self.docs = self.indexes.setdefault(path, {})
+
+    def putDoc(self, doc, options):
+        self.docs[doc[u'@uri']] = doc
+
+    def remove(self, uri):
+        del self.docs[uri]
+
+    def search(self, condition):
+        return self.docs.values()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.docs = None
+
+
+class FakeHypy(object):
+    HDatabase = FakeHDatabase
+    HDocument = FakeHDocument
+    HCondition = FakeHCondition
+
+
+class SearchTest(BadgersTestCase):
     def test_textFromHtml(self):
         """
         textFromHtml converts html into unicode text, and html with no text
@@ -43,6 +109,30 @@ class SearchTest(unittest.TestCase):
         self.assertEqual(type(t2), unicode)
         self.assertEqual(t2, u"")
 
+    def test_textFromHtmlLenient(self):
+        """
+        textFromHtml keeps entities, comments and script text as nodes of
+        their own, and drops whitespace-only text
+        """
+        t = search.textFromHtml
+        self.assertEqual(t(u"a &amp; b"), u"a  &amp;  b")
+        self.assertEqual(t(u"<p>one<!-- comment -->two</p>"),
+                u"one  comment  two")
+        self.assertEqual(t(u"<script>if (a<b) {x}</script>after"),
+                u"if (a<b) {x} after")
+        self.assertEqual(t(u"  leading  <p> </p> trailing "),
+                u"leading    trailing ")
+        self.assertEqual(t(u"<p a='>'>q</p>"), u"q")
+        self.assertEqual(t(u"text only"), u"text only")
+
+        # where this differs from microdom: what cannot be markup is kept as
+        # text, instead of becoming a node of its own or an error
+        self.assertEqual(t(u"a<? pi ?>b"), u"a<? pi ?>b")
+        self.assertEqual(t(u"a<?pi x?>b"), u"a b")
+        self.assertEqual(t(u"a & b"), u"a & b")
+        self.assertEqual(t(u"<1>x"), u"<1>x")
+        self.assertEqual(t(u"<p>a < b</p>"), u"a < b")
+
     def test_makeAltName(self):
         """
         makeAltName can convert title-cased text into altnames and handles
@@ -66,6 +156,192 @@ class SearchTest(unittest.TestCase):
         self.assertEqual(qt("hi there"), "hi there")
         self.assertEqual(qt("cat's"), "cat's*")
 
+    def test_extractParallel(self):
+        """
+        Extracting in worker processes gives the same documents in the same
+        order as extracting serially
+        """
+        badgers = self.BADGERS.facts['badger']
+        self.assertEqual(list(search.extractParallel(badgers, 2)),
+                list(search.extractDocuments(badgers)))
+
+    def test_postingsBackend(self):
+        """
+        The postings backend indexes the same documents and answers find()
+        the same way
+        """
+        path = self.BADGERS.searchIndexPath + postings.SUFFIX
+        search.removeIndex(path)
+        indexer = search.PostingsIndexer(path)
+        indexer.buildIndex(self.BADGERS.facts['badger'], beQuiet=True)
+        indexer.buildIndex(self.BADGERS.facts['building'], beQuiet=True)
+
+        index = postings.PostingsIndex(path)
+        try:
+            self.assertEqual(len(index), 4)
+            hits = search.find(index, u'badger', [u'giant'])
+            self.assertEqual([h[u'@uri'] for h in hits], [u'badger/73'])
+            self.assertEqual(hits[0][u'altname'], u"giant maneating badger")
+            hits = search.find(index, u'building', [u'castle'])
+            self.assertEqual([h[u'@uri'] for h in hits], [u'building/2'])
+        finally:
+            index.close()
+            search.removeIndex(path)
+
+    def test_facets(self):
+        """
+        Hits can be filtered by the facets of the documents and sorted by
+        them, and the filters are part of the cache key
+        """
+        path = self.BADGERS.searchIndexPath + postings.SUFFIX
+        search.removeIndex(path)
+        indexer = search.PostingsIndexer(path)
+        indexer.buildIndex(self.BADGERS.facts['badger'], beQuiet=True)
+
+        service = search.SearchService(backend='postings')
+        def uris(terms, filters=None, order=None):
+            hits = service.find(self.BADGERS, u'badger', terms,
+                    filters=filters, order=order)
+            return [h[u'@uri'] for h in hits]
+        try:
+            self.assertEqual(uris([u'badger'], {u'cr': (3, 5)}),
+                    [u'badger/73'])
+            self.assertEqual(uris([u'badger'], {u'cr': (None, 1)}),
+                    [u'badger/1'])
+            self.assertEqual(uris([], {u'family': u'Magical Beast'}),
+                    [u'badger/73'])
+            self.assertEqual(uris([], {u'family': u'beast'}), [])
+            self.assertEqual(uris([], {u'altname': u'*eating*'}),
+                    [u'badger/73'])
+            self.assertEqual(uris([], {u'cr': (0, 10)}, order=u'-cr'),
+                    [u'badger/73', u'badger/1'])
+            self.assertEqual(uris([], {u'cr': (0, 10)}, order=u'cr'),
+                    [u'badger/1', u'badger/73'])
+        finally:
+            service.closeIndex()
+            search.removeIndex(path)
+
+    def test_facetCondition(self):
+        """
+        Facet filters are converted to conditions the backends can evaluate
+        """
+        fc = search.facetCondition
+        self.assertEqual(fc((3, 5)), ('range', 3, 5))
+        self.assertEqual(fc(2), ('range', 2, 2))
+        self.assertEqual(fc(u'Astral Construct'),
+                ('token', u'astral-construct'))
+        self.assertEqual(fc(u'*Wight*'), ('include', u'wight'))
+        self.assertEqual(fc(u'wight*'), ('begin', u'wight'))
+        self.assertEqual(search.hypyFacetExpression(u'cr', fc((3, 5))),
+                u'cr NUMBT 3 5')
+        self.assertEqual(search.hypyFacetExpression(u'cr', fc((3, None))),
+                u'cr NUMGE 3')
+        self.assertEqual(search.hypyFacetExpression(u'type', fc(u'Undead')),
+                u'type STRAND undead')
+
+    def test_parseFacetFilter(self):
+        """
+        Numbers and ranges of them, including challenge ratings such as 1/2,
+        filter by value; other filters are strings
+        """
+        pff = search.parseFacetFilter
+        self.assertEqual(pff(u'3-5'), (3., 5.))
+        self.assertEqual(pff(u'3-'), (3., None))
+        self.assertEqual(pff(u'-5'), (None, 5.))
+        self.assertEqual(pff(u'3'), 3.)
+        self.assertEqual(pff(u'1/2'), .5)
+        self.assertEqual(pff(u'1/4-1/2'), (.25, .5))
+        self.assertEqual(pff(u'1/8-2'), (.125, 2.))
+        self.assertEqual(pff(u'Undead'), u'Undead')
+        self.assertRaises(usage.UsageError, pff, u'3/4')
+        self.assertRaises(usage.UsageError, pff, u'1/0')
+
+    def test_findMany(self):
+        """
+        findMany answers a batch of queries in order, caches the results, and
+        throws the cache away when the index is rebuilt
+        """
+        path = self.BADGERS.searchIndexPath + postings.SUFFIX
+        search.removeIndex(path)
+        indexer = search.PostingsIndexer(path)
+        indexer.buildIndex(self.BADGERS.facts['badger'], beQuiet=True)
+
+        service = search.SearchService(backend='postings')
+        try:
+            results = service.findMany(self.BADGERS, u'badger',
+                    [[u'giant'], [u'small'], [u'Giant '], [u'nothing']])
+            self.assertEqual([[h[u'@uri'] for h in r] for r in results],
+                    [[u'badger/73'], [u'badger/1'], [u'badger/73'], []])
+            self.assertEqual(service.cache.stats()['misses'], 3)
+            self.assertEqual(service.cache.stats()['hits'], 1)
+
+            indexer.buildIndex(self.BADGERS.facts['badger'], beQuiet=True)
+            service.find(self.BADGERS, u'badger', [u'giant'])
+            self.assertEqual(service.cache.stats()['misses'], 4)
+        finally:
+            service.closeIndex()
+            search.removeIndex(path)
+
+    def test_updateIndexHypyIndexer(self):
+        """
+        HypyIndexer.updateIndex replaces what changed, adds what is new and
+        removes what went away, here against a fake estraier database
+        """
+        self.addCleanup(setattr, search, 'hypy', search.hypy)
+        search.hypy = FakeHypy
+        FakeHDatabase.indexes = {}
+        _badgers = self.BADGERS.facts['badger']
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        path = os.path.join(tempDir, 'index')
+        indexer = search.HypyIndexer(path)
+        indexer.buildIndex(_badgers, beQuiet=True)
+        self.assertEqual(indexer.updateIndex(_badgers, beQuiet=True), (0, 0, 0))
+
+        original = gameplugin.database['badger'][:]
+        try:
+            small, giant = original
+            gameplugin.database['badger'][:] = [
+                gameplugin.Badger(u'73', giant.name, u'Now even more giant.',
+                    _badgers),
+                gameplugin.Badger(u'99', u'Honey Badger', u"Doesn't care.",
+                    _badgers),
+                ]
+            self.assertEqual(indexer.updateIndex(_badgers, beQuiet=True),
+                    (1, 1, 1))
+        finally:
+            gameplugin.database['badger'][:] = original
+
+        docs = FakeHDatabase.indexes[path]
+        self.assertEqual(sorted(docs), [u'badger/73', u'badger/99'])
+        self.assertEqual(docs[u'badger/73'][u'digest'],
+                search.contentHash(giant.name, u'Now even more giant.'))
+
+    def test_extractDocument(self):
+        """
+        extractDocument adapts an item and returns its picklable parts
+        """
+        badger = gameplugin.database['badger'][0]
+        self.assertEqual(search.extractDocument(badger),
+                (u'1', u'Small Badger', u'Small, pretty badger.',
+                    {u'cr': 0.5, u'family': u'animal'}))
+
+
+@unittest.skipIf(HDatabase is None, "hypy is not installed")
+class HypySearchTest(BadgersTestCase):
+    """
+    Tests of the hypy (estraier) search backend
+    """
+    def setUp(self):
+        BadgersTestCase.setUp(self)
+        self.index = HDatabase()
+
+    def tearDown(self):
+        try:
+            self.index.close()
+        except CloseFailed:
+            pass
+
     def test_indexItem(self):
         """
         indexItem indexes a single item which can be found, and make sure it's
@@ -132,3 +408,104 @@ class SearchTest(unittest.TestCase):
         self.assertEqual(len(self.index), 2)
         giantBadger = self.index[u'badger/73']
         self.assertEqual(giantBadger[u'altname'], "giant maneating badger")
+
+    def test_buildIndexParallel(self):
+        """
+        Building an index with worker processes produces the same documents
+        as building it serially
+        """
+        _badgers = self.BADGERS.facts['badger']
+        indexer = search.HypyIndexer(self.BADGERS.searchIndexPath)
+        indexer.buildIndex(_badgers, beQuiet=True, jobs=2)
+
+        self.index.open(self.BADGERS.searchIndexPath, 'r')
+        self.assertEqual(len(self.index), 2)
+        giantBadger = self.index[u'badger/73']
+        self.assertEqual(giantBadger[u'altname'], "giant maneating badger")
+        self.assertEqual(giantBadger[u'@name'], u'Giant Man-Eating Badger')
+
+    def test_updateIndex(self):
+        """
+        Updating an index only touches the documents whose content changed,
+        and removes documents that went away
+        """
+        _badgers = self.BADGERS.facts['badger']
+        indexer = search.HypyIndexer(self.BADGERS.searchIndexPath)
+        indexer.buildIndex(_badgers, beQuiet=True)
+
+        self.assertEqual(indexer.updateIndex(_badgers, beQuiet=True), (0, 0, 0))
+
+        original = gameplugin.database['badger'][:]
+        try:
+            small, giant = original
+            gameplugin.database['badger'][:] = [
+                gameplugin.Badger(u'73', giant.name, u'Now even more giant.',
+                    _badgers),
+                gameplugin.Badger(u'99', u'Honey Badger', u"Doesn't care.",
+                    _badgers),
+                ]
+            self.assertEqual(indexer.updateIndex(_badgers, beQuiet=True),
+                    (1, 1, 1))
+        finally:
+            gameplugin.database['badger'][:] = original
+
+        self.index.open(self.BADGERS.searchIndexPath, 'r')
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index[u'badger/73'][u'digest'],
+                search.contentHash(giant.name, u'Now even more giant.'))
+
+    def test_serviceReusesHandle(self):
+        """
+        The search service opens an index once and reuses the same handle for
+        every query against it
+        """
+        _badgers = self.BADGERS.facts['badger']
+        indexer = search.HypyIndexer(self.BADGERS.searchIndexPath)
+        indexer.buildIndex(_badgers, beQuiet=True)
+
+        service = search.SearchService()
+        try:
+            estdb = service.openIndex(self.BADGERS.searchIndexPath)
+            hits = service.find(self.BADGERS, u'badger', [u'giant'])
+            self.assertEqual([h[u'@uri'] for h in hits], [u'badger/73'])
+            self.assertTrue(service.openIndex(self.BADGERS.searchIndexPath) is estdb)
+        finally:
+            service.closeIndex()
+
+
+class FakeSearchService(object):
+    """
+    Stand-in for SearchService which returns canned hits
+    """
+    def find(self, system, domain, terms, max=10, filters=None, order=None):
+        return [{u'@uri': u'%s/1' % (domain,), u'@name': u' '.join(terms)}]
+
+
+class SearchProtocolTest(unittest.TestCase):
+    def setUp(self):
+        systems = {u'Buildings & Badgers': gameplugin.buildingsAndBadgers}
+        factory = searchserver.SearchFactory(systems, FakeSearchService())
+        self.proto = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.proto.makeConnection(self.transport)
+
+    def test_query(self):
+        """
+        Each line sent to the search daemon is answered with one line of hits
+        """
+        request = dict(system=u'Buildings & Badgers', fact=u'badger',
+                terms=[u'giant', u'badger'])
+        self.proto.dataReceived(json.dumps(request) + '\n')
+        response = json.loads(self.transport.value())
+        self.assertEqual(response, {u'hits': [
+            {u'uri': u'badger/1', u'name': u'giant badger'}]})
+
+    def test_badQuery(self):
+        """
+        Requests which cannot be answered get an error response, and the
+        connection stays up
+        """
+        self.proto.dataReceived('{"system": "Nope"}\n')
+        response = json.loads(self.transport.value())
+        self.assertTrue(u'error' in response)
+        self.failIf(self.transport.disconnecting)
@@ -0,0 +1,163 @@
+"""
+Test binary snapshots of RDF graphs
+"""
+import os
+
+from twisted.trial import unittest
+
+from rdflib import URIRef, BNode, Literal, ConjunctiveGraph
+from rdflib.Graph import QuotedGraph
+from rdflib.StringInputSource import StringInputSource
+from rdflib.Namespace import Namespace
+
+from playtools import snapshot, charsheet
+from playtools.common import a
+
+STAFF = Namespace('http://corp.com/staff#')
+XSD = Namespace('http://www.w3.org/2001/XMLSchema#')
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """
+    Write a small graph to a snapshot and match patterns against it
+    """
+    def setUp(self):
+        self.graph = g = ConjunctiveGraph()
+        g.bind('staff', STAFF)
+        self.boss = boss = BNode()
+        g.add((STAFF.peter, a, STAFF.Employee))
+        g.add((STAFF.peter, STAFF.firstname, Literal(u'Peter')))
+        g.add((STAFF.peter, STAFF.nickname, Literal(u'Le Gib', lang='fr')))
+        g.add((STAFF.peter, STAFF.age, Literal(u'32', datatype=XSD.integer)))
+        g.add((STAFF.peter, STAFF.supervisor, boss))
+        g.add((STAFF.bill, a, STAFF.Employee))
+        g.add((STAFF.bill, STAFF.firstname, Literal(u'Bill')))
+        g.add((boss, STAFF.firstname, Literal(u'Bill')))
+        g.add((STAFF.milton, STAFF.firstname, Literal(u'Milt\xf6n\0')))
+
+        self.path = self.mktemp()
+        self.assertEqual(snapshot.writeSnapshot(g, self.path), 9)
+        self.snap = snapshot.SnapshotGraph(self.path)
+
+    def tearDown(self):
+        self.snap.store.close()
+
+    def test_patterns(self):
+        """
+        Every triple pattern matches the same triples as in the original
+        graph
+        """
+        terms = [None, STAFF.peter, STAFF.bill, self.boss, STAFF.firstname,
+                a, Literal(u'Bill'), Literal(u'32', datatype=XSD.integer),
+                Literal(u'Le Gib', lang='fr'), Literal(u'Milt\xf6n\0'),
+                STAFF.nobody]
+        for s in terms:
+            for p in terms:
+                for o in terms:
+                    pattern = (s, p, o)
+                    self.assertEqual(sorted(self.snap.triples(pattern)),
+                            sorted(self.graph.triples(pattern)), pattern)
+        self.assertEqual(len(self.snap), 9)
+
+    def test_graph(self):
+        """
+        Snapshots work as graphs, with namespaces, SPARQL and added triples
+        """
+        self.assertEqual(dict(self.snap.namespaces())['staff'],
+                URIRef(STAFF))
+        q = "SELECT ?name { ?e a staff:Employee . ?e staff:firstname ?name }"
+        self.assertEqual(sorted(self.snap.query(q,
+            initNs={'staff': STAFF})), [(Literal(u'Bill'),),
+                (Literal(u'Peter'),)])
+
+        self.snap.add((STAFF.milton, a, STAFF.Employee))
+        self.snap.add((STAFF.peter, a, STAFF.Employee))
+        self.assertEqual(len(self.snap), 10)
+        self.assertEqual(sorted(self.snap.subjects(a, STAFF.Employee)),
+                [STAFF.bill, STAFF.milton, STAFF.peter])
+        self.snap.remove((STAFF.milton, a, None))
+        self.assertEqual(len(self.snap), 9)
+        self.assertRaises(TypeError, self.snap.remove,
+                (STAFF.peter, None, None))
+
+    def test_formulae(self):
+        """
+        The triples inside N3 formulae, nested ones too, are kept
+        """
+        g = ConjunctiveGraph()
+        g.parse(StringInputSource(RULES), format='n3')
+        path = self.mktemp()
+        snapshot.writeSnapshot(g, path)
+        snap = snapshot.SnapshotGraph(path)
+        self.addCleanup(snap.store.close)
+
+        self.assertEqual(len(snap), len(g))
+        self.assertEqual(formulaTriples(snap), formulaTriples(g))
+        self.assertEqual(len(formulaTriples(g)), 3)
+
+
+RULES = """
+@prefix staff: <http://corp.com/staff#> .
+{ ?e a staff:Employee } => { ?e staff:paid { ?e staff:wants staff:more } } .
+staff:peter a staff:Employee .
+"""
+
+def formulaTriples(graph):
+    """
+    The triples of every formula in graph, as (formula id, s, p, o) with
+    formulae replaced by their ids
+    """
+    ident = lambda x: x.identifier if isinstance(x, QuotedGraph) else x
+    found = set()
+    todo = [x for t in graph for x in t if isinstance(x, QuotedGraph)]
+    while todo:
+        f = todo.pop()
+        for t in f.triples((None, None, None)):
+            found.add((f.identifier,) + tuple(map(ident, t)))
+            todo.extend(x for x in t if isinstance(x, QuotedGraph))
+    return found
+
+
+class DataSnapshotTestCase(unittest.TestCase):
+    """
+    The charsheet data graph is snapshotted in the user's cache directory
+    """
+    def setUp(self):
+        self.cache = os.path.abspath(self.mktemp())
+        self.patch(os, 'environ', dict(os.environ, XDG_CACHE_HOME=self.cache))
+        self.data = os.path.abspath(self.mktemp())
+        os.makedirs(self.data)
+        self.files = []
+        self.patch(charsheet, 'dataFiles', lambda: self.files[:])
+
+    def addFile(self, name, n3):
+        path = os.path.join(self.data, name)
+        open(path, 'w').write(n3)
+        self.files.append(path)
+
+    def snapshots(self):
+        return sorted(os.listdir(os.path.join(self.cache, 'playtools')))
+
+    def test_loadDataGraph(self):
+        """
+        The files are parsed once, and then read from a snapshot until the
+        set of files changes, when the old snapshot is replaced
+        """
+        self.addFile('one.n3', RULES)
+        g = charsheet.loadDataGraph()
+        self.failIf(isinstance(g, snapshot.SnapshotGraph))
+        first = self.snapshots()
+        self.assertEqual(len(first), 1)
+
+        g = charsheet.loadDataGraph()
+        self.addCleanup(g.store.close)
+        self.failUnless(isinstance(g, snapshot.SnapshotGraph))
+        self.assertEqual(len(formulaTriples(g)), 3)
+
+        self.addFile('two.n3', "<http://a#b> <http://a#c> <http://a#d> .")
+        g = charsheet.loadDataGraph()
+        self.failIf(isinstance(g, snapshot.SnapshotGraph))
+        self.assertEqual(len(g), 3)
+        second = self.snapshots()
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(second, first)
@@ -3,13 +3,14 @@ Test the database and object mapping abilities of playtools.sparqly
 """
 import os
 import xml
+from cStringIO import StringIO
 from inspect import cleandoc as cd
 
 from twisted.trial import unittest
 from twisted.python.util import sibpath
 
 from rdflib.Namespace import Namespace
-from rdflib import Literal, URIRef, BNode, ConjunctiveGraph
+from rdflib import Literal, URIRef, BNode, ConjunctiveGraph, Variable
 
 from rdfalchemy import rdfSingle, rdfList 
 
@@ -114,6 +115,106 @@ class SparqlyTestCase(unittest.TestCase):
         self.assertEqual(title4, 'Foozam')
         self.assertEqual(title5, 'Foozam Zam')
 
+    def test_bulkLoad(self):
+        """
+        bulkLoad stores the same triples as adding them one at a time, in
+        SQLite-backed and in-memory graphs
+        """
+        boss = BNode()
+        triples = [(STAFF.peter, a, STAFF.Employee),
+                (STAFF.peter, STAFF.firstname, Literal(u"Peter 'the \"Gib\"'")),
+                (STAFF.peter, STAFF.supervisor, boss),
+                (boss, STAFF.age, Literal(40)),
+                (boss, a, STAFF.Employee)]
+
+        path = self.mktemp()
+        os.mkdir(path)
+        bulk = sparqly.sqliteBackedGraph(path, 'bulk.db')
+        count, seconds = sparqly.bulkLoad(bulk, triples, chunkSize=2)
+        self.assertEqual(count, len(triples))
+        slow = sparqly.sqliteBackedGraph(path, 'slow.db')
+        for triple in triples:
+            slow.add(triple)
+        self.assertEqual(sorted(bulk), sorted(slow))
+
+        memory = ConjunctiveGraph()
+        sparqly.bulkLoad(memory, triples)
+        self.assertEqual(sorted(memory), sorted(triples))
+
+    def test_bulkLoadError(self):
+        """
+        When bulkLoad fails, it rolls back its own transaction, but leaves
+        the caller's alone when commit is false
+        """
+        def broken(who):
+            yield (who, a, STAFF.Employee)
+            raise ValueError()
+
+        path = self.mktemp()
+        os.mkdir(path)
+        graph = sparqly.sqliteBackedGraph(path, 'bulk.db')
+        graph.add((STAFF.bob, a, STAFF.Employee))
+        self.assertRaises(ValueError, sparqly.bulkLoad, graph,
+                broken(STAFF.peter), chunkSize=1, commit=False)
+        self.assertEqual(len(graph), 2)
+        graph.commit()
+
+        self.assertRaises(ValueError, sparqly.bulkLoad, graph,
+                broken(STAFF.paul), chunkSize=1)
+        self.assertEqual(sorted(graph.subjects(a, STAFF.Employee)),
+                [STAFF.bob, STAFF.peter])
+
+    def test_queryCache(self):
+        """
+        A query is parsed once per generation, whatever its bindings, and
+        changing the database starts a new generation
+        """
+        db = TestableDatabase()
+        db.addTriple(STAFF.peter, STAFF.firstname, 'Peter')
+        db.addTriple(STAFF.bill, STAFF.firstname, 'Bill')
+        generation = db.generation
+
+        q = 'SELECT ?n { ?e :firstname ?n }'
+        parsed = db.parse(q)
+        self.assertEqual(list(db.query(q, initBindings={
+            Variable('?e'): STAFF.peter})), [(Literal('Peter'),)])
+        self.assertEqual(list(db.query(q, initBindings={
+            Variable('?e'): STAFF.bill})), [(Literal('Bill'),)])
+        self.assertTrue(db.parse(q) is parsed)
+        self.assertEqual(db.generation, generation)
+
+        db.addTriple(STAFF.milton, STAFF.firstname, 'Milton')
+        self.assertEqual(db.generation, generation + 1)
+        self.assertFalse(db.parse(q) is parsed)
+        self.assertEqual(len(list(db.query(q))), 3)
+
+    def test_resultCache(self):
+        """
+        With cacheResults, repeated queries return the remembered results
+        until the database changes
+        """
+        db = TestableDatabase()
+        db.addTriple(STAFF.peter, STAFF.firstname, 'Peter')
+        db.cacheResults(2)
+
+        q = 'SELECT ?n { ?e :firstname ?n }'
+        peter = {Variable('?e'): STAFF.peter}
+        first = db.query(q, initBindings=peter)
+        self.assertTrue(db.query(q, initBindings=peter) is first)
+        self.assertEqual(list(db.query(q, initBindings={
+            Variable('?e'): STAFF.bill})), [])
+        self.assertEqual((db.results.hits, db.results.misses), (1, 2))
+
+        db.addTriple(STAFF.bill, STAFF.firstname, 'Bill')
+        self.assertEqual(len(db.results), 0)
+        self.assertEqual(list(db.query(q, initBindings={
+            Variable('?e'): STAFF.bill})), [(Literal('Bill'),)])
+
+        db.cacheResults(0)
+        self.assertEqual(db.results, None)
+        self.assertFalse(db.query(q, initBindings=peter) is
+                db.query(q, initBindings=peter))
+
 
 class RDFIsInstanceTestCase(unittest.TestCase):
     """
@@ -192,6 +293,89 @@ class RDFIsInstanceTestCase(unittest.TestCase):
                 list(bill.db.predicate_objects(bill.resUri)),
                 "Bill's db graph should no longer contain :peter a :PeoplePerson")
 
+    def test_prefetchTypes(self):
+        """
+        prefetchTypes fetches the types of many objects in one go, and their
+        rdfIsInstance descriptors then need no queries of their own
+        """
+        employees = list(Employee.ClassInstances())
+        db = employees[0].db
+        calls = []
+        def triples(triple):
+            calls.append(triple)
+            return db.__class__.triples(db, triple)
+        def triples_choices(triple):
+            calls.append(triple)
+            return db.__class__.triples_choices(db, triple)
+        db.triples = triples
+        db.triples_choices = triples_choices
+        try:
+            sparqly.prefetchTypes(employees + employees)
+            self.assertEqual(len(calls), 1)
+            flags = [(e.straightShooter, e.peoplePerson) for e in employees]
+            self.assertEqual(len(calls), 1)
+        finally:
+            del db.triples, db.triples_choices
+
+        flags = dict(zip([e.lastname for e in employees], flags))
+        self.assertEqual(flags, {'Gibbons': (True, False),
+            'Lumbergh': (False, True), 'Slydell': (False, False)})
+
+        bill = [e for e in employees if e.lastname == 'Lumbergh'][0]
+        del bill.peoplePerson
+        self.failIf(bill.peoplePerson)
+
+    def test_prefetchTypesError(self):
+        """
+        When prefetchTypes fails, no types are stored, and rdfIsInstance
+        descriptors fetch them for themselves
+        """
+        employees = list(Employee.ClassInstances())
+        db = employees[0].db
+        def triples_choices(triple):
+            raise RuntimeError("the database went away")
+        db.triples_choices = triples_choices
+        try:
+            self.assertRaises(RuntimeError, sparqly.prefetchTypes, employees)
+        finally:
+            del db.triples_choices
+
+        flags = dict((e.lastname, (e.straightShooter, e.peoplePerson))
+                for e in employees)
+        self.assertEqual(flags, {'Gibbons': (True, False),
+            'Lumbergh': (False, True), 'Slydell': (False, False)})
+
+    def test_hydrate(self):
+        """
+        Hydrated objects and the objects they refer to answer from memory, and
+        writes still reach the graph
+        """
+        employees = sparqly.hydrate(Employee.ClassInstances())
+        peter = [e for e in employees if e.lastname == 'Gibbons'][0]
+        graph = peter.db
+        self.assertTrue(isinstance(graph, sparqly.PrefetchedGraph))
+
+        calls = []
+        def triples(triple):
+            calls.append(triple)
+            return graph.graph.__class__.triples(graph.graph, triple)
+        graph.graph.triples = triples
+        try:
+            self.assertEqual(peter.firstname, 'Peter')
+            self.assertTrue(peter.straightShooter)
+            self.assertEqual([s.lastname for s in peter.supervisor],
+                    ['Lumbergh', 'Slydell'])
+            self.assertEqual(list(graph.objects(peter.resUri,
+                STAFF.firstname)), [Literal('Peter')])
+            self.assertEqual(calls, [])
+        finally:
+            del graph.graph.triples
+
+        peter.peoplePerson = True
+        self.assertTrue((peter.resUri, a, STAFF.PeoplePerson) in
+                graph.graph)
+        self.assertTrue((peter.resUri, a, STAFF.PeoplePerson) in graph)
+
 
 class RDFAlchemyClassTestCase(unittest.TestCase):
     def test_autoLabel(self):
@@ -210,6 +394,38 @@ class RDFAlchemyClassTestCase(unittest.TestCase):
         # clean up
         sparqly.initRDFDatabase(oldGraph)
 
+    def test_mapClasses(self):
+        """
+        The classes are mapped once, and again only when an rdfsPTClass is
+        defined or a remap is asked for.  Swapping the database does not walk
+        the classes, and purges the db of those it was set on.
+        """
+        classes = sparqly.mapClasses()
+        self.assertIdentical(sparqly.mapClasses(), classes)
+
+        class Contractor(Employee):
+            rdf_type = STAFF.Contractor
+        self.failUnless(Contractor in sparqly.mapClasses())
+
+        # classes that are not rdfsPTClasses are only found by a remap
+        class Person(sparqly.rdfSubject):
+            rdf_type = STAFF.Person
+        self.failIf(Person in sparqly.mapClasses())
+        self.failUnless(Person in sparqly.mapClasses(force=True))
+
+        def allsub(cls):
+            self.fail("the classes were walked")
+        self.patch(sparqly, 'allsub', allsub)
+        old = sparqly.initRDFDatabase(None)
+        try:
+            Contractor.db = ConjunctiveGraph()
+            self.assertEqual(sparqly._boundDb, set([Contractor]))
+            sparqly.initRDFDatabase(None)
+            self.failIf('db' in Contractor.__dict__)
+            self.assertEqual(sparqly._boundDb, set())
+        finally:
+            sparqly.initRDFDatabase(old)
+
 
 class TriplesDbTestCase(unittest.TestCase, pttestutil.DiffTestCaseMixin):
     def fill(self, graph):
@@ -340,6 +556,37 @@ class TriplesDbTestCase(unittest.TestCase, pttestutil.DiffTestCaseMixin):
                  _\d:supervisor _5:e1001\.""").split('\n')
         self.failIfRxDiff(expected, actual, "expected", "actual")
 
+    def test_dumpTo(self):
+        """
+        dumpTo streams N-Triples or N3 that parse back to the same graph
+        """
+        self.db.graph.bind('staff', STAFF)
+        boss = BNode()
+        self.db.addTriple(STAFF.e1231, STAFF.firstname,
+                Literal(u'Mich\xe6l "Mike"\n\\'))
+        self.db.addTriple(STAFF.e1231, STAFF.nickname,
+                Literal(u'Mikey', lang='en'))
+        self.db.addTriple(STAFF.e1231, STAFF.age, 32)
+        self.db.addTriple(STAFF.e1231, STAFF.supervisor, boss)
+        self.db.addTriple(boss, a, STAFF.Employee)
+
+        for format in ['nt', 'n3']:
+            out = StringIO()
+            self.db.dumpTo(out, format)
+            out.seek(0)
+            comp = IsomorphicTestableGraph()
+            comp.parse(out, format=format)
+            # the prefixes are not part of N-Triples, so compare just the
+            # triples
+            self.assertEqual(len(comp), len(self.db.graph))
+            self.assertEqual(comp.internal_hash(),
+                    self.db.graph.internal_hash())
+
+        out = StringIO()
+        self.db.dumpTo(out, 'nt')
+        self.failUnless(r'"Mich\u00E6l \"Mike\"\n\\" .' in out.getvalue())
+        self.assertRaises(ValueError, self.db.dumpTo, out, 'rdf/xml')
+
     def test_extendGraphFromFile(self):
         """
         extendGraphFromFile should add triples to the db's graph, within the context
@@ -381,3 +628,150 @@ class TriplesDbTestCase(unittest.TestCase, pttestutil.DiffTestCaseMixin):
         self.assertEqual(len(ret), 1)
         self.assertEqual(ret[0][0], Literal('Michael', datatype=URIRef('NULL')))
 
+    def test_describe(self):
+        """
+        A PrefetchedGraph reads the triples about many subjects at once, and
+        answers from them afterwards
+        """
+        graph = ConjunctiveGraph()
+        self.fill(graph)
+        node = BNode()
+        graph.add((URIRef('http://a#x'), URIRef('http://a#z'), node))
+        graph.add((node, URIRef('http://a#y'), Literal(5)))
+        prefetched = sparqly.PrefetchedGraph(graph)
+        calls = []
+        def triples_choices(triple):
+            calls.append(triple)
+            return graph.__class__.triples_choices(graph, triple)
+        graph.triples_choices = triples_choices
+        try:
+            subjects = [URIRef('http://a#x'), URIRef('http://b#xb'),
+                    URIRef('http://a#none')]
+            prefetched.describe(subjects, depth=0, chunkSize=2)
+        finally:
+            del graph.triples_choices
+        # the subjects in two chunks, then the bnode
+        self.assertEqual([len(c[0]) for c in calls], [2, 1, 1])
+        for s in subjects + [node]:
+            self.assertEqual(sorted(prefetched.described[s]),
+                    sorted(graph.triples((s, None, None))))
+        self.assertEqual(list(prefetched.triples((URIRef('http://b#xb'),
+            None, None))), [(URIRef('http://b#xb'), URIRef('http://b#yb'),
+                Literal(2))])
+
+    def test_lazy(self):
+        """
+        A LazyTriplesDatabase opens its graph on first use, once for each
+        thread
+        """
+        import threading
+        newdb = sparqly.LazyTriplesDatabase(None)
+        self.failIf(newdb.isOpen())
+        self.fill(newdb.graph)
+        self.failUnless(newdb.isOpen())
+        ret = list(newdb.query("SELECT ?a { ?a b:yb 2 }"))
+        self.assertEqual(len(ret), 1)
+        self.assertIdentical(newdb.graph, newdb.graph)
+
+        graphs = []
+        t = threading.Thread(target=lambda: graphs.append(newdb.graph))
+        t.start()
+        t.join()
+        self.assertNotIdentical(graphs[0], newdb.graph)
+        self.assertEqual(len(graphs[0]), 0)
+
+    def test_pool(self):
+        """
+        A SQLiteGraphPool gives each thread a reader of its own, and commits
+        writes from any thread through its one writer
+        """
+        import threading
+        path = os.path.abspath(self.mktemp())
+        os.makedirs(path)
+        filename = os.path.join(path, 'pool.db')
+        sparqly.sqliteBackedGraph(path, 'pool.db').close()
+
+        pool = sparqly.SQLiteGraphPool(filename, wal=True)
+        self.addCleanup(pool.close)
+        self.assertIdentical(pool.reader(), pool.reader())
+
+        def write(n):
+            with pool.writer() as graph:
+                graph.add((STAFF['e%s' % (n,)], a, STAFF.Employee))
+
+        def read():
+            graph = pool.reader()
+            found.append((graph, len(list(graph.subjects(a,
+                STAFF.Employee)))))
+
+        write(1)
+        found = []
+        threads = [threading.Thread(target=write, args=(2,))] + [
+                threading.Thread(target=read) for n in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(g for g, n in found)), 3)
+        for g, n in found:
+            self.failUnless(n in (1, 2), n)
+            self.assertIdentical(sparqly.graphSource(g), pool)
+        prefetched = sparqly.PrefetchedGraph(pool.reader())
+        self.assertIdentical(sparqly.graphSource(prefetched), pool)
+        self.assertEqual(len(pool.reader()), 2)
+
+        def fail():
+            with pool.writer() as graph:
+                graph.add((STAFF.e3, a, STAFF.Employee))
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(len(pool.reader()), 2)
+
+        stats = pool.stats()
+        self.assertEqual(stats['writes'], 2)
+        self.assertEqual(stats['wal'], True)
+        t = threading.Thread(target=read)
+        t.start()
+        t.join()
+        self.assertEqual(pool.stats()['readers'], 2)
+
+        # a reader is for the thread that opened it only
+        from pysqlite2.dbapi2 import ProgrammingError
+        errors = []
+        def misuse(graph):
+            try:
+                len(graph)
+            except ProgrammingError, e:
+                errors.append(e)
+        t = threading.Thread(target=misuse, args=(pool.reader(),))
+        t.start()
+        t.join()
+        self.assertEqual(len(errors), 1)
+
+        db = sparqly.LazyTriplesDatabase(filename)
+        self.assertEqual(len(list(db.query(
+            "SELECT ?e { ?e a staff:Employee }",
+            initNs={'staff': STAFF}))), 2)
+        self.assertEqual(db.pool.stats()['readers'], 1)
+
+        # threadGraph is the reader of whichever thread uses it
+        stores = []
+        def readThreadGraph():
+            stores.append((db.threadGraph.store, len(db.threadGraph)))
+        t = threading.Thread(target=readThreadGraph)
+        t.start()
+        t.join()
+        self.assertEqual(stores[0][1], 2)
+        self.assertNotIdentical(stores[0][0], db.graph.store)
+        self.assertIdentical(db.threadGraph.store, db.graph.store)
+        self.assertIdentical(sparqly.graphSource(db.threadGraph), db.pool)
+
+        # as in a forked child: new graphs, from a new pool
+        graph, oldPool = db.graph, db.pool
+        local, forgotten = db.forget()
+        self.assertIdentical(forgotten, oldPool)
+        oldPool.close()
+        self.addCleanup(db.pool.close)
+        self.assertNotIdentical(db.pool, oldPool)
+        self.assertNotIdentical(db.graph, graph)
+        self.assertEqual(len(db.graph), 2)
@@ -1,5 +1,6 @@
 import os
 import re
+import weakref
 from xml.dom import minidom
 
 from twisted.trial import unittest
@@ -167,3 +168,46 @@ class UtilTestCase(unittest.TestCase):
         self.assertEqual([n.getAttribute('id') for n in act1], ['1','2','3'])
         act2 = util.findNodesByAttribute(cn, 'x', '2')
         self.assertEqual([n.getAttribute('id') for n in act2], ['2','3'])
+
+    def test_LRUCache(self):
+        """
+        The LRU cache evicts the least recently used item and counts hits and
+        misses
+        """
+        cache = util.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.failIf('b' in cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache['c'], 3)
+        self.assertRaises(KeyError, lambda: cache['b'])
+        self.assertEqual(len(cache), 2)
+        del cache['a']
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats(), dict(size=1, maxSize=2, hits=3,
+            misses=2))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_afterFork(self):
+        """
+        afterFork makes the objects registered with holdsHandles forget their
+        handles, and keeps what they forgot
+        """
+        class Holder(object):
+            handle = 1
+            def forget(self):
+                old, self.handle = self.handle, None
+                return old
+
+        # only the holder made here, so the handles of the rest of the test
+        # process are left alone
+        self.patch(util, '_handleHolders', weakref.WeakSet())
+        self.patch(util, '_inherited', [])
+        holder = util.holdsHandles(Holder())
+        util.afterFork()
+        self.assertEqual(holder.handle, None)
+        self.assertEqual(util._inherited, [1])
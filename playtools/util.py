@@ -4,11 +4,47 @@ are used in Playtools.
 """
 import os
 import re
+import weakref
 
 from twisted.python.util import sibpath
 
 RESOURCE = lambda f: sibpath(__file__, f)
 
+
+def userCacheDir():
+    """
+    The directory for files Playtools can rebuild whenever they are missing,
+    under $XDG_CACHE_HOME (by default ~/.cache)
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'playtools')
+
+
+# objects holding database handles that must not be used in a forked child
+# process (SQLite forbids carrying a connection across fork), and what they
+# forgot in this process
+_handleHolders = weakref.WeakSet()
+_inherited = []
+
+def holdsHandles(obj):
+    """
+    Have afterFork call obj.forget(), which must drop the database handles
+    obj has opened, and return them
+    """
+    _handleHolders.add(obj)
+    return obj
+
+
+def afterFork():
+    """
+    Call in a child process just forked, before any database is used: every
+    object passed to holdsHandles forgets the handles it inherited, and opens
+    its own when next used.  The inherited handles are kept, not closed,
+    since they still belong to the parent.
+    """
+    for obj in list(_handleHolders):
+        _inherited.append(obj.forget())
+
 def rdfName(s):
     """Return a string suitable for an IRI from s"""
     s = s.replace('.', ' ')
@@ -133,3 +169,95 @@ def attr(node, name, value=None):
         return True
     return node.getAttribute(name) == value
 
+
+class LRUCache(object):
+    """
+    Dictionary-like cache which holds at most maxSize items, discarding the
+    least recently used item to make room for a new one.
+
+    hits and misses count the lookups done through get(), for sizing the
+    cache.  LRUCache does no locking of its own.
+    """
+    _NOTHING = object()
+
+    def __init__(self, maxSize):
+        assert maxSize > 0, "maxSize must be at least 1"
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """
+        Drop every item (but keep the hit and miss counts)
+        """
+        # circular doubly-linked list of [prev, next, key, value], with the
+        # most recently used item just before _root
+        self._items = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        Return the item for key, and mark it most recently used, or return
+        default if it is not cached
+        """
+        link = self._items.get(key, self._NOTHING)
+        if link is self._NOTHING:
+            self.misses = self.misses + 1
+            return default
+        self.hits = self.hits + 1
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def __getitem__(self, key):
+        ret = self.get(key, self._NOTHING)
+        if ret is self._NOTHING:
+            raise KeyError(key)
+        return ret
+
+    def __setitem__(self, key, value):
+        link = self._items.get(key)
+        if link is not None:
+            link[3] = value
+            self._unlink(link)
+            self._append(link)
+            return
+        if len(self._items) >= self.maxSize:
+            oldest = self._root[1]
+            self._unlink(oldest)
+            del self._items[oldest[2]]
+        link = [None, None, key, value]
+        self._items[key] = link
+        self._append(link)
+
+    def __delitem__(self, key):
+        link = self._items.pop(key)
+        self._unlink(link)
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        last[1] = link
+        root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def stats(self):
+        """
+        Return a dict of the size and hit/miss counts of the cache
+        """
+        return dict(size=len(self._items), maxSize=self.maxSize,
+                hits=self.hits, misses=self.misses)